@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger("psychrag")
+
+
+class TokenBucket:
+    """Ведро токенов: пополняется на rate токенов в секунду, вмещает не больше capacity; rate <= 0 - без ограничения"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> float:
+        """Забирает токен и возвращает 0; если токена нет - сколько секунд ждать следующего"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def full_in(self) -> float:
+        """Через сколько секунд ведро наполнится"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return (self.capacity - self.tokens) / self.rate
+
+
+class _Chat:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.texts = []
+        self.contexts = []
+        # Время прихода каждого сообщения (time.monotonic)
+        self.received = []
+        self.first_at = None
+        self.last_at = None
+        self.timer = None
+        self.running = False
+
+
+class ChatAdmission:
+    """
+    Допуск сообщений чатов к модели.
+
+    Сообщения чата, пришедшие с паузами меньше window секунд, склеиваются в один вопрос (первое
+    ждёт не дольше max_wait). Пока готовится ответ на вопрос чата, новые сообщения копятся и уходят
+    следующим вопросом, так что у чата не больше одного вопроса в работе. Вопросы чата ограничены
+    ведром токенов (rate в секунду, до burst подряд): без токена сообщения продолжают склеиваться,
+    пока токен не появится. Всего одновременно обрабатывается не больше max_in_flight вопросов;
+    сверх этого вопрос не ждёт в очереди, а сразу отклоняется через reject.
+
+    Args:
+        handle: async handle(chat_id, text, contexts) - ответ на вопрос; contexts - объекты
+            склеенных сообщений (например, aiogram Message) в порядке прихода
+        reject: async reject(chat_id, text, contexts) - ответ на отклонённый вопрос
+        window: Пауза в секундах, после которой сообщения чата отправляются вопросом
+        max_wait: Максимальное ожидание первого сообщения вопроса в секундах
+        rate: Вопросов чата в секунду в среднем, 0 - без ограничения
+        burst: Вопросов чата подряд без ожидания
+        max_in_flight: Максимум одновременно обрабатываемых вопросов всех чатов
+        observe_wait: observe_wait(seconds) вызывается для каждого сообщения вопроса перед handle -
+            сколько сообщение ждало с прихода в submit (склеивание, ожидание токена чата)
+    """
+
+    def __init__(
+            self,
+            handle: Callable[[Any, str, List[Any]], Awaitable],
+            reject: Callable[[Any, str, List[Any]], Awaitable],
+            window: float = 1.5,
+            max_wait: float = 6.0,
+            rate: float = 0.1,
+            burst: int = 3,
+            max_in_flight: int = 32,
+            observe_wait: Optional[Callable[[float], Any]] = None
+    ):
+        self.handle = handle
+        self.reject = reject
+        self.window = window
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.observe_wait = observe_wait
+        self._chats = {}
+        self._tasks = set()
+        self.in_flight = 0
+        self.messages = 0
+        self.questions = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def submit(self, chat_id, text: str, context=None):
+        """Принимает сообщение чата (вызывается из event loop, не ждёт ответа)"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.rate, self.burst))
+        now = time.monotonic()
+        if chat.first_at is None:
+            chat.first_at = now
+        chat.last_at = now
+        chat.texts.append(text)
+        chat.contexts.append(context)
+        chat.received.append(now)
+        self.messages += 1
+        if not chat.running:
+            self._schedule(chat_id, chat, self._delay(chat))
+
+    def _delay(self, chat: _Chat) -> float:
+        deadline = min(chat.last_at + self.window, chat.first_at + self.max_wait)
+        return max(0.0, deadline - time.monotonic())
+
+    def _schedule(self, chat_id, chat: _Chat, delay: float):
+        if chat.timer is not None:
+            chat.timer.cancel()
+        chat.timer = asyncio.get_running_loop().call_later(delay, self._flush, chat_id, chat)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        # Ссылка на задачу, чтобы её не собрал сборщик мусора до завершения
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _flush(self, chat_id, chat: _Chat):
+        chat.timer = None
+        if chat.running or not chat.texts:
+            return
+        wait = chat.bucket.take()
+        if wait > 0:
+            # Вопросов слишком много - ждём токен, продолжая склеивать сообщения
+            self.throttled += 1
+            self._schedule(chat_id, chat, max(wait, self._delay(chat)))
+            return
+
+        text, contexts, received = "\n".join(chat.texts), chat.contexts, chat.received
+        chat.texts, chat.contexts, chat.received, chat.first_at, chat.last_at = [], [], [], None, None
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            chat.bucket.give_back()
+            self._spawn(self._call(self.reject, chat_id, text, contexts))
+            self._forget_later(chat_id, chat)
+            return
+
+        chat.running = True
+        self.in_flight += 1
+        self.questions += 1
+        self._spawn(self._run(chat_id, chat, text, contexts, received))
+
+    async def _call(self, fn, chat_id, text: str, contexts):
+        try:
+            await fn(chat_id, text, contexts)
+        except Exception:
+            logger.exception("Ошибка обработки сообщения чата %s", chat_id)
+
+    async def _run(self, chat_id, chat: _Chat, text: str, contexts, received: List[float]):
+        try:
+            if self.observe_wait is not None:
+                started = time.monotonic()
+                for at in received:
+                    self.observe_wait(started - at)
+            await self._call(self.handle, chat_id, text, contexts)
+        finally:
+            self.in_flight -= 1
+            chat.running = False
+            if chat.texts:
+                self._schedule(chat_id, chat, self._delay(chat))
+            else:
+                self._forget_later(chat_id, chat)
+
+    def _forget_later(self, chat_id, chat: _Chat):
+        """Состояние молчащего чата удаляется, когда его ведро снова полное"""
+        asyncio.get_running_loop().call_later(chat.bucket.full_in() + self.window, self._forget, chat_id, chat)
+
+    def _forget(self, chat_id, chat: _Chat):
+        if (self._chats.get(chat_id) is chat and not chat.running and not chat.texts
+                and chat.bucket.full_in() <= 0):
+            del self._chats[chat_id]
+
+    def metrics(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "in_flight": self.in_flight,
+            "messages": self.messages,
+            "questions": self.questions,
+            "messages_per_question": self.messages / self.questions if self.questions else 0.0,
+            "rejected": self.rejected,
+            "throttled": self.throttled
+        }
@@ -0,0 +1,126 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Кэш ответов по смыслу вопроса.
+
+    Хранит нормированный эмбеддинг вопроса, id найденных фрагментов и ответ модели.
+    Вопрос считается повтором, если косинусная близость с сохранённым не меньше threshold.
+    Записи живут ttl секунд, при переполнении вытесняется самая давняя по использованию.
+    После изменения индекса ответы, ссылающиеся на удалённые или заменённые фрагменты,
+    удаляются через invalidate().
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl: Optional[float] = 3600, max_size: int = 1024):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._miss_latency = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float):
+        if self.ttl is None:
+            return
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _vectors(self):
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[key]["vector"] for key in self._keys]) \
+                if self._keys else None
+        return self._matrix
+
+    def lookup(self, vector) -> Optional[dict]:
+        """Возвращает копию сохранённого ответа на похожий вопрос или None"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire(time.monotonic())
+            matrix = self._vectors()
+            if matrix is not None:
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self._keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if self._miss_latency is not None:
+                        self.saved_seconds += self._miss_latency
+                    return copy.deepcopy(self._entries[key]["response"])
+            self.misses += 1
+            return None
+
+    def store(self, vector, chunk_ids: List[str], response: dict, latency: float):
+        """Сохраняет ответ, полученный от LLM за latency секунд"""
+        with self._lock:
+            # Скользящее среднее времени ответа LLM - оценка сэкономленного времени на попадание
+            self._miss_latency = latency if self._miss_latency is None \
+                else 0.9 * self._miss_latency + 0.1 * latency
+
+            self._entries[self._next_key] = {
+                "vector": self._normalize(vector),
+                "chunk_ids": list(chunk_ids),
+                "response": copy.deepcopy(response),
+                "created": time.monotonic()
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self, chunk_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Удаляет ответы, опирающиеся на фрагменты chunk_ids (None - все ответы).
+        Возвращает число удалённых записей
+        """
+        with self._lock:
+            if chunk_ids is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = set(chunk_ids)
+                keys = [key for key, entry in self._entries.items() if stale.intersection(entry["chunk_ids"])]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            if removed:
+                self._matrix = None
+            return removed
+
+    def metrics(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "size": len(self._entries)
+            }
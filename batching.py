@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from concurrent.futures import Executor
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """
+    Объединяет запросы, пришедшие почти одновременно, в один пакет.
+
+    Первый запрос в пустой очереди запускает таймер на max_wait секунд; по таймеру или при
+    накоплении max_batch запросов пакет целиком отдаётся в process(items) -> results в пуле потоков.
+    Каждый вызывающий получает свой результат по порядку. Пакеты обрабатываются параллельно,
+    насколько позволяет executor. Исключение в process() получают все запросы пакета.
+    """
+
+    def __init__(
+            self,
+            process: Callable[[List[Any]], List[Any]],
+            executor: Executor,
+            max_batch: int = 32,
+            max_wait: float = 0.003
+    ):
+        self.process = process
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            # Ссылка на задачу, чтобы её не собрал сборщик мусора до завершения
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.process, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # Вызывающий мог быть отменён, пока пакет обрабатывался
+            if not future.done():
+                future.set_result(result)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.largest
+            }
@@ -1,17 +1,43 @@
+import asyncio
+import json
+import logging
 import os
+import time
 
 from aiogram import Bot, Dispatcher, types, Router
 from aiogram import F
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from dotenv import load_dotenv
 
+from admission import ChatAdmission
 from model import PsychologistRAG
+from tracing import Metrics, start_metrics_server
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Порт для /metrics в формате Prometheus; если не задан, метрики не собираются
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Потоковая выдача ответа: сообщение отправляется по первым токенам и дописывается редактированием
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") != "0"
+# Минимальный интервал между редактированиями одного сообщения (у Telegram лимиты на частоту правок)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Сообщения чата с паузами меньше ADMISSION_WINDOW секунд склеиваются в один вопрос
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "1.5"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "6"))
+# Вопросов одного чата в минуту в среднем (0 - без ограничения) и подряд без ожидания
+ADMISSION_RATE_PER_MIN = float(os.getenv("ADMISSION_RATE_PER_MIN", "6"))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "3"))
+# Сверх стольких одновременно обрабатываемых вопросов бот просит подождать
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+
+BUSY_TEXT = (
+    "Сейчас мне пишет очень много людей, и я не успеваю ответить вам так, как вы заслуживаете. 🤍\n"
+    "Пожалуйста, напишите ещё раз через пару минут."
+)
 
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 storage = MemoryStorage()
@@ -20,7 +46,20 @@ dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
 
-psychologist = PsychologistRAG("./faiss_index")
+metrics = Metrics(enabled=bool(METRICS_PORT))
+
+psychologist = PsychologistRAG(
+    "./faiss_index",
+    metrics=metrics,
+    max_concurrency=int(os.getenv("RAG_MAX_CONCURRENCY", "8")),
+    retrieval_workers=int(os.getenv("RAG_RETRIEVAL_WORKERS", "2")),
+    batch_window=float(os.getenv("RAG_BATCH_WINDOW_MS", "3")) / 1000,
+    retrieval_processes=int(os.getenv("RAG_RETRIEVAL_PROCESSES", "0")),
+    llm_deadline=float(os.getenv("RAG_LLM_DEADLINE", "20")),
+    hedge_percentile=float(os.environ["RAG_HEDGE_PERCENTILE"]) if os.getenv("RAG_HEDGE_PERCENTILE") else None,
+    extractive_overload=int(os.getenv("RAG_EXTRACTIVE_OVERLOAD", "0")),
+    lazy=True
+)
 
 
 @router.message(CommandStart())
@@ -58,31 +97,95 @@ async def start_dialog(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.message()
+@router.message(F.text)
 async def handle_msg(message: types.Message):
-    user_q = message.text
+    admission.submit(message.chat.id, message.text, message)
+
 
+async def answer_question(chat_id, user_q: str, messages):
+    """Ответ на склеенные сообщения чата, reply на последнее из них"""
+    message = messages[-1]
+    metrics.observe("bot_messages_per_question", len(messages), buckets=(1, 2, 3, 5, 10))
     await message.bot.send_chat_action(
-        chat_id=message.chat.id,
+        chat_id=chat_id,
         action=ChatAction.TYPING
     )
 
-    result = psychologist.ask(user_q)
+    if STREAM_ANSWERS:
+        await stream_answer(message, user_q)
+        return
+
+    result = await psychologist.aask(user_q, session_id=chat_id)
+    await message.answer(format_answer(result), parse_mode="Markdown")
+
+
+async def answer_busy(chat_id, user_q: str, messages):
+    metrics.inc("bot_busy_replies_total")
+    await messages[-1].answer(BUSY_TEXT)
 
-    answer = (
+
+admission = ChatAdmission(
+    answer_question,
+    answer_busy,
+    window=ADMISSION_WINDOW,
+    max_wait=ADMISSION_MAX_WAIT,
+    rate=ADMISSION_RATE_PER_MIN / 60,
+    burst=ADMISSION_BURST,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    # Сколько сообщение ждало от получения ботом до начала ответа: склеивание и лимит вопросов чата
+    observe_wait=lambda seconds: metrics.observe("bot_message_wait_seconds", seconds)
+)
+metrics.register_collector("admission", admission.metrics)
+
+
+def format_answer(result: dict) -> str:
+    return (
         f"*{result['title']}*\n\n"
         f"{result['solution']}\n\n"
         f"Источник: {result['link']}"
     )
 
-    await message.answer(answer, parse_mode="Markdown")
+
+async def stream_answer(message: types.Message, user_q: str):
+    """
+    Отправляет ответ по мере генерации: первое сообщение - как только появился текст,
+    дальше правки не чаще STREAM_EDIT_INTERVAL. Промежуточный текст без разметки,
+    чтобы незакрытые символы Markdown не ломали отправку; итоговый - в обычном формате.
+    """
+    sent = None
+    shown = ""
+    last_edit = 0.0
+    result = None
+    async for result in psychologist.astream(user_q, session_id=message.chat.id):
+        text = "\n\n".join(part for part in (result.get("title"), result.get("solution")) if part)
+        if not text or text == shown or time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            continue
+        if sent is None:
+            sent = await message.answer(text)
+        else:
+            await sent.edit_text(text)
+        shown = text
+        last_edit = time.monotonic()
+
+    if sent is None:
+        await message.answer(format_answer(result), parse_mode="Markdown")
+        return
+    try:
+        await sent.edit_text(format_answer(result), parse_mode="Markdown")
+    except TelegramBadRequest:
+        # Итоговый текст совпал с показанным или не разобрался как Markdown
+        await sent.edit_text(format_answer(result).replace("*", ""))
 
 
 async def main():
+    if METRICS_PORT:
+        logging.basicConfig(level=logging.INFO)
+        start_metrics_server(metrics, int(METRICS_PORT))
+    # Индекс и энкодер загружаются до начала опроса, а не на первом сообщении пользователя
+    timings = await asyncio.get_running_loop().run_in_executor(None, psychologist.warmup)
+    print("Прогрев:", json.dumps(timings, ensure_ascii=False))
     await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
-    import asyncio
-
     asyncio.run(main())
@@ -0,0 +1,221 @@
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from index_factory import IndexSpec
+
+INDEX_NAME = "index.faiss"
+CHUNKS_DIR = "chunks"
+SCHEMA_NAME = "schema.json"
+
+# Колонки метаданных статьи с небольшим числом различных значений хранятся как коды + словарь
+DICTIONARY_COLUMNS = ("category",)
+
+
+def _write_strings(folder: str, name: str, values: List[str]):
+    """Строки одним UTF-8 блобом и массивом смещений длины len(values) + 1"""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(folder, f"{name}.bin"), "wb") as f:
+        for b in encoded:
+            f.write(b)
+    np.save(os.path.join(folder, f"{name}.offsets.npy"), offsets)
+
+
+class _StringColumn:
+    """Строковая колонка поверх memmap: строка декодируется только при обращении"""
+
+    def __init__(self, folder: str, name: str):
+        self.offsets = np.load(os.path.join(folder, f"{name}.offsets.npy"), mmap_mode="r")
+        path = os.path.join(folder, f"{name}.bin")
+        # Пустой файл отобразить нельзя
+        self.blob = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+def save_chunks(db: FAISS, folder_path: str):
+    """
+    Сохраняет фрагменты store в колоночном формате без pickle.
+
+    Порядок строк совпадает с номерами векторов в FAISS индексе. Метаданные одинаковы у всех
+    фрагментов статьи, поэтому хранятся один раз на статью, а фрагмент ссылается на номер статьи.
+    """
+    folder = os.path.join(folder_path, CHUNKS_DIR)
+    os.makedirs(folder, exist_ok=True)
+
+    ids, texts, chunk_article = [], [], []
+    articles = {}
+    for row in range(db.index.ntotal):
+        doc_id = db.index_to_docstore_id[row]
+        doc = db.docstore.search(doc_id)
+        key = json.dumps(doc.metadata, ensure_ascii=False, sort_keys=True)
+        ids.append(doc_id)
+        texts.append(doc.page_content)
+        chunk_article.append(articles.setdefault(key, len(articles)))
+
+    _write_strings(folder, "text", texts)
+    _write_strings(folder, "id", ids)
+    # Отсортированный порядок id для поиска строки по id бинарным поиском
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    np.save(os.path.join(folder, "id.order.npy"), np.array(order, dtype=np.int64))
+    np.save(os.path.join(folder, "article.npy"), np.array(chunk_article, dtype=np.int32))
+
+    rows = [json.loads(key) for key in articles]
+    columns = {}
+    for name in sorted({name for meta in rows for name in meta}):
+        values = [meta.get(name) for meta in rows]
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            np.save(os.path.join(folder, f"meta.{name}.npy"), np.array(values, dtype=np.int64))
+            columns[name] = {"type": "int"}
+        elif name in DICTIONARY_COLUMNS:
+            vocab = sorted({str(v) for v in values if v is not None})
+            codes = {v: i for i, v in enumerate(vocab)}
+            np.save(
+                os.path.join(folder, f"meta.{name}.npy"),
+                np.array([codes[str(v)] if v is not None else -1 for v in values], dtype=np.int32)
+            )
+            columns[name] = {"type": "dict", "values": vocab}
+        else:
+            _write_strings(folder, f"meta.{name}", ["" if v is None else str(v) for v in values])
+            columns[name] = {"type": "str"}
+
+    with open(os.path.join(folder, SCHEMA_NAME), "w", encoding="utf-8") as f:
+        json.dump({"chunks": len(ids), "articles": len(rows), "columns": columns}, f, ensure_ascii=False)
+
+
+class ChunkStore(Docstore):
+    """
+    Docstore только для чтения поверх файлов save_chunks().
+
+    Все массивы отображены в память, поэтому загрузка занимает миллисекунды, а несколько процессов
+    делят одни и те же страницы. Document собирается при обращении; для изменения индекса
+    store нужно сначала перевести в память через materialize().
+    """
+
+    def __init__(self, folder_path: str):
+        folder = os.path.join(folder_path, CHUNKS_DIR)
+        with open(os.path.join(folder, SCHEMA_NAME), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+
+        self.texts = _StringColumn(folder, "text")
+        self.ids = _StringColumn(folder, "id")
+        self.id_order = np.load(os.path.join(folder, "id.order.npy"), mmap_mode="r")
+        self.chunk_article = np.load(os.path.join(folder, "article.npy"), mmap_mode="r")
+
+        self.columns = {}
+        for name, column in schema["columns"].items():
+            if column["type"] == "str":
+                self.columns[name] = (column, _StringColumn(folder, f"meta.{name}"))
+            else:
+                self.columns[name] = (column, np.load(os.path.join(folder, f"meta.{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def row(self, doc_id: str) -> Optional[int]:
+        """Номер строки по id фрагмента (бинарный поиск по отсортированному порядку)"""
+        lo, hi = 0, len(self.id_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ids[int(self.id_order[mid])] < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.id_order):
+            row = int(self.id_order[lo])
+            if self.ids[row] == doc_id:
+                return row
+        return None
+
+    def metadata(self, row: int) -> dict:
+        article = int(self.chunk_article[row])
+        result = {}
+        for name, (column, values) in self.columns.items():
+            if column["type"] == "int":
+                result[name] = int(values[article])
+            elif column["type"] == "dict":
+                code = int(values[article])
+                result[name] = column["values"][code] if code >= 0 else None
+            else:
+                result[name] = values[article]
+        return result
+
+    def document(self, row: int) -> Document:
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=self.metadata(row))
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise NotImplementedError("ChunkStore только для чтения, вызовите materialize()")
+
+    def delete(self, ids: List) -> None:
+        raise NotImplementedError("ChunkStore только для чтения, вызовите materialize()")
+
+
+class RowIds(Mapping):
+    """Номер вектора FAISS -> id фрагмента, без словаря на каждый фрагмент"""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, row: int) -> str:
+        if not 0 <= row < len(self.store):
+            raise KeyError(row)
+        return self.store.ids[row]
+
+    def __iter__(self):
+        return iter(range(len(self.store)))
+
+    def __len__(self):
+        return len(self.store)
+
+
+def has_chunks(folder_path: str) -> bool:
+    return os.path.exists(os.path.join(folder_path, CHUNKS_DIR, SCHEMA_NAME))
+
+
+def save_store(db: FAISS, folder_path: str):
+    """FAISS индекс и фрагменты в формате ChunkStore (вместо index.pkl)"""
+    os.makedirs(folder_path, exist_ok=True)
+    faiss.write_index(db.index, os.path.join(folder_path, INDEX_NAME))
+    save_chunks(db, folder_path)
+
+
+def load_store(folder_path: str, embeddings, spec: IndexSpec) -> FAISS:
+    """Индекс через mmap и ChunkStore. Данные не копируются в память процесса"""
+    index = faiss.read_index(os.path.join(folder_path, INDEX_NAME), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    store = ChunkStore(folder_path)
+    if index.ntotal != len(store):
+        raise ValueError(f"Индекс содержит {index.ntotal} векторов, а хранилище фрагментов - {len(store)}")
+    return FAISS(embeddings, index, store, RowIds(store), distance_strategy=spec.distance_strategy)
+
+
+def materialize(db: FAISS):
+    """
+    Переводит store, загруженный через load_store(), в обычный изменяемый вид:
+    индекс копируется в память, фрагменты - в InMemoryDocstore.
+    """
+    if not isinstance(db.docstore, ChunkStore):
+        return
+    store = db.docstore
+    db.index = faiss.deserialize_index(faiss.serialize_index(db.index))
+    db.docstore = InMemoryDocstore({store.ids[row]: store.document(row) for row in range(len(store))})
+    db.index_to_docstore_id = {row: store.ids[row] for row in range(len(store))}
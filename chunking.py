@@ -0,0 +1,225 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from context import split_sentences
+
+_MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s+")
+_LIST_ITEM_RE = re.compile(r"^(?:[*\-•–]|\d{1,2}[.)])\s+")
+# Так заканчиваются предложения и пункты; строки без этих знаков - кандидаты в заголовки
+_TERMINAL = (".", "!", "?", "…", ":", ";", ",", "»", ")", "\"")
+
+MAX_HEADING_CHARS = 100
+
+# Научные работы длиннее статей и состоят из длинных абзацев - им достаются фрагменты крупнее
+CATEGORY_SCALE = {"paper": 1.5}
+
+
+def chunk_id(article_id, chunk_no: int) -> str:
+    return f"{article_id}:{chunk_no}"
+
+
+def _join_wrapped(text: str) -> List[str]:
+    """
+    Строки текста без переносов внутри абзаца: строка, за которой идёт строка со строчной буквы,
+    продолжается ею (жёсткие переносы в работах из PDF), если это не пункты списка со строчной буквы
+    ("симптомы:\nтоска;\nапатия."). Пустые строки отбрасываются.
+    """
+    lines = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        list_item = lines and (lines[-1].endswith(";") or (lines[-1].endswith(":") and line.endswith(";")))
+        if lines and line[:1].islower() and not list_item and not _LIST_ITEM_RE.match(line):
+            previous = lines[-1]
+            lines[-1] = previous[:-1] + line if previous.endswith("-") else f"{previous} {line}"
+        else:
+            lines.append(line)
+    return lines
+
+
+def _kind(line: str, in_list: bool) -> str:
+    if _MARKDOWN_HEADING_RE.match(line):
+        return "heading"
+    if _LIST_ITEM_RE.match(line) or line.endswith(";") or (in_list and len(line) <= MAX_HEADING_CHARS):
+        return "list"
+    if len(line) <= MAX_HEADING_CHARS and (not line.endswith(_TERMINAL) or line.endswith("?")):
+        return "heading"
+    return "text"
+
+
+def parse_blocks(text: str) -> List[Tuple[str, str]]:
+    """
+    Структура текста html2text: список (вид, текст), вид - heading, list или text.
+
+    Заголовок - markdown-заголовок или короткая строка без точки в конце (или вопрос).
+    Пункты списка (маркер, нумерация или ';' в конце) объединяются в один блок вместе
+    с вводной строкой, оканчивающейся двоеточием.
+    """
+    blocks = []
+    for line in _join_wrapped(text):
+        in_list = bool(blocks) and blocks[-1][0] == "list" and blocks[-1][1].endswith(";")
+        kind = _kind(line, in_list)
+        if kind == "heading":
+            line = _MARKDOWN_HEADING_RE.sub("", line)
+        if blocks and kind == blocks[-1][0] and kind in ("heading", "list"):
+            blocks[-1] = (kind, f"{blocks[-1][1]}\n{line}")
+        elif kind == "list" and blocks and blocks[-1][0] == "text" and blocks[-1][1].endswith(":"):
+            blocks[-1] = (kind, f"{blocks[-1][1]}\n{line}")
+        else:
+            blocks.append((kind, line))
+    return blocks
+
+
+class ChunkPolicy:
+    """
+    Параметры разбиения статей одной категории.
+
+    structured=False - RecursiveCharacterTextSplitter по всему тексту (прежнее разбиение).
+    structured=True - фрагменты не пересекают границы разделов, абзацы и списки по возможности
+    не разрезаются, заголовок раздела повторяется в начале каждого его фрагмента. Разделы короче
+    min_size склеиваются со следующими. Перекрытие - последние предложения предыдущего фрагмента
+    раздела, не длиннее chunk_overlap символов.
+    """
+
+    def __init__(
+            self,
+            chunk_size: int = 1024,
+            chunk_overlap: int = 128,
+            structured: bool = True,
+            min_size: Optional[int] = None
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.structured = structured
+        self.min_size = chunk_size // 4 if min_size is None else min_size
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "ChunkPolicy":
+        return cls(**(data or {}))
+
+
+class Chunker:
+    """
+    Разбиение статей на фрагменты с политикой по категории статьи (categories) или default.
+    Фрагменты получают детерминированные id вида '<id статьи>:<номер>' и метаданные статьи.
+    Объект сериализуем, поэтому статьи можно разбивать в пуле процессов.
+    """
+
+    def __init__(self, default: Optional[ChunkPolicy] = None, categories: Optional[Dict[str, ChunkPolicy]] = None):
+        self.default = default or ChunkPolicy()
+        self.categories = categories or {}
+
+    def policy(self, category) -> ChunkPolicy:
+        return self.categories.get(category, self.default)
+
+    def to_dict(self) -> dict:
+        return {
+            "default": self.default.to_dict(),
+            "categories": {name: policy.to_dict() for name, policy in self.categories.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "Chunker":
+        data = data or {}
+        return cls(
+            ChunkPolicy.from_dict(data.get("default")),
+            {name: ChunkPolicy.from_dict(policy) for name, policy in data.get("categories", {}).items()}
+        )
+
+    def split(self, row: dict) -> List[Document]:
+        policy = self.policy(row.get("category"))
+        metadata = {key: value for key, value in row.items() if key != "text"}
+        if policy.structured:
+            texts = self._split_structured(row["text"], policy)
+        else:
+            splitter = RecursiveCharacterTextSplitter(chunk_size=policy.chunk_size, chunk_overlap=policy.chunk_overlap)
+            texts = splitter.split_text(row["text"])
+        return [
+            Document(page_content=text, metadata=dict(metadata), id=chunk_id(row["id"], i))
+            for i, text in enumerate(texts)
+        ]
+
+    def _sections(self, text: str, policy: ChunkPolicy) -> List[Tuple[str, List[str]]]:
+        """Разделы (заголовок, блоки); короткий раздел поглощает следующий, его заголовок становится блоком"""
+        sections = []
+        for kind, block in parse_blocks(text):
+            if kind == "heading":
+                current = sections[-1] if sections else None
+                if current is None or sum(len(b) for b in current[1]) >= policy.min_size:
+                    sections.append((block, []))
+                    continue
+                if not current[1]:
+                    # Подряд идущие заголовки (например, заголовок и подпись к фото)
+                    sections[-1] = (f"{current[0]}\n{block}" if current[0] else block, [])
+                    continue
+            if not sections:
+                sections.append(("", []))
+            sections[-1][1].append(block)
+        return sections
+
+    def _split_structured(self, text: str, policy: ChunkPolicy) -> List[str]:
+        chunks = []
+        for heading, blocks in self._sections(text, policy):
+            if not blocks:
+                # Заголовок без текста в конце статьи
+                continue
+            if len(heading) > MAX_HEADING_CHARS:
+                # Много коротких строк подряд (оглавление, подписи): в начало фрагментов - только последняя
+                blocks = [heading] + blocks
+                heading = heading.rsplit("\n", 1)[-1][:MAX_HEADING_CHARS]
+            prefix = f"{heading}\n" if heading else ""
+            budget = max(policy.chunk_size - len(prefix), policy.chunk_size // 2)
+            splitter = RecursiveCharacterTextSplitter(chunk_size=budget, chunk_overlap=policy.chunk_overlap)
+            pieces = [piece for block in blocks
+                      for piece in (splitter.split_text(block) if len(block) > budget else [block])]
+
+            current, carried = [], 0
+            for piece in pieces:
+                if len(current) > carried and sum(len(p) + 1 for p in current) + len(piece) > budget:
+                    chunks.append(prefix + "\n".join(current))
+                    current = self._overlap(current[-1], policy.chunk_overlap)
+                    carried = len(current)
+                current.append(piece)
+            if len(current) > carried:
+                chunks.append(prefix + "\n".join(current))
+        return chunks
+
+    @staticmethod
+    def _overlap(piece: str, max_chars: int) -> List[str]:
+        """Последние предложения отрывка, суммарно не длиннее max_chars"""
+        tail = []
+        used = 0
+        for sentence in reversed(split_sentences(piece)):
+            if used + len(sentence) > max_chars:
+                break
+            tail.insert(0, sentence)
+            used += len(sentence) + 1
+        return [" ".join(tail)] if tail else []
+
+
+def default_chunker(chunk_size: int = 1024, chunk_overlap: int = 128) -> Chunker:
+    """Разбиение по структуре с размерами chunk_size/chunk_overlap и крупнее для категорий из CATEGORY_SCALE"""
+    return Chunker(
+        ChunkPolicy(chunk_size, chunk_overlap),
+        {
+            category: ChunkPolicy(int(chunk_size * scale), int(chunk_overlap * scale))
+            for category, scale in CATEGORY_SCALE.items()
+        }
+    )
+
+
+# Наборы политик для сравнения в eval/bench_chunking.py
+PRESETS = {
+    "recursive": lambda: Chunker(ChunkPolicy(1024, 128, structured=False)),
+    "recursive_512": lambda: Chunker(ChunkPolicy(512, 64, structured=False)),
+    "structured": lambda: default_chunker(1024, 128),
+    "structured_768": lambda: default_chunker(768, 96),
+    "structured_512": lambda: default_chunker(512, 64)
+}
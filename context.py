@@ -0,0 +1,168 @@
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import List, Tuple
+
+from sessions import estimate_tokens
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_WORD_RE = re.compile(r"\w+")
+_TURN_RE = re.compile(r"(?m)^(?=Human: )")
+
+# Слова короче не участвуют в ранжировании (предлоги, союзы)
+MIN_WORD_LEN = 3
+# Грубый стемминг для русского: сравниваются только начала слов
+STEM_LEN = 5
+
+
+def _stems(text: str) -> set:
+    return {w[:STEM_LEN] for w in _WORD_RE.findall(text.lower()) if len(w) >= MIN_WORD_LEN}
+
+
+def _chunk_no(doc) -> int:
+    """Номер фрагмента в статье из id вида '<id статьи>:<номер>'"""
+    try:
+        return int(str(doc.id).rsplit(":", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def merge_overlap(left: str, right: str, min_overlap: int = 16) -> str:
+    """
+    Склеивает соседние фрагменты статьи без повтора перекрытия (chunk_overlap сплиттера).
+    Если перекрытия нет (сплиттер разрезал по границе абзаца), текст просто продолжается.
+    """
+    probe = right[:min_overlap]
+    if len(probe) == min_overlap:
+        start = left.find(probe, max(0, len(left) - len(right)))
+        while start != -1:
+            if right.startswith(left[start:]):
+                return left[:start] + right
+            start = left.find(probe, start + 1)
+    return f"{left} {right}"
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+class ContextBudgeter:
+    """
+    Сборка контекста для промпта.
+
+    Фрагменты одной статьи объединяются в один отрывок (с удалением перекрытий), почти одинаковые
+    предложения удаляются. Если контекст вместе с историей не укладывается в max_tokens,
+    остаются предложения, наиболее близкие к вопросу (пересечение основ слов с весами IDF),
+    в исходном порядке. История получает не больше history_share бюджета, старые реплики отбрасываются.
+    """
+
+    def __init__(self, max_tokens: int = 1024, history_share: float = 0.5, duplicate_threshold: float = 0.8):
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.duplicate_threshold = duplicate_threshold
+
+    def passages(self, docs) -> List[Tuple[dict, str]]:
+        """Отрывки по статьям в порядке первого появления статьи в выдаче"""
+        by_article = OrderedDict()
+        for doc in docs:
+            key = doc.metadata.get("id", doc.id)
+            by_article.setdefault(key, []).append(doc)
+
+        result = []
+        for chunks in by_article.values():
+            chunks.sort(key=_chunk_no)
+            text = chunks[0].page_content
+            for prev, chunk in zip(chunks, chunks[1:]):
+                if _chunk_no(chunk) == _chunk_no(prev) + 1:
+                    text = merge_overlap(text, chunk.page_content)
+                else:
+                    text = f"{text} {chunk.page_content}"
+            result.append((chunks[0].metadata, text))
+        return result
+
+    def trim_history(self, history: str, budget: int) -> str:
+        """Последние реплики диалога, укладывающиеся в budget токенов"""
+        turns = [t.strip("\n") for t in _TURN_RE.split(history) if t.strip()]
+        kept, used = [], 0
+        for turn in reversed(turns):
+            size = estimate_tokens(turn)
+            if used + size > budget:
+                break
+            kept.append(turn)
+            used += size
+        return "\n".join(reversed(kept))
+
+    def _dedupe(self, passages) -> List[List[Tuple[str, set]]]:
+        seen = []
+        result = []
+        for _, text in passages:
+            sentences = []
+            for sentence in split_sentences(text):
+                stems = _stems(sentence)
+                duplicate = any(
+                    stems and len(stems & other) / len(stems | other) >= self.duplicate_threshold
+                    for other in seen
+                )
+                if not duplicate:
+                    sentences.append((sentence, stems))
+                    seen.append(stems)
+            result.append(sentences)
+        return result
+
+    def _select(self, question: str, passages: List[List[Tuple[str, set]]], budget: int) -> List[List[str]]:
+        """Лучшие по близости к вопросу предложения в пределах budget токенов, в исходном порядке"""
+        all_sentences = [(i, j, s, stems) for i, p in enumerate(passages) for j, (s, stems) in enumerate(p)]
+        document_freq = Counter(stem for *_, stems in all_sentences for stem in stems)
+        n = len(all_sentences)
+        query = _stems(question)
+
+        def score(item):
+            i, j, _, stems = item
+            overlap = sum(math.log(1 + n / document_freq[stem]) for stem in stems & query)
+            # При равной близости предпочитаются более релевантные статьи и начала отрывков
+            return overlap, -i, -j
+
+        chosen = set()
+        used = 0
+        for i, j, sentence, _ in sorted(all_sentences, key=score, reverse=True):
+            size = estimate_tokens(sentence)
+            if used + size > budget:
+                continue
+            chosen.add((i, j))
+            used += size
+
+        return [[s for j, (s, _) in enumerate(p) if (i, j) in chosen] for i, p in enumerate(passages)]
+
+    def build(self, question: str, docs, history: str = "") -> dict:
+        """
+        Контекст, метаданные и история для промпта и статистика токенов до и после сжатия.
+        context_tokens_before - как при простой склейке фрагментов.
+        """
+        stats = {
+            "context_tokens_before": estimate_tokens("\n\n".join(d.page_content for d in docs)),
+            "history_tokens_before": estimate_tokens(history)
+        }
+
+        history = self.trim_history(history, int(self.max_tokens * self.history_share))
+        history_tokens = estimate_tokens(history)
+
+        passages = self.passages(docs)
+        sentences = self._dedupe(passages)
+        context_tokens = sum(estimate_tokens(s) for p in sentences for s, _ in p)
+        budget = self.max_tokens - history_tokens
+        if context_tokens > budget:
+            selected = self._select(question, sentences, budget)
+        else:
+            selected = [[s for s, _ in p] for p in sentences]
+
+        context = "\n\n".join(" ".join(p) for p in selected if p)
+        metadata = "\n".join(
+            f"{meta.get('name', 'Источник')}: {meta.get('link', '')}"
+            for (meta, _), p in zip(passages, selected) if p
+        )
+        stats.update(
+            context_tokens=estimate_tokens(context),
+            history_tokens=history_tokens,
+            passages=len(passages)
+        )
+        return {"context": context, "metadata": metadata, "chat_history": history, "stats": stats}
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Iterable, Iterator, Optional
+
+DATASET_MANIFEST = "manifest.json"
+SHARDED_DATASET = "data/dataset"
+LEGACY_DATASET = "data/final_dataset.json"
+
+
+def article_hash(row: dict) -> str:
+    """Хэш статьи вместе с метаданными: изменение любого поля требует переиндексации"""
+    payload = json.dumps(row, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def default_dataset() -> str:
+    """Шардированный датасет, если он собран, иначе final_dataset.json"""
+    if os.path.exists(os.path.join(SHARDED_DATASET, DATASET_MANIFEST)):
+        return SHARDED_DATASET
+    return LEGACY_DATASET
+
+
+def load_dataset_manifest(path: str) -> Optional[dict]:
+    manifest_path = os.path.join(path, DATASET_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_rows(path: str, shards: Optional[Iterable[str]] = None) -> Iterator[dict]:
+    """
+    Построчно читает статьи датасета.
+
+    Директория с manifest.json - шарды JSONL по порядку (или только перечисленные в shards),
+    JSONL читается потоково; final_dataset.json - один JSON объект, поэтому загружается целиком.
+    """
+    if os.path.isdir(path):
+        manifest = load_dataset_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"В {path} нет {DATASET_MANIFEST}")
+        names = [s["file"] for s in manifest["shards"]] if shards is None else shards
+        for name in names:
+            yield from iter_jsonl(os.path.join(path, name))
+        return
+
+    if path.endswith(".jsonl"):
+        yield from iter_jsonl(path)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    yield from data["rows"]
+
+
+def write_shards(rows: Iterable[dict], output_dir: str, shard_size: int = 1000) -> dict:
+    """
+    Записывает статьи в шарды part-00000.jsonl, ... по shard_size строк и манифест:
+    список шардов и для каждой статьи - категория, хэш и шард.
+
+    Строки потребляются по одной, в памяти держится только манифест. Датасет собирается
+    во временной директории и подменяет старый целиком.
+    """
+    output_dir = os.path.normpath(output_dir)
+    tmp_dir = output_dir + ".tmp"
+    old_dir = output_dir + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {"shard_size": shard_size, "shards": [], "articles": {}}
+    f = None
+    try:
+        for row in rows:
+            if f is None or manifest["shards"][-1]["rows"] >= shard_size:
+                if f is not None:
+                    f.close()
+                name = f"part-{len(manifest['shards']):05d}.jsonl"
+                manifest["shards"].append({"file": name, "rows": 0})
+                f = open(os.path.join(tmp_dir, name), "w", encoding="utf-8")
+
+            shard = manifest["shards"][-1]
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            shard["rows"] += 1
+            manifest["articles"][str(row["id"])] = {
+                "category": row.get("category"),
+                "hash": article_hash(row),
+                "shard": shard["file"]
+            }
+    finally:
+        if f is not None:
+            f.close()
+
+    with open(os.path.join(tmp_dir, DATASET_MANIFEST), "w", encoding="utf-8") as mf:
+        json.dump(manifest, mf, ensure_ascii=False)
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
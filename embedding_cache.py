@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def cache_namespace(model_name: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Имя раздела кэша: эмбеддинги разных моделей и разбиений не смешиваются"""
+    key = f"{model_name}|{chunk_size}|{chunk_overlap}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов фрагментов.
+
+    Векторы лежат подряд в одном float32 файле (читается через memmap),
+    рядом - индекс "хэш текста -> номер строки" в JSON.
+    Векторы дописываются в конец, индекс перезаписывается атомарно в flush(),
+    поэтому прерванная сборка оставляет кэш в согласованном состоянии: строки после последней
+    из индекса (в том числе недописанная) отбрасываются перед следующей записью.
+
+    Кэш только растёт: векторы текстов, которых больше нет в статьях, не удаляются.
+    Чтобы освободить место, достаточно удалить каталог раздела - он заполнится при следующей сборке.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, chunk_size: int, chunk_overlap: int):
+        self.path = os.path.join(cache_dir, cache_namespace(model_name, chunk_size, chunk_overlap))
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._index_path = os.path.join(self.path, "index.json")
+
+        self.dim = None
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self._index = meta["rows"]
+
+        self._rows = self._stored_rows()
+        # Строки, которых нет в файле, были бы перезаписаны чужими векторами
+        self._index = {h: row for h, row in self._index.items() if row < self._rows}
+        self._vectors = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def _stored_rows(self) -> int:
+        """Число строк, на которые ссылается индекс и которые целиком лежат в файле"""
+        if self.dim is None or not os.path.exists(self._vectors_path):
+            return 0
+        indexed = max(self._index.values(), default=-1) + 1
+        return min(indexed, os.path.getsize(self._vectors_path) // (4 * self.dim))
+
+    def _open(self) -> Optional[np.ndarray]:
+        if self._vectors is None and self._rows:
+            self._vectors = np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self._rows, self.dim)
+            )
+        return self._vectors
+
+    def get_many(self, hashes: List[str]) -> List[Optional[np.ndarray]]:
+        vectors = self._open()
+        result = []
+        for h in hashes:
+            row = self._index.get(h)
+            result.append(None if row is None else np.array(vectors[row]))
+        return result
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+
+        # Хвост прерванной записи сдвинул бы все следующие строки
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(self._rows * self.dim * 4)
+            f.write(vectors.tobytes())
+
+        for i, h in enumerate(hashes):
+            self._index[h] = self._rows + i
+        self._rows += len(vectors)
+        self._vectors = None
+
+    def flush(self):
+        if self.dim is None:
+            return
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "rows": self._index}, f)
+        os.replace(tmp_path, self._index_path)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обёртка над моделью эмбеддингов.
+
+    embed_documents() кодирует только тексты, которых нет в дисковом кэше,
+    embed_query() хранит последние запросы в LRU, так что повторные вопросы не идут в энкодер,
+    embed_queries() кодирует пакет вопросов за один проход модели.
+    При normalize=True возвращаются векторы единичной длины (для cosine индексов).
+    """
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            cache: Optional[EmbeddingCache] = None,
+            query_cache_size: int = 256,
+            normalize: bool = False
+    ):
+        self.embeddings = embeddings
+        self.normalize = normalize
+        self.cache = cache
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return [self._output(v) for v in self.embeddings.embed_documents(texts)]
+
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(hashes)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+
+        if missing:
+            new_vectors = np.asarray(
+                self.embeddings.embed_documents([texts[i] for i in missing]),
+                dtype=np.float32
+            )
+            self.cache.put_many([hashes[i] for i in missing], new_vectors)
+            self.cache.flush()
+            for i, v in zip(missing, new_vectors):
+                vectors[i] = v
+
+        return [self._output(v) for v in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                return self._output(vector)
+
+        vector = self.embeddings.embed_query(text)
+
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return self._output(vector)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги нескольких вопросов: отсутствующие в LRU кодируются одним вызовом энкодера"""
+        vectors = [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                vector = self._queries.get(text)
+                if vector is not None:
+                    self._queries.move_to_end(text)
+                    vectors[i] = vector
+
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            encoded = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            with self._lock:
+                for text, vector in encoded.items():
+                    self._queries[text] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+            vectors = [encoded[t] if v is None else v for t, v in zip(texts, vectors)]
+
+        return [self._output(v) for v in vectors]
+
+    def _output(self, vector) -> List[float]:
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.normalize:
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector = vector / norm
+        return vector.tolist()
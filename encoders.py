@@ -0,0 +1,88 @@
+import importlib.util
+import os
+import threading
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Параметры SentenceTransformer для каждого бэкенда.
+# ONNX-файлы берутся из репозитория модели на Hugging Face Hub, нужен optimum[onnxruntime]
+BACKENDS = {
+    "torch": {},
+    "onnx": {"backend": "onnx"},
+    "onnx-int8": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}},
+}
+
+
+def encoder_kwargs(backend: str = "torch") -> dict:
+    """Параметры HuggingFaceEmbeddings для бэкенда (их же получают процессы пула при сборке индекса)"""
+    return {
+        "model_name": MODEL_NAME,
+        "model_kwargs": {"device": "cpu", **BACKENDS[backend]},
+        "encode_kwargs": {"normalize_embeddings": False}
+    }
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Энкодер MiniLM, который загружается при первом обращении, а не при импорте.
+
+    Импорт sentence-transformers и загрузка весов занимают секунды, поэтому модули,
+    которым энкодер не нужен (метрики, бенчмарки индекса), за них не платят.
+    """
+
+    def __init__(self, backend: str = "torch"):
+        self.backend = backend
+        self.kwargs = encoder_kwargs(backend)
+        # Векторы разных бэкендов немного отличаются, поэтому в кэше эмбеддингов они не смешиваются
+        self.model_name = MODEL_NAME if backend == "torch" else f"{MODEL_NAME}@{backend}"
+        self.load_seconds = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from langchain_huggingface import HuggingFaceEmbeddings
+
+                    started = time.perf_counter()
+                    self._model = HuggingFaceEmbeddings(**self.kwargs)
+                    self.load_seconds = time.perf_counter() - started
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
+
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(backend: str = None) -> LazyEmbeddings:
+    """
+    Общий на процесс энкодер для бэкенда (по умолчанию - из EMBEDDINGS_BACKEND, иначе torch).
+    Без optimum ONNX-бэкенды недоступны, и используется torch.
+    """
+    backend = backend or os.getenv("EMBEDDINGS_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд энкодера: {backend}. Доступны: {', '.join(BACKENDS)}")
+    if backend != "torch" and importlib.util.find_spec("optimum") is None:
+        print(f"Бэкенд {backend} требует optimum[onnxruntime], используется torch.")
+        backend = "torch"
+
+    with _encoders_lock:
+        encoder = _encoders.get(backend)
+        if encoder is None:
+            encoder = _encoders[backend] = LazyEmbeddings(backend)
+        return encoder
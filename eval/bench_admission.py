@@ -0,0 +1,179 @@
+"""
+Склеивание сообщений и допуск к модели (admission.ChatAdmission) при всплеске сообщений.
+
+N чатов одновременно пишут сериями: burst-size коротких сообщений с паузами gap секунд, затем ждут
+ответов и пишут следующую серию. В режиме direct каждое сообщение сразу уходит в aask(), как было
+в bot.py; в режиме admission - через ChatAdmission. Ретривер настоящий, LLM - FakeChatModel.
+Печатаются вызовы LLM на чат, доля ответов "занято", p50/p95 задержки от последнего сообщения
+серии до ответа на всю серию и пик одновременных вопросов к модели.
+
+Запуск из корня проекта:
+    python eval/bench_admission.py --chats 64 --bursts 3 --burst-size 3 --fake-embeddings
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from eval.fake_llm import FakeChatModel
+
+
+class BurstClient:
+    """Чаты, пишущие сериями; ответы приходят через answer()/busy() в любом режиме"""
+
+    def __init__(self, bot, questions, args):
+        self.bot = bot
+        self.questions = questions
+        self.args = args
+        self.pending = {}
+        self.done = {}
+        self.latencies = []
+        self.llm_calls = 0
+        self.busy_replies = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _replied(self, chat_id, messages: int):
+        self.pending[chat_id] -= messages
+        if self.pending[chat_id] <= 0:
+            self.done[chat_id].set()
+
+    async def answer(self, chat_id, text: str, contexts):
+        self.llm_calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await self.bot.aask(text, session_id=chat_id)
+        finally:
+            self.in_flight -= 1
+            self._replied(chat_id, len(contexts))
+
+    async def busy(self, chat_id, text: str, contexts):
+        self.busy_replies += 1
+        self._replied(chat_id, len(contexts))
+
+    async def chat(self, chat_id: int, send):
+        for b in range(self.args.bursts):
+            self.pending[chat_id] = self.args.burst_size
+            self.done[chat_id] = asyncio.Event()
+            for j in range(self.args.burst_size):
+                if j:
+                    await asyncio.sleep(self.args.gap)
+                i = (chat_id * self.args.bursts + b) * self.args.burst_size + j
+                send(chat_id, self.questions[i % len(self.questions)])
+            last_message = time.perf_counter()
+            await self.done[chat_id].wait()
+            self.latencies.append(time.perf_counter() - last_message)
+            await asyncio.sleep(self.args.think)
+
+
+async def run(bot, questions, args, mode: str) -> dict:
+    from admission import ChatAdmission
+
+    client = BurstClient(bot, questions, args)
+    if mode == "admission":
+        admission = ChatAdmission(
+            client.answer,
+            client.busy,
+            window=args.window,
+            max_wait=args.max_wait,
+            rate=args.rate_per_min / 60,
+            burst=args.chat_burst,
+            max_in_flight=args.max_in_flight
+        )
+
+        def send(chat_id, text):
+            admission.submit(chat_id, text, text)
+    else:
+        tasks = set()
+
+        def send(chat_id, text):
+            task = asyncio.ensure_future(client.answer(chat_id, text, [text]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client.chat(i, send) for i in range(args.chats)))
+    wall = time.perf_counter() - started
+
+    messages = args.chats * args.bursts * args.burst_size
+    return {
+        "mode": mode,
+        "messages": messages,
+        "llm_calls": client.llm_calls,
+        "llm_calls_per_chat": round(client.llm_calls / args.chats, 2),
+        "busy_rate": round(client.busy_replies / args.chats / args.bursts, 3),
+        "peak_in_flight": client.peak_in_flight,
+        "reply_p50_ms": round(float(np.percentile(client.latencies, 50)) * 1000, 1),
+        "reply_p95_ms": round(float(np.percentile(client.latencies, 95)) * 1000, 1),
+        "wall_sec": round(wall, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--modes", nargs="+", choices=["direct", "admission"], default=["direct", "admission"])
+    parser.add_argument("--chats", type=int, default=64)
+    parser.add_argument("--bursts", type=int, default=3, help="Серий сообщений на чат")
+    parser.add_argument("--burst-size", type=int, default=3, help="Сообщений в серии")
+    parser.add_argument("--gap", type=float, default=0.3, help="Пауза между сообщениями серии, сек")
+    parser.add_argument("--think", type=float, default=1.0, help="Пауза после ответа до следующей серии, сек")
+    parser.add_argument("--concurrency", type=int, default=8, help="max_concurrency PsychologistRAG")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Задержка заглушки LLM, сек")
+    parser.add_argument("--window", type=float, default=1.5)
+    parser.add_argument("--max-wait", type=float, default=6.0)
+    parser.add_argument("--rate-per-min", type=float, default=6.0)
+    parser.add_argument("--chat-burst", type=int, default=3)
+    parser.add_argument("--max-in-flight", type=int, default=32)
+    parser.add_argument("--fake-embeddings", action="store_true", help="Детерминированные эмбеддинги вместо MiniLM")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+    from model import PsychologistRAG
+
+    with open(args.bench, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)["questions"]]
+
+    kwargs = {}
+    faiss_path = args.faiss_path
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        work_dir = tempfile.mkdtemp(prefix="psychrag_admission_")
+        faiss_path = os.path.join(work_dir, "faiss_index")
+        kwargs["encoder"] = DeterministicFakeEmbedding(size=384)
+        kwargs["embedding_cache_dir"] = os.path.join(work_dir, "embedding_cache")
+
+    report = []
+    for mode in args.modes:
+        bot = PsychologistRAG(
+            faiss_path=faiss_path,
+            llm=FakeChatModel(latency=args.llm_latency),
+            max_concurrency=args.concurrency,
+            answer_cache_size=0,
+            **kwargs
+        )
+        bot.warmup()
+        row = asyncio.run(run(bot, questions, args, mode))
+        report.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
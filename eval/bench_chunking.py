@@ -0,0 +1,119 @@
+"""
+Сравнение политик разбиения статей на фрагменты (chunking.PRESETS).
+
+Для каждой политики индекс собирается заново во временной директории (с пустым кэшем эмбеддингов,
+чтобы время сборки было сравнимым) и печатаются: число фрагментов, размер индекса на диске, время
+сборки, Hit@3/MRR@3 на psychrag_bench_100.json и средний размер промпта в токенах для вопросов
+бенчмарка - с тем же поиском и сжатием контекста, что в aask() (LLM не вызывается), а также размер
+найденного контекста до сжатия.
+
+Запуск из корня проекта:
+    python eval/bench_chunking.py --policies recursive structured structured_768 structured_512
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from chunking import PRESETS
+from eval.eval_retr import _load_questions, evaluate_retrieval_batched
+from eval.fake_llm import FakeChatModel
+
+
+def _dir_size_mb(path: str) -> float:
+    total = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+    return round(total / 1024 / 1024, 2)
+
+
+def prompt_tokens(bot, questions, k: int) -> dict:
+    """Средний размер промпта и найденного контекста до сжатия в токенах (оценка sessions.estimate_tokens)"""
+    from sessions import estimate_tokens
+    from tracing import NULL_TRACE
+
+    prompts, contexts = [], []
+    for item in questions:
+        vector = bot._embed(item["question"])
+        docs = bot._retrieve(vector, k)
+        inputs = bot._build_inputs(item["question"], docs, "", NULL_TRACE)
+        prompts.append(estimate_tokens(bot._prompt_chain.invoke(inputs).to_string()))
+        contexts.append(estimate_tokens("\n\n".join(d.page_content for d in docs)))
+    return {
+        "prompt_tokens_mean": round(float(np.mean(prompts)), 1),
+        "context_tokens_before_mean": round(float(np.mean(contexts)), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=os.path.join(PROJECT_ROOT, "data", "final_dataset.json"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--policies", nargs="+", choices=sorted(PRESETS), default=sorted(PRESETS))
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--workers", type=int, help="Процессов сборки, по умолчанию по числу ядер")
+    parser.add_argument("--work-dir", help="Куда собирать индексы (по умолчанию временная директория)")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Детерминированные эмбеддинги вместо MiniLM")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+    from model import PsychologistRAG
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="psychrag_chunking_")
+    questions = _load_questions(args.bench)
+    kwargs = {}
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        kwargs["encoder"] = DeterministicFakeEmbedding(size=384)
+
+    rows = []
+    for name in args.policies:
+        faiss_path = os.path.join(work_dir, name)
+        cache_dir = os.path.join(work_dir, f"{name}_embedding_cache")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        bot = PsychologistRAG(
+            faiss_path=faiss_path,
+            embedding_cache_dir=cache_dir,
+            answer_cache_size=0,
+            llm=FakeChatModel(latency=0),
+            llm_deadline=0,
+            lazy=True,
+            **kwargs
+        )
+
+        started = time.perf_counter()
+        bot.vectorize_dataset(args.dataset, chunking=PRESETS[name](), workers=args.workers)
+        build_sec = time.perf_counter() - started
+        bot._ensure_ready()
+
+        results, _ = evaluate_retrieval_batched(bot, args.bench, ks=(args.k,), questions=questions)
+        row = {
+            "policy": name,
+            "chunks": bot.db.index.ntotal,
+            "index_mb": _dir_size_mb(faiss_path),
+            "build_sec": round(build_sec, 2)
+        }
+        row.update({metric: round(value, 3) for metric, value in results[args.k]["overall"].items()})
+        row.update(prompt_tokens(bot, questions, args.k))
+        rows.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Сравнение типов FAISS индекса на psychrag_bench_100.json.
+
+Для каждого типа индекса и метрики считаются задержка поиска одного запроса, размер индекса,
+Hit@k / MRR@k по категориям и recall@k относительно точного flat-поиска с той же метрикой.
+Векторы фрагментов берутся из готового индекса, поэтому энкодер запускается только для вопросов.
+--synthetic N добавляет N шумовых векторов, чтобы оценить поведение на большом корпусе.
+
+Запуск из корня проекта:
+    python eval/bench_index.py --faiss-path faiss_index --synthetic 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from eval.eval_retr import hit_at_k, reciprocal_rank
+from index_factory import INDEX_TYPES, METRICS, IndexSpec, index_bytes
+
+
+def load_corpus(faiss_path: str):
+    """Векторы и категории фрагментов из сохранённого индекса"""
+    from model import PsychologistRAG
+
+    bot = PsychologistRAG(faiss_path=faiss_path, answer_cache_size=0)
+    db = bot.db
+    vectors = db.index.reconstruct_n(0, db.index.ntotal)
+    categories = [
+        db.docstore.search(db.index_to_docstore_id[i]).metadata.get("category")
+        for i in range(db.index.ntotal)
+    ]
+    return vectors, categories
+
+
+def add_synthetic(vectors: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """Шумовые векторы с теми же средним и разбросом по координатам, что и у корпуса"""
+    if n <= 0:
+        return vectors
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(vectors.mean(axis=0), vectors.std(axis=0), size=(n, vectors.shape[1]))
+    return np.vstack([vectors, noise.astype(np.float32)])
+
+
+def run_spec(spec: IndexSpec, vectors, queries, categories, questions, k: int, exact_ids=None) -> dict:
+    vectors = vectors.copy()
+    queries = queries.copy()
+    if spec.normalize:
+        faiss.normalize_L2(vectors)
+        faiss.normalize_L2(queries)
+
+    started = time.perf_counter()
+    index = spec.create(vectors.shape[1], vectors)
+    index.add(vectors)
+    build_sec = time.perf_counter() - started
+
+    # Как в боте: по одному запросу за раз
+    latencies = []
+    ids = []
+    for q in queries:
+        started = time.perf_counter()
+        _, found = index.search(q[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        ids.append(found[0])
+    ids = np.array(ids)
+
+    hits, rrs = [], []
+    for item, row in zip(questions, ids):
+        retrieved = [categories[i] if 0 <= i < len(categories) else None for i in row]
+        hits.append(hit_at_k(retrieved, item["allowed_topics"]))
+        rrs.append(reciprocal_rank(retrieved, item["allowed_topics"]))
+
+    result = {
+        "index": spec.index_type,
+        "metric": spec.metric,
+        "build_sec": round(build_sec, 3),
+        "bytes": index_bytes(index),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        f"Hit@{k}": round(float(np.mean(hits)), 3),
+        f"MRR@{k}": round(float(np.mean(rrs)), 3),
+    }
+    if exact_ids is not None:
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+        result[f"recall@{k}"] = round(float(recall), 3)
+    return result, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--metrics", nargs="+", default=list(METRICS), choices=METRICS)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--synthetic", type=int, default=0)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    from model import embeddings
+
+    with open(args.bench, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+
+    vectors, categories = load_corpus(args.faiss_path)
+    vectors = add_synthetic(vectors, args.synthetic)
+    queries = np.asarray(embeddings.embed_documents([q["question"] for q in questions]), dtype=np.float32)
+    print(f"Фрагментов: {len(categories)}, всего векторов: {len(vectors)}, вопросов: {len(questions)}")
+
+    results = []
+    for metric in args.metrics:
+        # Точный поиск - эталон для recall
+        _, exact_ids = run_spec(IndexSpec("flat", metric), vectors, queries, categories, questions, args.k)
+        for index_type in args.types:
+            result, _ = run_spec(
+                IndexSpec(index_type, metric), vectors, queries, categories, questions, args.k, exact_ids
+            )
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Нагрузочный бенчмарк PsychologistRAG.aask() с локальной заглушкой LLM.
+
+N одновременных чатов отправляют вопросы из psychrag_bench_100.json (каждый чат - последовательно,
+как пользователь в Telegram). Ретривер и цепочка настоящие, ChatMistralAI заменён на FakeChatModel
+с заданной задержкой. Печатаются p50/p95/p99 по этапам, пропускная способность и пиковая память.
+С --fake-embeddings индекс собирается во временной директории на детерминированных эмбеддингах,
+и бенчмарк не требует ни сети, ни загрузки MiniLM. С --stream ответы читаются через astream(),
+в этапах появляется first_token - задержка до первого токена. --llm-error-rate и --llm-slow-rate
+добавляют ошибки и хвост задержек, --llm-deadline, --hedge-percentile и --fallback-latency
+настраивают дедлайн, дублирующие запросы и резервную модель. С --batch-window-ms вопросы чатов
+собираются в пакеты для эмбеддинга и поиска, в этапах появляется batch_wait. С --extractive-overload
+запросы сверх очереди получают ответ из фрагментов без LLM (исход extractive_overload, этап extract).
+
+Запуск из корня проекта:
+    python eval/bench_load.py --chats 32 --messages 5 --llm-latency 0.8 --fake-embeddings
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from eval.fake_llm import FakeChatModel
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StageCollector(logging.Handler):
+    """Собирает длительности этапов из структурированных логов трассировки PsychologistRAG"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.samples = defaultdict(list)
+        self.outcomes = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            event = json.loads(record.getMessage())
+        except ValueError:
+            return
+        if event.get("event") != "rag_request":
+            return
+        with self._lock:
+            self.outcomes[event["outcome"]] += 1
+            self.samples["total"].append(event["total_ms"])
+            for stage, value in event["stages_ms"].items():
+                self.samples[stage].append(value)
+            for key in ("prompt_tokens", "completion_tokens", "context_tokens", "context_tokens_before"):
+                self.tokens[key] += event.get(key, 0)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(float(np.percentile(values, 50)), 2),
+                "p95_ms": round(float(np.percentile(values, 95)), 2),
+                "p99_ms": round(float(np.percentile(values, 99)), 2)
+            }
+            for stage, values in sorted(self.samples.items()) if values
+        }
+
+
+def create_bot(args):
+    from model import PsychologistRAG
+    from tracing import Metrics
+
+    llm = FakeChatModel(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        seed=args.seed,
+        token_latency=args.token_latency,
+        error_rate=args.llm_error_rate,
+        slow_rate=args.llm_slow_rate,
+        slow_latency=args.llm_slow_latency
+    )
+    kwargs = {
+        "max_concurrency": args.concurrency,
+        "retrieval_workers": args.retrieval_workers,
+        "answer_cache_size": 1024 if args.answer_cache else 0,
+        "batch_window": args.batch_window_ms / 1000,
+        "max_batch_size": args.max_batch,
+        "llm": llm,
+        "llm_deadline": args.llm_deadline,
+        "hedge_percentile": args.hedge_percentile,
+        "extractive_overload": args.extractive_overload,
+        "fallback_llm": FakeChatModel(
+            latency=args.fallback_latency,
+            seed=args.seed + 1,
+            token_latency=args.token_latency
+        ) if args.fallback_latency is not None else None,
+        "metrics": Metrics(enabled=True)
+    }
+    faiss_path = args.faiss_path
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        work_dir = tempfile.mkdtemp(prefix="psychrag_bench_")
+        faiss_path = os.path.join(work_dir, "faiss_index")
+        kwargs["encoder"] = DeterministicFakeEmbedding(size=384)
+        kwargs["embedding_cache_dir"] = os.path.join(work_dir, "embedding_cache")
+
+    return PsychologistRAG(faiss_path=faiss_path, **kwargs)
+
+
+async def run_load(bot, questions, chats: int, messages: int, stream: bool = False) -> dict:
+    async def chat(chat_id: int):
+        for j in range(messages):
+            question = questions[(chat_id * messages + j) % len(questions)]["question"]
+            if stream:
+                async for _ in bot.astream(question, session_id=chat_id):
+                    pass
+            else:
+                await bot.aask(question, session_id=chat_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(i) for i in range(chats)))
+    wall = time.perf_counter() - started
+
+    total = chats * messages
+    return {
+        "chats": chats,
+        "messages": total,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(total / wall, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--chats", type=int, default=16, help="Число одновременных чатов")
+    parser.add_argument("--messages", type=int, default=5, help="Сообщений в каждом чате")
+    parser.add_argument("--concurrency", type=int, default=8, help="max_concurrency PsychologistRAG")
+    parser.add_argument("--retrieval-workers", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Задержка заглушки LLM, сек")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Задержка между токенами в потоке, сек")
+    parser.add_argument("--stream", action="store_true", help="Читать ответы через astream()")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля ответов LLM с ошибкой")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Доля медленных ответов LLM")
+    parser.add_argument("--llm-slow-latency", type=float, default=5.0, help="Задержка медленного ответа, сек")
+    parser.add_argument("--llm-deadline", type=float, default=20.0, help="Дедлайн ответа LLM, 0 - без обёртки")
+    parser.add_argument("--hedge-percentile", type=float, help="Перцентиль задержки для дублирующего запроса")
+    parser.add_argument("--fallback-latency", type=float, help="Задержка резервной заглушки LLM (без неё резерва нет)")
+    parser.add_argument("--extractive-overload", type=int, default=0,
+                        help="Длина очереди, с которой ответ собирается без LLM, 0 - выключено")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--answer-cache", action="store_true", help="Включить семантический кэш ответов")
+    parser.add_argument("--batch-window-ms", type=float, default=0.0, help="Окно пакетного поиска, 0 - выключено")
+    parser.add_argument("--max-batch", type=int, default=32, help="Максимальный размер пакета поиска")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Детерминированные эмбеддинги вместо MiniLM")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    # Пути по умолчанию внутри PsychologistRAG относительны корня проекта
+    os.chdir(PROJECT_ROOT)
+
+    with open(args.bench, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+
+    bot = create_bot(args)
+
+    collector = StageCollector()
+    trace_logger = logging.getLogger("psychrag")
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    trace_logger.addHandler(collector)
+
+    report = asyncio.run(run_load(bot, questions, args.chats, args.messages, args.stream))
+    report["outcomes"] = dict(collector.outcomes)
+    report["tokens"] = dict(collector.tokens)
+    report["stages"] = collector.summary()
+    if bot.batcher is not None:
+        report["retrieval_batch"] = bot.batcher.metrics()
+    report["gauges"] = bot.metrics.snapshot()["gauges"]
+    if resource is not None:
+        report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Сравнение MMR из LangChain (max_marginal_relevance_search_by_vector) и VectorMMR.
+
+Для вопросов psychrag_bench_100.json замеряется задержка поиска одного запроса обоими способами
+и VectorMMR пакетом на все вопросы (задержка на запрос), считаются Hit@k/MRR@k по категориям
+и доля вопросов с тем же выбором, что у LangChain. VectorMMR прогоняется без ограничения
+и с ограничением числа фрагментов одной статьи (--max-per-article).
+
+Запуск из корня проекта:
+    python eval/bench_mmr.py --k 3 --max-per-article 1 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from eval.eval_retr import _aggregate, _load_questions
+
+
+def _timed(fn, repeats: int):
+    """Результат последнего вызова и медианная длительность в секундах"""
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - started)
+    return result, float(np.median(latencies))
+
+
+def _row(name, questions, docs, k, latencies, reference=None) -> dict:
+    categories = [[d.metadata.get("category") for d in found] for found in docs]
+    row = {"method": name}
+    row.update({key: round(value, 3) for key, value in _aggregate(questions, categories, [k])[k]["overall"].items()})
+    row.update(
+        p50_ms=round(float(np.percentile(latencies, 50)) * 1000, 3),
+        p95_ms=round(float(np.percentile(latencies, 95)) * 1000, 3),
+        chunks_per_article=round(float(np.mean([
+            len(found) / len({d.metadata.get("id", d.id) for d in found}) for found in docs if found
+        ])), 3)
+    )
+    if reference is not None:
+        row["same_as_langchain"] = round(float(np.mean([
+            [d.id for d in a] == [d.id for d in b] for a, b in zip(docs, reference)
+        ])), 3)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--max-per-article", type=int, nargs="*", default=[1, 2])
+    parser.add_argument("--repeats", type=int, default=5, help="Повторов каждого замера")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    from model import PsychologistRAG
+
+    bot = PsychologistRAG(faiss_path=args.faiss_path, answer_cache_size=0)
+    questions = _load_questions(args.bench)
+    vectors = bot.embeddings.embed_queries([item["question"] for item in questions])
+    db, mmr = bot.db, bot.mmr
+
+    def langchain(vector):
+        return db.max_marginal_relevance_search_by_vector(
+            vector, k=args.k, fetch_k=args.fetch_k, lambda_mult=args.lambda_mult
+        )
+
+    def vector_mmr(batch, max_per_article=None):
+        return mmr.search(batch, [args.k] * len(batch), args.fetch_k, args.lambda_mult, max_per_article)
+
+    rows = []
+    reference, latencies = [], []
+    for vector in vectors:
+        docs, seconds = _timed(lambda: langchain(vector), args.repeats)
+        reference.append(docs)
+        latencies.append(seconds)
+    rows.append(_row("langchain", questions, reference, args.k, latencies))
+
+    for max_per_article in [None] + args.max_per_article:
+        suffix = f" max_per_article={max_per_article}" if max_per_article else ""
+        docs, latencies = [], []
+        for vector in vectors:
+            found, seconds = _timed(lambda: vector_mmr([vector], max_per_article)[0], args.repeats)
+            docs.append(found)
+            latencies.append(seconds)
+        rows.append(_row("vector_mmr" + suffix, questions, docs, args.k, latencies, reference))
+
+        docs, seconds = _timed(lambda: vector_mmr(vectors, max_per_article), args.repeats)
+        rows.append(_row("vector_mmr batch" + suffix, questions, docs, args.k, [seconds / len(vectors)], reference))
+
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Время старта и первого запроса PsychologistRAG для разных бэкендов энкодера.
+
+Каждый бэкенд замеряется в отдельном процессе, чтобы загрузка была холодной: импорт model,
+конструктор с lazy=True, этапы warmup() (индекс, веса энкодера, первый эмбеддинг и поиск),
+затем задержка эмбеддинга вопросов psychrag_bench_100.json в установившемся режиме.
+Для бэкендов, отличных от torch, считается совпадение top-k фрагментов с torch.
+
+Запуск из корня проекта:
+    python eval/bench_startup.py --backends torch onnx onnx-int8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _percentile_ms(values, q: float) -> float:
+    return round(float(np.percentile(values, q)) * 1000, 2)
+
+
+def measure(backend: str, faiss_path: str, bench: str, k: int) -> dict:
+    """Замеры в текущем (свежем) процессе"""
+    os.environ["EMBEDDINGS_BACKEND"] = backend
+
+    started = time.perf_counter()
+    from model import PsychologistRAG
+    import_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bot = PsychologistRAG(faiss_path=faiss_path, query_cache_size=0, answer_cache_size=0, lazy=True)
+    init_sec = time.perf_counter() - started
+
+    warmup = bot.warmup()
+
+    with open(bench, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)["questions"]]
+
+    embed_latencies, retrieve_latencies, top_ids = [], [], []
+    for question in questions:
+        started = time.perf_counter()
+        vector = bot._embed(question)
+        embed_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        docs = bot._retrieve(vector, k)
+        retrieve_latencies.append(time.perf_counter() - started)
+        top_ids.append([d.id for d in docs])
+
+    result = {
+        "backend": bot.encoder.backend,
+        "import_sec": round(import_sec, 3),
+        "init_sec": round(init_sec, 3),
+        "warmup_sec": warmup,
+        "ready_sec": round(import_sec + init_sec + sum(warmup.values()), 3),
+        "embed_ms_p50": _percentile_ms(embed_latencies, 50),
+        "embed_ms_p95": _percentile_ms(embed_latencies, 95),
+        "retrieve_ms_p50": _percentile_ms(retrieve_latencies, 50),
+        "top_ids": top_ids
+    }
+    if resource is not None:
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def run_child(backend: str, args) -> dict:
+    completed = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__), "--child", backend,
+            "--faiss-path", args.faiss_path, "--bench", args.bench, "--k", str(args.k)
+        ],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    # Результат - последняя строка вывода, выше могут быть сообщения загрузки модели
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    if args.child:
+        os.chdir(PROJECT_ROOT)
+        print(json.dumps(measure(args.child, args.faiss_path, args.bench, args.k), ensure_ascii=False))
+        return
+
+    results = []
+    reference = None
+    for backend in args.backends:
+        result = run_child(backend, args)
+        top_ids = result.pop("top_ids")
+        if result["backend"] == "torch" and reference is None:
+            reference = top_ids
+        elif reference is not None:
+            overlap = [len(set(a) & set(b)) / args.k for a, b in zip(top_ids, reference)]
+            result[f"overlap@{args.k}_vs_torch"] = round(float(np.mean(overlap)), 3)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
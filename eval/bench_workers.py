@@ -0,0 +1,141 @@
+"""
+Масштабирование поиска по числу процессов RetrievalPool.
+
+Для каждого числа процессов (0 - пул потоков процесса бота) вопросы psychrag_bench_100.json
+отправляются в поиск с заданным числом одновременных запросов, через тот же MicroBatcher, что и aask().
+LLM не вызывается. Печатаются пропускная способность, p50/p95 задержки и память: RSS процесса бота
+и процессов пула, а также PSS - память с учётом общих страниц (индекс и фрагменты через mmap
+считаются один раз на все процессы). PSS доступен только в Linux.
+
+Запуск из корня проекта:
+    python eval/bench_workers.py --processes 0 1 2 4 --concurrency 64 --queries 2000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from eval.fake_llm import FakeChatModel
+
+
+def _memory_kb(pid) -> dict:
+    """Rss и Pss процесса из /proc (только Linux)"""
+    result = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    result[name.lower()] = int(value.split()[0])
+    except OSError:
+        pass
+    return result
+
+
+def memory_report() -> dict:
+    processes = [_memory_kb("self")] + [_memory_kb(p.pid) for p in multiprocessing.active_children()]
+    if not all(processes):
+        return {}
+    return {
+        "bot_rss_mb": round(processes[0]["rss"] / 1024, 1),
+        "workers_rss_mb": round(sum(p["rss"] for p in processes[1:]) / 1024, 1),
+        "total_pss_mb": round(sum(p["pss"] for p in processes) / 1024, 1)
+    }
+
+
+async def run_queries(bot, questions, total: int, concurrency: int, k: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def query(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.batcher.submit((questions[i % len(questions)], k))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(query(i) for i in range(total)))
+    wall = time.perf_counter() - started
+    return {
+        "qps": round(total / wall, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--processes", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--threads", type=int, default=2, help="Потоков поиска при 0 процессов")
+    parser.add_argument("--concurrency", type=int, default=64, help="Одновременных запросов")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--batch-window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fake-embeddings", action="store_true", help="Детерминированные эмбеддинги вместо MiniLM")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+    from model import PsychologistRAG
+
+    with open(args.bench, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)["questions"]]
+
+    kwargs = {}
+    faiss_path = args.faiss_path
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        work_dir = tempfile.mkdtemp(prefix="psychrag_workers_")
+        faiss_path = os.path.join(work_dir, "faiss_index")
+        kwargs["encoder"] = DeterministicFakeEmbedding(size=384)
+        kwargs["embedding_cache_dir"] = os.path.join(work_dir, "embedding_cache")
+
+    report = {"cpu_count": os.cpu_count(), "runs": []}
+    for processes in args.processes:
+        bot = PsychologistRAG(
+            faiss_path=faiss_path,
+            llm=FakeChatModel(latency=0),
+            retrieval_workers=args.threads,
+            retrieval_processes=processes,
+            batch_window=args.batch_window_ms / 1000,
+            max_batch_size=args.max_batch,
+            # Повторяющиеся вопросы не должны браться из кэша эмбеддингов
+            query_cache_size=0,
+            answer_cache_size=0,
+            **kwargs
+        )
+        warmup = bot.warmup()
+        # Прогрев потоков и процессов на коротком прогоне
+        asyncio.run(run_queries(bot, questions, args.concurrency, args.concurrency, args.k))
+
+        run = {"processes": processes, "warmup": warmup}
+        run.update(asyncio.run(run_queries(bot, questions, args.queries, args.concurrency, args.k)))
+        run.update(memory_report())
+        run["batch"] = bot.batcher.metrics()
+        report["runs"].append(run)
+        print(json.dumps(run, ensure_ascii=False))
+
+        if bot.pool is not None:
+            bot.pool.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
+import argparse
+import csv
 import json
+import os
+import sys
+import time
 from collections import defaultdict
 from typing import List
 
@@ -99,3 +104,274 @@ def evaluate_retrieval(bot, benchmark_path: str, k: int):
         }
 
     return results, detailed_results
+
+
+def _load_questions(benchmark_path: str):
+    with open(benchmark_path, "r", encoding="utf-8") as f:
+        return json.load(f)["questions"]
+
+
+def _row_categories(db) -> List[str]:
+    """Категория статьи для каждой строки FAISS индекса"""
+    return [
+        db.docstore.search(db.index_to_docstore_id[i]).metadata.get("category")
+        for i in range(db.index.ntotal)
+    ]
+
+
+def _aggregate(questions, ranked_categories, ks) -> dict:
+    """Hit/Precision/MRR для каждого k по ранжированным категориям (общие и по темам)"""
+    results = {}
+    for k in ks:
+        per_theme_stats = defaultdict(list)
+        stats = []
+        for item, categories in zip(questions, ranked_categories):
+            top = categories[:k]
+            allowed_topics = item["allowed_topics"]
+            row = (
+                hit_at_k(top, allowed_topics),
+                precision_at_k(top, allowed_topics, k),
+                reciprocal_rank(top, allowed_topics)
+            )
+            stats.append(row)
+            per_theme_stats[item["expected_theme"]].append(row)
+
+        def summary(rows):
+            hits, precisions, rrs = zip(*rows)
+            return {
+                f"Hit@{k}": float(np.mean(hits)),
+                f"Precision@{k}": float(np.mean(precisions)),
+                f"MRR@{k}": float(np.mean(rrs))
+            }
+
+        results[k] = {
+            "overall": summary(stats),
+            "per_theme": {theme: summary(rows) for theme, rows in per_theme_stats.items()}
+        }
+    return results
+
+
+def evaluate_retrieval_batched(
+        bot,
+        benchmark_path: str,
+        ks=(1, 3, 5),
+        mode: str = "mmr",
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        questions=None,
+        query_vectors=None
+):
+    """
+    Оценка ретривера сразу для нескольких k.
+
+    Все вопросы кодируются одним батчем и ищутся одним матричным запросом к индексу.
+    mode="mmr" повторяет продовый путь (PsychologistRAG._retrieve) с fetch_k, lambda_mult
+    и bot.max_chunks_per_article: если у бота есть подындексы категорий (bot.shards), вопрос
+    сначала идёт через роутер, и только без уверенного маршрута - в VectorMMR бота (bot.mmr)
+    по всему индексу. mode="similarity" - обычный поиск ближайших по всему индексу, как
+    в evaluate_retrieval. MMR жадный, поэтому выбор для max(ks) содержит выборы для меньших k
+    как префиксы.
+
+    Returns:
+        (результаты по k, латентность ретривера на запрос в мс)
+    """
+    questions = questions or _load_questions(benchmark_path)
+    db = bot.db
+    max_k = max(ks)
+
+    if query_vectors is None:
+        query_vectors = bot.embeddings.embed_documents([item["question"] for item in questions])
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+    started = time.perf_counter()
+    _, indices = db.index.search(query_vectors, fetch_k if mode == "mmr" else max_k)
+    search_sec = (time.perf_counter() - started) / len(questions)
+
+    row_categories = _row_categories(db)
+    latencies = []
+    ranked_categories = []
+    for q, rows in zip(query_vectors, indices):
+        started = time.perf_counter()
+        docs = None
+        if mode == "mmr" and bot.shards is not None:
+            docs = bot.shards.max_marginal_relevance_search(
+                q,
+                k=max_k,
+                fetch_k=fetch_k,
+                lambda_mult=lambda_mult,
+                max_per_article=bot.max_chunks_per_article
+            )
+        if docs is not None:
+            categories = [d.metadata.get("category") for d in docs]
+        else:
+            if mode == "mmr":
+                rows = bot.mmr.select([q], [rows], [max_k], lambda_mult, bot.max_chunks_per_article)[0]
+            else:
+                rows = [int(i) for i in rows if i != -1]
+            categories = [row_categories[i] for i in rows]
+        latencies.append(search_sec + time.perf_counter() - started)
+        ranked_categories.append(categories[:max_k])
+
+    latency = {
+        "mean_ms": float(np.mean(latencies) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000)
+    }
+    return _aggregate(questions, ranked_categories, ks), latency
+
+
+def evaluate_extractive(bot, benchmark_path: str, ks=(1, 3, 5), retrieve_k: int = 3, questions=None):
+    """
+    Оценка ответа без LLM (extractive.ExtractiveAnswerer) по тем же метрикам.
+
+    Для каждого вопроса ищутся retrieve_k фрагментов, как в aask(), и из них собирается ответ.
+    Ранжирование - статьи в порядке их вклада в ответ (первая - статья заголовка и ссылки),
+    затем остальные найденные фрагменты, так что Hit@1 - доля ответов по статье нужной темы.
+
+    Returns:
+        (результаты по k, латентность сборки ответа на запрос в мс без поиска)
+    """
+    questions = questions or _load_questions(benchmark_path)
+    vectors = bot.embeddings.embed_queries([item["question"] for item in questions])
+
+    latencies = []
+    ranked_categories = []
+    for vector in vectors:
+        docs = bot._retrieve(vector, retrieve_k)
+        started = time.perf_counter()
+        selected = bot.extractive.extract(vector, docs)
+        latencies.append(time.perf_counter() - started)
+
+        order = list(dict.fromkeys([i for _, i, _, _ in selected] + list(range(len(docs)))))
+        ranked_categories.append([docs[i].metadata.get("category") for i in order])
+
+    latency = {
+        "mean_ms": float(np.mean(latencies) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000)
+    }
+    return _aggregate(questions, ranked_categories, ks), latency
+
+
+def sweep(
+        benchmark_path: str,
+        dataset_path: str,
+        ks=(1, 3, 5),
+        fetch_ks=(10, 20, 40),
+        lambda_mults=(0.3, 0.5, 0.7),
+        chunk_configs=((1024, 128),),
+        work_dir: str = "./sweep_indexes",
+        output_path: str = None
+):
+    """
+    Перебор параметров ретривера: k, fetch_k, lambda_mult и разбиения на фрагменты.
+
+    Для каждого (chunk_size, chunk_overlap) собирается отдельный индекс в work_dir
+    (эмбеддинги берутся из кэша, если фрагменты уже кодировались), затем для всех
+    fetch_k x lambda_mult считается батчевая оценка. Результат - таблица строк,
+    при output_path сохраняется в CSV.
+    """
+    from model import PsychologistRAG
+
+    questions = _load_questions(benchmark_path)
+    bot = None
+    table = []
+
+    for chunk_size, chunk_overlap in chunk_configs:
+        faiss_path = os.path.join(work_dir, f"faiss_{chunk_size}_{chunk_overlap}")
+        if bot is None:
+            # lazy: индекс по умолчанию не загружается и не собирается, каждое разбиение собирается один раз
+            bot = PsychologistRAG(faiss_path=faiss_path, answer_cache_size=0, lazy=True)
+        bot.faiss_path = faiss_path
+        bot.vectorize_dataset(dataset_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        query_vectors = bot.embeddings.embed_documents([item["question"] for item in questions])
+
+        runs = [("similarity", None, None)] + [
+            ("mmr", fetch_k, lambda_mult) for fetch_k in fetch_ks for lambda_mult in lambda_mults
+        ]
+        for mode, fetch_k, lambda_mult in runs:
+            results, latency = evaluate_retrieval_batched(
+                bot,
+                benchmark_path,
+                ks=ks,
+                mode=mode,
+                fetch_k=fetch_k or max(ks),
+                lambda_mult=lambda_mult or 0.5,
+                questions=questions,
+                query_vectors=query_vectors
+            )
+            row = {
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "chunks": bot.db.index.ntotal,
+                "mode": mode,
+                "fetch_k": fetch_k,
+                "lambda_mult": lambda_mult,
+                "latency_mean_ms": round(latency["mean_ms"], 3),
+                "latency_p95_ms": round(latency["p95_ms"], 3)
+            }
+            for k in ks:
+                row.update({name: round(value, 3) for name, value in results[k]["overall"].items()})
+            table.append(row)
+            print(row)
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(table[0]))
+            writer.writeheader()
+            writer.writerows(table)
+
+    return table
+
+
+def _parse_chunks(value: str):
+    chunk_size, chunk_overlap = value.split(":")
+    return int(chunk_size), int(chunk_overlap)
+
+
+if __name__ == "__main__":
+    PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+
+    parser = argparse.ArgumentParser(description="Батчевая оценка ретривера и перебор параметров")
+    parser.add_argument("--bench", default=os.path.join(PROJECT_ROOT, "eval", "psychrag_bench_100.json"))
+    parser.add_argument("--faiss-path", default=os.path.join(PROJECT_ROOT, "faiss_index"))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--mode", choices=["mmr", "similarity"], default="mmr")
+    parser.add_argument("--sweep", action="store_true", help="Перебор fetch_k, lambda_mult и разбиений")
+    parser.add_argument("--extractive", action="store_true", help="Оценить ответ из фрагментов без LLM")
+    parser.add_argument("--dataset", default=os.path.join(PROJECT_ROOT, "data", "final_dataset.json"))
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--lambda-mult", type=float, nargs="+", default=[0.3, 0.5, 0.7])
+    parser.add_argument("--chunks", type=_parse_chunks, nargs="+", default=[(1024, 128)],
+                        help="Разбиения в формате chunk_size:chunk_overlap")
+    parser.add_argument("--work-dir", default=os.path.join(PROJECT_ROOT, "sweep_indexes"))
+    parser.add_argument("--output", help="CSV с таблицей результатов")
+    args = parser.parse_args()
+
+    if args.sweep:
+        sweep(
+            args.bench,
+            args.dataset,
+            ks=args.k,
+            fetch_ks=args.fetch_k,
+            lambda_mults=args.lambda_mult,
+            chunk_configs=args.chunks,
+            work_dir=args.work_dir,
+            output_path=args.output
+        )
+    else:
+        from model import PsychologistRAG
+
+        bot = PsychologistRAG(faiss_path=args.faiss_path, answer_cache_size=0)
+        if args.extractive:
+            results, latency = evaluate_extractive(bot, args.bench, ks=args.k)
+        else:
+            results, latency = evaluate_retrieval_batched(
+                bot, args.bench, ks=args.k, mode=args.mode, fetch_k=args.fetch_k[0], lambda_mult=args.lambda_mult[0]
+            )
+        for k, stats in results.items():
+            print(f"\n=== k = {k} ===")
+            for name, value in stats["overall"].items():
+                print(f"{name}: {value:.3f}")
+        stage = "сборки ответа" if args.extractive else "ретривера"
+        print(f"\nЛатентность {stage}: {latency['mean_ms']:.3f} мс (p95 {latency['p95_ms']:.3f} мс)")
@@ -0,0 +1,151 @@
+"""
+Локальная заглушка чат-модели для бенчмарков и офлайн-проверок.
+
+Отвечает заранее заданным JSON в формате PsychoResponse с настраиваемой задержкой,
+поэтому PsychologistRAG можно гонять под нагрузкой без сети и API-ключа.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+DEFAULT_RESPONSE = json.dumps(
+    {
+        "title": "Поддержка при тревоге",
+        "solution": "Понимаю, как вам сейчас непросто. Попробуйте дыхательную технику 4-7-8 "
+                    "и запишите мысли, которые вызывают тревогу.",
+        "link": "https://example.org/anxiety"
+    },
+    ensure_ascii=False
+)
+
+
+class FakeLLMError(RuntimeError):
+    """Ошибка, которую заглушка возвращает с вероятностью error_rate (как 5xx от API)"""
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Чат-модель с детерминированным ответом и задержкой latency (+ равномерный jitter по seed).
+    Число токенов оценивается по словам, чтобы цепочка получала usage_metadata как от реальной модели.
+    В потоковом режиме latency - задержка до первого токена, далее по слову раз в token_latency.
+
+    Для проверки устойчивости: с вероятностью slow_rate задержка равна slow_latency (хвост задержек),
+    с вероятностью error_rate после задержки выбрасывается FakeLLMError.
+    """
+
+    response: str = DEFAULT_RESPONSE
+    latency: float = 0.5
+    jitter: float = 0.0
+    seed: int = 0
+    token_latency: float = 0.02
+    error_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 5.0
+
+    _rng: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _delay(self) -> float:
+        if not self.jitter and not self.slow_rate:
+            return self.latency
+        with self._lock:
+            if self.slow_rate and self._rng.random() < self.slow_rate:
+                return self.slow_latency
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _check_error(self):
+        if not self.error_rate:
+            return
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise FakeLLMError("Заглушка LLM: имитация ошибки API")
+
+    def _usage(self, messages: List[BaseMessage]) -> dict:
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(self.response.split())
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages: List[BaseMessage]) -> List[ChatGenerationChunk]:
+        """Ответ по словам (с пробелами), usage_metadata - в последнем фрагменте"""
+        tokens = re.findall(r"\s*\S+\s*", self.response) or [self.response]
+        chunks = [ChatGenerationChunk(message=AIMessageChunk(content=token)) for token in tokens[:-1]]
+        chunks.append(ChatGenerationChunk(
+            message=AIMessageChunk(content=tokens[-1], usage_metadata=self._usage(messages))
+        ))
+        return chunks
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> ChatResult:
+        time.sleep(self._delay())
+        self._check_error()
+        return self._result(messages)
+
+    async def _agenerate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        self._check_error()
+        return self._result(messages)
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._delay())
+        self._check_error()
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                time.sleep(self.token_latency)
+            yield chunk
+
+    async def _astream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._delay())
+        self._check_error()
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield chunk
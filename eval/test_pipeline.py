@@ -4,15 +4,6 @@ load_dotenv()
 
 api_key = os.getenv("MISTRAL_API_KEY")
 
-model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-model_kwargs = {"device": "cpu"}
-encode_kwargs = {"normalize_embeddings": False}
-embeddings = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs,
-)
-
 
 def main():
     rag_system = PsychologistRAG(faiss_path="../faiss_index")
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+from context import split_sentences
+from mmr import normalize_rows
+
+# Короче - заголовки, подписи и обрывки списков
+MIN_SENTENCE_CHARS = 40
+NOTE = "Ответ составлен автоматически из фрагментов статей, без обработки языковой моделью."
+
+
+def _clean(sentence: str) -> str:
+    """Без разметки markdown в начале строки (заголовки, пункты списков, цитаты)"""
+    return sentence.lstrip("#*->• ").strip()
+
+
+class ExtractiveAnswerer:
+    """
+    Ответ без LLM из найденных фрагментов.
+
+    Предложения фрагментов кодируются тем же энкодером, что и вопросы, и ранжируются по косинусной
+    близости к эмбеддингу вопроса; почти одинаковые предложения (перекрытия соседних фрагментов)
+    отбрасываются. Векторы предложений хранятся в LRU, поэтому часто находимые фрагменты кодируются
+    один раз. Выбранные предложения выводятся по статьям в исходном порядке, заголовок и ссылка -
+    статьи лучшего предложения.
+
+    Args:
+        embeddings: Модель эмбеддингов
+        max_sentences: Не больше стольких предложений в ответе
+        max_chars: Не длиннее стольких символов (без списка источников)
+        duplicate_threshold: Близость, начиная с которой предложение считается повтором выбранного
+        cache_size: Размер LRU-кэша эмбеддингов предложений
+    """
+
+    def __init__(
+            self,
+            embeddings,
+            max_sentences: int = 5,
+            max_chars: int = 900,
+            duplicate_threshold: float = 0.9,
+            cache_size: int = 4096
+    ):
+        self.embeddings = embeddings
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.duplicate_threshold = duplicate_threshold
+        self.cache_size = cache_size
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _encode(self, sentences: List[str]) -> np.ndarray:
+        """Нормированные эмбеддинги предложений, отсутствующие в LRU кодируются одним вызовом"""
+        with self._lock:
+            vectors = [self._vectors.get(s) for s in sentences]
+            for s, v in zip(sentences, vectors):
+                if v is not None:
+                    self._vectors.move_to_end(s)
+
+        missing = [s for s, v in zip(sentences, vectors) if v is None]
+        if missing:
+            encoded = dict(zip(missing, normalize_rows(
+                np.asarray(self.embeddings.embed_documents(missing), dtype=np.float32)
+            )))
+            with self._lock:
+                self._vectors.update(encoded)
+                while len(self._vectors) > self.cache_size:
+                    self._vectors.popitem(last=False)
+            vectors = [encoded[s] if v is None else v for s, v in zip(sentences, vectors)]
+
+        return np.stack(vectors)
+
+    def extract(self, vector, docs) -> List[Tuple[float, int, int, str]]:
+        """Выбранные предложения (близость, номер фрагмента в docs, номер предложения, текст) по убыванию близости"""
+        candidates = []
+        seen = set()
+        for i, doc in enumerate(docs):
+            for j, sentence in enumerate(split_sentences(doc.page_content)):
+                sentence = _clean(sentence)
+                if sentence and sentence not in seen:
+                    seen.add(sentence)
+                    candidates.append((i, j, sentence))
+        if not candidates:
+            return []
+        # Если во фрагментах только короткие строки, берутся они
+        candidates = [c for c in candidates if len(c[2]) >= MIN_SENTENCE_CHARS] or candidates
+
+        vectors = self._encode([sentence for *_, sentence in candidates])
+        query = normalize_rows(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        scores = vectors @ query
+
+        chosen = []
+        used = 0
+        for c in np.argsort(-scores, kind="stable"):
+            sentence = candidates[c][2]
+            if chosen and used + len(sentence) > self.max_chars:
+                continue
+            if chosen and float((vectors[chosen] @ vectors[c]).max()) >= self.duplicate_threshold:
+                continue
+            chosen.append(c)
+            used += len(sentence)
+            if len(chosen) >= self.max_sentences:
+                break
+
+        return [(float(scores[c]), *candidates[c]) for c in chosen]
+
+    def answer(self, vector, docs) -> dict:
+        """Ответ в формате PsychoResponse"""
+        selected = self.extract(vector, docs)
+        if not selected:
+            meta = docs[0].metadata if docs else {}
+            return {
+                "title": meta.get("name", "Материалы по вашему вопросу"),
+                "solution": NOTE,
+                "link": meta.get("link", "")
+            }
+
+        # Статьи в порядке лучшего предложения, внутри статьи - исходный порядок текста
+        articles = OrderedDict()
+        for _, i, j, sentence in selected:
+            key = docs[i].metadata.get("id", docs[i].id)
+            articles.setdefault(key, []).append((i, j, sentence))
+
+        paragraphs, sources = [], []
+        for sentences in articles.values():
+            paragraphs.append(" ".join(sentence for *_, sentence in sorted(sentences)))
+            sources.append(docs[sentences[0][0]].metadata)
+
+        best = sources[0]
+        if len(sources) > 1:
+            paragraphs.append("Источники: " + "; ".join(
+                f"{meta.get('name', 'Источник')} ({meta.get('link', '')})" for meta in sources
+            ))
+        paragraphs.append(NOTE)
+        return {
+            "title": best.get("name", "Материалы по вашему вопросу"),
+            "solution": "\n\n".join(paragraphs),
+            "link": best.get("link", "")
+        }
@@ -0,0 +1,131 @@
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq8")
+METRICS = ("l2", "cosine")
+MIN_POINTS_PER_CENTROID = 39
+
+
+class IndexSpec:
+    """
+    Описание FAISS индекса.
+
+    index_type:
+        flat     - точный перебор (как FAISS.from_documents)
+        hnsw     - граф HNSW, без обучения
+        ivf_flat - инвертированные списки с точными векторами
+        ivf_pq   - инвертированные списки с product quantization
+        ivf_sq8  - инвертированные списки со скалярным 8-битным квантованием
+    metric:
+        l2     - евклидово расстояние по ненормированным векторам
+        cosine - скалярное произведение нормированных векторов
+    """
+
+    def __init__(
+            self,
+            index_type: str = "flat",
+            metric: str = "l2",
+            nlist: Optional[int] = None,
+            nprobe: int = 8,
+            hnsw_m: int = 32,
+            ef_search: int = 64,
+            pq_m: int = 16,
+            train_size: int = 20000
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Неизвестный тип индекса: {index_type}. Доступны: {', '.join(INDEX_TYPES)}")
+        if metric not in METRICS:
+            raise ValueError(f"Неизвестная метрика: {metric}. Доступны: {', '.join(METRICS)}")
+        self.index_type = index_type
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.train_size = train_size
+
+    @property
+    def normalize(self) -> bool:
+        return self.metric == "cosine"
+
+    @property
+    def trainable(self) -> bool:
+        return self.index_type.startswith("ivf")
+
+    @property
+    def distance_strategy(self) -> DistanceStrategy:
+        if self.metric == "cosine":
+            return DistanceStrategy.MAX_INNER_PRODUCT
+        return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "IndexSpec":
+        return cls(**(data or {}))
+
+    def describe(self, n_train: int) -> str:
+        """Строка для faiss.index_factory"""
+        if self.index_type == "flat":
+            return "Flat"
+        if self.index_type == "hnsw":
+            return f"HNSW{self.hnsw_m}"
+
+        nlist = self._nlist(n_train)
+        if self.index_type == "ivf_flat":
+            return f"IVF{nlist},Flat"
+        if self.index_type == "ivf_sq8":
+            return f"IVF{nlist},SQ8"
+        return f"IVF{nlist},PQ{self.pq_m}x{self._pq_bits(n_train)}"
+
+    def _nlist(self, n_train: int) -> int:
+        # Рекомендация FAISS - не меньше MIN_POINTS_PER_CENTROID обучающих векторов на кластер
+        return self.nlist or max(1, min(int(4 * math.sqrt(n_train)), n_train // MIN_POINTS_PER_CENTROID))
+
+    @staticmethod
+    def _pq_bits(n_train: int) -> int:
+        return max(1, min(8, int(math.log2(max(n_train, 2)))))
+
+    def can_train(self, n_train: int) -> bool:
+        """Хватает ли n_train векторов, чтобы обучить центроиды IVF и словари PQ без предупреждений FAISS"""
+        if not self.trainable:
+            return True
+        n_train = min(n_train, self.train_size)
+        centroids = self._nlist(n_train)
+        if self.index_type == "ivf_pq":
+            centroids = max(centroids, 2 ** self._pq_bits(n_train))
+        return n_train >= MIN_POINTS_PER_CENTROID * centroids
+
+    def create(self, dim: int, train_vectors: Optional[np.ndarray] = None):
+        """Создаёт пустой индекс; IVF-индексы обучаются на train_vectors"""
+        n_train = 0 if train_vectors is None else len(train_vectors)
+        if self.trainable and not n_train:
+            raise ValueError(f"Индексу {self.index_type} нужны векторы для обучения")
+
+        metric = faiss.METRIC_INNER_PRODUCT if self.metric == "cosine" else faiss.METRIC_L2
+        index = faiss.index_factory(dim, self.describe(n_train), metric)
+        if self.trainable:
+            index.train(np.ascontiguousarray(train_vectors[:self.train_size], dtype=np.float32))
+        self.configure(index)
+        return index
+
+    def configure(self, index):
+        """Выставляет параметры поиска (nprobe, efSearch)"""
+        if self.trainable:
+            ivf = faiss.extract_index_ivf(index)
+            ivf.nprobe = self.nprobe
+            # Нужен для reconstruct() в MMR и при удалении
+            ivf.make_direct_map()
+        elif self.index_type == "hnsw":
+            index.hnsw.efSearch = self.ef_search
+
+
+def index_bytes(index) -> int:
+    """Размер сериализованного индекса в байтах"""
+    return faiss.serialize_index(index).nbytes
@@ -0,0 +1,437 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from chunk_store import save_store
+from chunking import ChunkPolicy, Chunker
+from dataset import article_hash
+from embedding_cache import text_hash
+from index_factory import IndexSpec
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MANIFEST_NAME = "manifest.json"
+
+
+class IndexManifest:
+    """
+    Манифест индекса: id статьи -> хэш содержимого и id её фрагментов в docstore.
+    Хранится рядом с FAISS индексом и позволяет обновлять только изменившиеся статьи.
+    """
+
+    def __init__(
+            self,
+            chunk_size: int,
+            chunk_overlap: int,
+            articles: Optional[Dict[str, dict]] = None,
+            index: Optional[dict] = None,
+            chunking: Optional[dict] = None
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.articles = articles or {}
+        # Параметры IndexSpec, с которыми собран индекс
+        self.index = index or IndexSpec().to_dict()
+        # Параметры Chunker; None - индекс собран RecursiveCharacterTextSplitter(chunk_size, chunk_overlap)
+        self.chunking = chunking
+
+    @property
+    def index_spec(self) -> IndexSpec:
+        return IndexSpec.from_dict(self.index)
+
+    @property
+    def chunker(self) -> Chunker:
+        """Разбиение, с которым собран индекс (им же режутся добавляемые статьи)"""
+        if self.chunking is None:
+            return Chunker(ChunkPolicy(self.chunk_size, self.chunk_overlap, structured=False))
+        return Chunker.from_dict(self.chunking)
+
+    @classmethod
+    def load(cls, folder_path: str) -> Optional["IndexManifest"]:
+        path = os.path.join(folder_path, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["chunk_size"], data["chunk_overlap"], data["articles"], data.get("index"), data.get("chunking"))
+
+    @classmethod
+    def from_store(cls, db, chunk_size: int, chunk_overlap: int) -> "IndexManifest":
+        """
+        Восстанавливает манифест по docstore индекса, собранного без манифеста.
+        Хэши неизвестны, поэтому такие статьи при upsert всегда переиндексируются.
+        """
+        manifest = cls(chunk_size, chunk_overlap)
+        for doc_id in db.index_to_docstore_id.values():
+            doc = db.docstore.search(doc_id)
+            article_id = str(doc.metadata.get("id"))
+            entry = manifest.articles.setdefault(article_id, {"hash": "", "chunks": []})
+            entry["chunks"].append(doc_id)
+        return manifest
+
+    def save(self, folder_path: str):
+        with open(os.path.join(folder_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "chunk_size": self.chunk_size,
+                    "chunk_overlap": self.chunk_overlap,
+                    "index": self.index,
+                    "chunking": self.chunking,
+                    "articles": self.articles
+                },
+                f,
+                ensure_ascii=False
+            )
+
+
+def atomic_save(db, manifest: IndexManifest, folder_path: str):
+    """
+    Сохраняет индекс, фрагменты и манифест в новую директорию версии '<folder_path>.v<время>'
+    и переключает на неё символическую ссылку folder_path заменой ссылки (os.replace атомарен).
+    Путь folder_path существует всё время: читатель, в том числе перезапущенный процесс пула,
+    видит либо старую, либо новую версию индекса целиком. Прежние версии удаляются, процессы,
+    уже отобразившие их файлы в память, продолжают их читать.
+
+    Индекс старого формата (обычная директория) при первом сохранении переносится в версию,
+    пока ссылка не создана, пути нет. Без поддержки символических ссылок (Windows без прав)
+    директория подменяется переименованием с тем же коротким окном.
+    """
+    folder_path = os.path.normpath(folder_path)
+    version_path = f"{folder_path}.v{time.time_ns()}"
+    save_store(db, version_path)
+    manifest.save(version_path)
+
+    link_path = folder_path + ".link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    try:
+        # Относительная ссылка: директорию с индексом можно переносить целиком
+        os.symlink(os.path.basename(version_path), link_path, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        _replace_directory(version_path, folder_path)
+        return
+
+    if os.path.isdir(folder_path) and not os.path.islink(folder_path):
+        os.replace(folder_path, f"{folder_path}.v0")
+    os.replace(link_path, folder_path)
+
+    prefix = os.path.basename(folder_path) + "."
+    parent = os.path.dirname(folder_path) or "."
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        version = name[len(prefix) + 1:] if name.startswith(prefix + "v") else ""
+        stale = version.isdigit() or name in (prefix + "tmp", prefix + "old")
+        if stale and path != version_path:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _replace_directory(version_path: str, folder_path: str):
+    old_path = folder_path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(folder_path):
+        os.replace(folder_path, old_path)
+    os.replace(version_path, folder_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def new_store(embeddings, spec: IndexSpec, train_vectors: np.ndarray) -> FAISS:
+    """Пустой FAISS store с индексом по spec (IVF-индексы обучаются на train_vectors)"""
+    index = spec.create(train_vectors.shape[1], train_vectors)
+    return FAISS(
+        embeddings,
+        index,
+        InMemoryDocstore(),
+        {},
+        distance_strategy=spec.distance_strategy
+    )
+
+
+def remove_chunks(db: FAISS, ids: List[str], spec: IndexSpec):
+    """
+    Удаляет фрагменты из store.
+
+    Flat индекс поддерживает remove_ids со сдвигом номеров, как ожидает FAISS.delete.
+    HNSW не умеет удалять, а IVF не перенумеровывает векторы, поэтому для них
+    оставшиеся векторы восстанавливаются и добавляются заново в очищенный индекс (без переобучения).
+    """
+    if spec.index_type == "flat":
+        db.delete(ids)
+        return
+
+    removed = set(ids)
+    kept = [(i, doc_id) for i, doc_id in sorted(db.index_to_docstore_id.items()) if doc_id not in removed]
+    vectors = np.stack([db.index.reconstruct(int(i)) for i, _ in kept]) if kept else None
+
+    db.index.reset()
+    if vectors is not None:
+        db.index.add(vectors)
+    db.docstore.delete(list(removed))
+    db.index_to_docstore_id = {j: doc_id for j, (_, doc_id) in enumerate(kept)}
+
+
+_worker_encoder = None
+
+
+def _init_worker(encoder_kwargs: dict, threads: int):
+    """Каждый процесс пула загружает свою копию энкодера"""
+    global _worker_encoder
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    torch.set_num_threads(threads)
+    _worker_encoder = HuggingFaceEmbeddings(**encoder_kwargs)
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_encoder.embed_documents(texts), dtype=np.float32)
+
+
+def _split_rows(chunker: Chunker, rows: List[dict]) -> List[List[Document]]:
+    return [chunker.split(row) for row in rows]
+
+
+def _peak_rss_mb() -> float:
+    """Пиковое потребление памяти процессом и его дочерними процессами, МБ"""
+    if resource is None:
+        return 0.0
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_kb, children_kb) / 1024
+
+
+class BuildStats:
+    """Статистика сборки индекса: время по этапам, скорость и пиковая память"""
+
+    def __init__(self):
+        self.stages = {"split": 0.0, "cache": 0.0, "embed": 0.0, "index": 0.0}
+        self.chunks = 0
+        self.encoded = 0
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self) -> dict:
+        total = time.perf_counter() - self._started
+        return {
+            "chunks": self.chunks,
+            "encoded": self.encoded,
+            "total_sec": round(total, 3),
+            "chunks_per_sec": round(self.chunks / total, 1) if total else 0.0,
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "stages_sec": {name: round(value, 3) for name, value in self.stages.items()}
+        }
+
+
+class IndexBuilder:
+    """
+    Потоковая сборка индекса.
+
+    Статьи читаются лениво и режутся на фрагменты разбиением из манифеста (при split_workers > 1 -
+    в пуле процессов, с сохранением порядка статей), фрагменты кодируются батчами по batch_size
+    (при workers > 1 - в пуле процессов), а готовые векторы сразу добавляются в индекс.
+    В памяти одновременно находится не больше 2 * workers батчей.
+    """
+
+    def __init__(
+            self,
+            embeddings,
+            encoder,
+            encoder_kwargs: dict,
+            cache=None,
+            batch_size: int = 64,
+            workers: Optional[int] = None,
+            spec: Optional[IndexSpec] = None,
+            split_workers: Optional[int] = None
+    ):
+        """
+        Args:
+            embeddings: Эмбеддинги, с которыми FAISS store будет кодировать запросы
+            encoder: Энкодер фрагментов для сборки в текущем процессе (workers <= 1)
+            encoder_kwargs (dict): Параметры HuggingFaceEmbeddings для процессов пула
+            cache (EmbeddingCache): Дисковый кэш эмбеддингов фрагментов
+            batch_size (int): Размер батча фрагментов
+            workers (int): Число процессов-энкодеров, по умолчанию - число ядер
+            spec (IndexSpec): Тип индекса для новой сборки, по умолчанию flat L2
+            split_workers (int): Число процессов для разбиения статей, по умолчанию как workers
+        """
+        self.embeddings = embeddings
+        self.encoder = encoder
+        self.encoder_kwargs = encoder_kwargs
+        self.cache = cache
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.spec = spec or IndexSpec()
+        self.split_workers = self.workers if split_workers is None else split_workers
+        # Для IVF векторы копятся, пока не наберётся выборка для обучения
+        self._pending = []
+        self._pending_rows = 0
+        self.stats = BuildStats()
+
+    def _split(self, rows: Iterable[dict], chunker: Chunker, group_size: int = 8) -> Iterator[tuple]:
+        """Пары (статья, фрагменты) в порядке статей; в пуле статьи отправляются группами по group_size"""
+        if self.split_workers <= 1:
+            for row in rows:
+                yield row, chunker.split(row)
+            return
+
+        def groups():
+            group = []
+            for row in rows:
+                group.append(row)
+                if len(group) >= group_size:
+                    yield group
+                    group = []
+            if group:
+                yield group
+
+        # spawn: процессу разбиения не нужны потоки и состояние родителя
+        with ProcessPoolExecutor(
+                max_workers=self.split_workers,
+                mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            pending = deque()
+            for group in groups():
+                pending.append((group, pool.submit(_split_rows, chunker, group)))
+                # Не больше 2 * split_workers групп в полёте, чтобы не читать весь датасет вперёд
+                while len(pending) > 2 * self.split_workers:
+                    group, future = pending.popleft()
+                    yield from zip(group, future.result())
+            while pending:
+                group, future = pending.popleft()
+                yield from zip(group, future.result())
+
+    def _batches(self, rows: Iterable[dict], manifest: IndexManifest) -> Iterator[List[Document]]:
+        batch = []
+        articles = self._split(rows, manifest.chunker)
+        while True:
+            with self.stats.stage("split"):
+                row, chunks = next(articles, (None, None))
+                if row is None:
+                    break
+                manifest.articles[str(row["id"])] = {
+                    "hash": article_hash(row),
+                    "chunks": [c.id for c in chunks]
+                }
+            batch.extend(chunks)
+            while len(batch) >= self.batch_size:
+                yield batch[:self.batch_size]
+                batch = batch[self.batch_size:]
+        if batch:
+            yield batch
+
+    def _lookup(self, chunks: List[Document]):
+        """Возвращает векторы из кэша (None для отсутствующих) и тексты, которые нужно закодировать"""
+        texts = [c.page_content for c in chunks]
+        if self.cache is None:
+            return texts, [None] * len(texts), texts
+        with self.stats.stage("cache"):
+            vectors = self.cache.get_many([text_hash(t) for t in texts])
+        missing = [t for t, v in zip(texts, vectors) if v is None]
+        return texts, vectors, missing
+
+    def _merge(self, texts, vectors, encoded: np.ndarray):
+        """Подставляет закодированные векторы на места промахов кэша"""
+        if len(encoded):
+            self.stats.encoded += len(encoded)
+            missing_texts = [t for t, v in zip(texts, vectors) if v is None]
+            if self.cache is not None:
+                with self.stats.stage("cache"):
+                    self.cache.put_many([text_hash(t) for t in missing_texts], encoded)
+        encoded = iter(encoded)
+        return [v if v is not None else next(encoded) for v in vectors]
+
+    def _add(self, db, chunks: List[Document], vectors):
+        vectors = np.array(vectors, dtype=np.float32)
+        if self.spec.normalize:
+            faiss.normalize_L2(vectors)
+
+        if db is None and self.spec.trainable:
+            self._pending.append((chunks, vectors))
+            self._pending_rows += len(chunks)
+            if self._pending_rows < self.spec.train_size:
+                return None
+            return self._flush_pending()
+
+        with self.stats.stage("index"):
+            if db is None:
+                db = new_store(self.embeddings, self.spec, vectors)
+            db.add_embeddings(
+                zip([c.page_content for c in chunks], vectors),
+                metadatas=[c.metadata for c in chunks],
+                ids=[c.id for c in chunks]
+            )
+        self.stats.chunks += len(chunks)
+        return db
+
+    def _flush_pending(self):
+        """Обучает IVF индекс на накопленных векторах и добавляет их"""
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        with self.stats.stage("train"):
+            db = new_store(self.embeddings, self.spec, np.concatenate([v for _, v in pending]))
+        for chunks, vectors in pending:
+            db = self._add(db, chunks, vectors)
+        return db
+
+    def build(self, rows: Iterable[dict], manifest: IndexManifest, db=None):
+        """Индексирует статьи и записывает их фрагменты в манифест. Возвращает FAISS store"""
+        batches = self._batches(rows, manifest)
+
+        if self.workers <= 1:
+            for chunks in batches:
+                texts, vectors, missing = self._lookup(chunks)
+                with self.stats.stage("embed"):
+                    encoded = np.asarray(self.encoder.embed_documents(missing), dtype=np.float32) \
+                        if missing else np.empty((0, 0), dtype=np.float32)
+                db = self._add(db, chunks, self._merge(texts, vectors, encoded))
+        else:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn, как и у пула разбиения: fork после запуска потоков torch/OpenMP может зависнуть
+            with ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.encoder_kwargs, threads)
+            ) as pool:
+                pending = deque()
+                for chunks in batches:
+                    texts, vectors, missing = self._lookup(chunks)
+                    future = pool.submit(_embed_batch, missing) if missing else None
+                    pending.append((chunks, texts, vectors, future))
+                    # Ограничиваем число батчей в полёте, чтобы память не росла с размером корпуса
+                    while len(pending) > 2 * self.workers:
+                        db = self._drain(db, pending.popleft())
+                while pending:
+                    db = self._drain(db, pending.popleft())
+
+        if self._pending:
+            db = self._flush_pending()
+        if self.cache is not None:
+            self.cache.flush()
+        return db
+
+    def _drain(self, db, item):
+        chunks, texts, vectors, future = item
+        with self.stats.stage("embed"):
+            encoded = future.result() if future is not None else np.empty((0, 0), dtype=np.float32)
+        return self._add(db, chunks, self._merge(texts, vectors, encoded))
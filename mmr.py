@@ -0,0 +1,137 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(
+        queries: np.ndarray,
+        candidates: np.ndarray,
+        k: int,
+        lambda_mult: float = 0.5,
+        valid: Optional[np.ndarray] = None,
+        groups: Optional[np.ndarray] = None,
+        max_per_group: Optional[int] = None
+) -> np.ndarray:
+    """
+    Жадный MMR сразу для пакета запросов на нормированных векторах.
+
+    Первым берётся самый близкий к запросу кандидат, далее - максимум
+    lambda_mult * близость к запросу - (1 - lambda_mult) * макс. близость к уже выбранным.
+    Без ограничения по группам выбор совпадает с maximal_marginal_relevance из LangChain.
+
+    Args:
+        queries: (B, d) векторы запросов
+        candidates: (B, F) x d векторы кандидатов
+        k: Сколько кандидатов выбрать
+        lambda_mult: Баланс релевантности и разнообразия
+        valid: (B, F) маска существующих кандидатов
+        groups: (B, F) номер группы кандидата (статьи)
+        max_per_group: Не больше стольких кандидатов одной группы
+
+    Returns:
+        (B, k) номера выбранных кандидатов по порядку выбора, -1 - выбирать больше нечего
+    """
+    batch, fetch_k, _ = candidates.shape
+    relevance = np.einsum("bd,bfd->bf", queries, candidates)
+    similarity = np.einsum("bfd,bgd->bfg", candidates, candidates)
+
+    available = np.ones((batch, fetch_k), dtype=bool) if valid is None else valid.copy()
+    redundancy = np.full((batch, fetch_k), -np.inf, dtype=relevance.dtype)
+    group_counts = np.zeros((batch, fetch_k), dtype=np.int32)
+    selected = np.full((batch, k), -1, dtype=np.int64)
+    rows = np.arange(batch)
+
+    for step in range(min(k, fetch_k)):
+        score = relevance if step == 0 else lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        score = np.where(available, score, -np.inf)
+        pick = score.argmax(axis=1)
+        found = np.isfinite(score[rows, pick])
+        if not found.any():
+            break
+        rows_found, pick = rows[found], pick[found]
+
+        selected[rows_found, step] = pick
+        available[rows_found, pick] = False
+        redundancy[rows_found] = np.maximum(redundancy[rows_found], similarity[rows_found, pick])
+        if groups is not None and max_per_group:
+            group_counts[rows_found] += groups[rows_found] == groups[rows_found, pick][:, None]
+            available &= group_counts < max_per_group
+
+    return selected
+
+
+class VectorMMR:
+    """
+    MMR-поиск по FAISS store без поштучного reconstruct() и цикла Python по кандидатам.
+
+    Векторы кандидатов пакета запросов восстанавливаются из индекса одним reconstruct_batch()
+    (для PQ - приближённые, как и у reconstruct() в LangChain) и нормируются, выбор делается
+    матричными операциями. Копия всех векторов корпуса не создаётся, поэтому индекс, отображённый
+    в память, остаётся общим для процессов. max_per_article ограничивает число фрагментов одной
+    статьи в выдаче (статья берётся из id фрагмента '<id статьи>:<номер>').
+    После изменения индекса объект нужно создать заново.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        index = db.index
+        codes = {}
+        self.articles = np.array(
+            [codes.setdefault(str(db.index_to_docstore_id[row]).rsplit(":", 1)[0], len(codes))
+             for row in range(index.ntotal)],
+            dtype=np.int64
+        )
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Нормированные векторы строк rows любой формы: каждая строка восстанавливается один раз"""
+        unique, inverse = np.unique(rows, return_inverse=True)
+        vectors = normalize_rows(self.db.index.reconstruct_batch(unique).astype(np.float32))
+        return vectors[inverse.reshape(rows.shape)]
+
+    def select(
+            self,
+            queries,
+            rows,
+            ks: Sequence[int],
+            lambda_mult: float = 0.5,
+            max_per_article: Optional[int] = None
+    ) -> List[List[int]]:
+        """Номера строк индекса, выбранные MMR из строк-кандидатов rows (B, F), -1 - пустой кандидат"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size or not self.db.index.ntotal:
+            return [[] for _ in ks]
+        valid = rows >= 0
+        safe_rows = np.where(valid, rows, 0)
+        chosen = mmr_select(
+            normalize_rows(np.asarray(queries, dtype=np.float32)),
+            self.vectors(safe_rows),
+            max(ks),
+            lambda_mult=lambda_mult,
+            valid=valid,
+            groups=self.articles[safe_rows] if max_per_article else None,
+            max_per_group=max_per_article
+        )
+        # Выбор жадный, поэтому выбор для меньшего k - префикс выбора для max(ks)
+        return [[int(rows[b, i]) for i in chosen[b, :k] if i >= 0] for b, k in enumerate(ks)]
+
+    def search(
+            self,
+            queries,
+            ks: Sequence[int],
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5,
+            max_per_article: Optional[int] = None
+    ) -> List[list]:
+        """MMR-поиск для пакета запросов: один index.search на все запросы. Возвращает документы"""
+        queries = np.asarray(queries, dtype=np.float32)
+        _, rows = self.db.index.search(queries, fetch_k)
+        return [
+            [self.db.docstore.search(self.db.index_to_docstore_id[row]) for row in selected]
+            for selected in self.select(queries, rows, ks, lambda_mult, max_per_article)
+        ]
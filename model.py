@@ -1,29 +1,54 @@
+import asyncio
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
 from dotenv import load_dotenv
-from langchain_classic.memory import ConversationBufferMemory
-from langchain_community.document_loaders import DataFrameLoader
 from langchain_community.vectorstores import FAISS
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.outputs import Generation
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableMap
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_mistralai.chat_models import ChatMistralAI
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pydantic import BaseModel, Field
 
+from answer_cache import SemanticAnswerCache
+from batching import MicroBatcher
+from chunk_store import has_chunks, load_store, materialize
+from chunking import Chunker, default_chunker
+from context import ContextBudgeter
+from dataset import article_hash, default_dataset, iter_rows, load_dataset_manifest
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from encoders import MODEL_NAME, LazyEmbeddings, get_encoder
+from extractive import ExtractiveAnswerer
+from index_factory import IndexSpec
+from indexing import IndexBuilder, IndexManifest, atomic_save, remove_chunks
+from mmr import VectorMMR
+from resilience import LLMUnavailable, ResilientChatModel
+from retrieval import ShardedIndex, retrieve_batch
+from sessions import SessionStore, estimate_tokens
+from tracing import Metrics
+from workers import RetrievalPool
+
 load_dotenv()
 
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 
-model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-embeddings = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs={"device": "cpu"},
-    encode_kwargs={"normalize_embeddings": False}
-)
+model_name = MODEL_NAME
+# Общий энкодер процесса; веса загружаются при первом эмбеддинге или в warmup()
+embeddings = get_encoder()
+EMBEDDINGS_KWARGS = embeddings.kwargs
+
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 128
+
+FETCH_K = 20
+LAMBDA_MULT = 0.5
+
+# Резервная модель, если основная не успевает ответить до дедлайна
+FALLBACK_MODEL = "mistral-small-latest"
 
 
 class PsychoResponse(BaseModel):
@@ -32,41 +57,240 @@ class PsychoResponse(BaseModel):
     link: str = Field(..., description="Ссылка на источник")
 
 
+def _response(title: str, solution: str, link: str = "") -> dict:
+    return {"title": title, "solution": solution, "link": link}
+
+
+def _unavailable_response() -> dict:
+    return _response(
+        "Сервис временно недоступен",
+        "Не удалось получить ответ вовремя. Пожалуйста, повторите вопрос через минуту."
+    )
+
+
 class PsychologistRAG:
-    def __init__(self, faiss_path: str = "./faiss_index"):
+    def __init__(
+            self,
+            faiss_path: str = "./faiss_index",
+            max_concurrency: int = 8,
+            retrieval_workers: int = 2,
+            max_sessions: int = 1000,
+            session_ttl: float = 3600,
+            history_token_budget: int = 1024,
+            embedding_cache_dir: str = "./embedding_cache",
+            query_cache_size: int = 256,
+            answer_cache_size: int = 1024,
+            answer_cache_threshold: float = 0.92,
+            answer_cache_ttl: float = 3600,
+            index_spec: IndexSpec = None,
+            shard_routing: bool = False,
+            router_confidence: float = 0.8,
+            llm=None,
+            encoder=None,
+            metrics: Metrics = None,
+            lazy: bool = False,
+            prompt_token_budget: int = 1024,
+            batch_window: float = 0.0,
+            max_batch_size: int = 32,
+            retrieval_processes: int = 0,
+            max_chunks_per_article: int = None,
+            llm_deadline: float = 20.0,
+            fallback_llm=None,
+            hedge_percentile: float = None,
+            extractive_overload: int = 0,
+            extractive_fallback: bool = True
+    ):
+        """
+        Args:
+            faiss_path (str): Путь к FAISS индексу
+            max_concurrency (int): Максимум одновременно обрабатываемых запросов в aask()
+            retrieval_workers (int): Число потоков для эмбеддинга запроса и поиска по индексу
+            max_sessions (int): Максимум одновременно хранимых диалогов
+            session_ttl (float): Время жизни неактивного диалога в секундах
+            history_token_budget (int): Бюджет токенов истории одного диалога
+            embedding_cache_dir (str): Директория дискового кэша эмбеддингов фрагментов
+            query_cache_size (int): Размер LRU-кэша эмбеддингов вопросов
+            answer_cache_size (int): Размер семантического кэша ответов, 0 - кэш выключен
+            answer_cache_threshold (float): Порог косинусной близости вопросов для попадания в кэш
+            answer_cache_ttl (float): Время жизни ответа в кэше в секундах
+            index_spec (IndexSpec): Тип FAISS индекса для новой сборки (по умолчанию flat L2).
+                Загруженный индекс использует параметры из своего манифеста
+            shard_routing (bool): Искать в подындексах категорий, выбранных роутером по центроидам
+            router_confidence (float): Минимальная вероятность выбранных категорий, иначе поиск по всему индексу
+            llm: Чат-модель вместо ChatMistralAI (например, локальная заглушка для бенчмарков)
+            encoder: Модель эмбеддингов вместо MiniLM
+            metrics (Metrics): Сбор метрик и трассировка этапов, по умолчанию выключены
+            lazy (bool): Не загружать индекс в конструкторе. Он загрузится в warmup() или при первом запросе
+            prompt_token_budget (int): Бюджет токенов контекста и истории в промпте, 0 - фрагменты целиком без сжатия
+            batch_window (float): Окно в секундах, за которое вопросы aask()/astream() собираются в один пакет
+                для эмбеддинга и поиска, 0 - каждый вопрос обрабатывается отдельно
+            max_batch_size (int): Максимальный размер такого пакета
+            retrieval_processes (int): Число процессов для эмбеддинга и поиска в aask()/astream(),
+                0 - в пуле потоков процесса бота. Процессы делят индекс через mmap
+            max_chunks_per_article (int): Не больше стольких фрагментов одной статьи в выдаче, None - без ограничения
+            llm_deadline (float): Дедлайн ответа LLM в секундах (с повторами и резервной моделью), 0 - без обёртки
+            fallback_llm: Резервная модель при угрозе дедлайна; по умолчанию FALLBACK_MODEL, если llm не задан
+            hedge_percentile (float): Перцентиль задержек LLM, после которого отправляется дублирующий запрос,
+                None - без дублирования
+            extractive_overload (int): Сколько запросов должно ждать очереди в aask()/astream(), чтобы новые
+                получали ответ из фрагментов без LLM (см. extractive.ExtractiveAnswerer), 0 - никогда
+            extractive_fallback (bool): Отвечать из фрагментов без LLM, если LLM недоступна
+        """
         self.faiss_path = faiss_path
+        self.embedding_cache_dir = embedding_cache_dir
+        self.llm = llm
+        self.fallback_llm = fallback_llm
+        self.llm_deadline = llm_deadline
+        self.hedge_percentile = hedge_percentile
+        self.encoder = encoder or embeddings
+        self.embeddings = CachedEmbeddings(self.encoder, query_cache_size=query_cache_size)
+        self.index_spec = index_spec or IndexSpec()
         self.db = None
+        self.manifest = None
+        self.shard_routing = shard_routing
+        self.router_confidence = router_confidence
+        self.shards = None
+        self._mmr = None
+        self.max_chunks_per_article = max_chunks_per_article
         self.chain = None
-        self._initialize_system()
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=False
+        # Эмбеддинг и MMR-поиск нагружают CPU, поэтому в async-режиме
+        # они выполняются в ограниченном пуле потоков, а не в event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=retrieval_workers,
+            thread_name_prefix="rag-retrieval"
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Запросы, ждущие семафора
+        self._queued = 0
+        self.extractive = ExtractiveAnswerer(self.encoder)
+        self.extractive_overload = extractive_overload
+        self.extractive_fallback = extractive_fallback
+        self.sessions = SessionStore(
+            max_sessions=max_sessions,
+            ttl=session_ttl,
+            max_history_tokens=history_token_budget
         )
+        self.answer_cache = SemanticAnswerCache(
+            threshold=answer_cache_threshold,
+            ttl=answer_cache_ttl,
+            max_size=answer_cache_size
+        ) if answer_cache_size > 0 else None
+        self.metrics = metrics or Metrics(enabled=False)
+        self.budgeter = ContextBudgeter(prompt_token_budget) if prompt_token_budget > 0 else None
+        if self.answer_cache is not None:
+            self.metrics.register_collector("answer_cache", self.answer_cache.metrics)
+        if retrieval_processes > 0 and shard_routing:
+            raise ValueError("shard_routing не поддерживается вместе с retrieval_processes")
+        self.pool = RetrievalPool(
+            faiss_path,
+            retrieval_processes,
+            # Процессы поднимают стандартный энкодер сами, другие энкодеры передаются сериализованными
+            encoder=self.encoder.backend if isinstance(self.encoder, LazyEmbeddings) else self.encoder,
+            fetch_k=FETCH_K,
+            lambda_mult=LAMBDA_MULT,
+            query_cache_size=query_cache_size,
+            max_chunks_per_article=max_chunks_per_article
+        ) if retrieval_processes > 0 else None
+        # С пулом процессов запросы всегда идут пакетами: при batch_window=0 объединяются
+        # только пришедшие в одной итерации event loop
+        self.batcher = MicroBatcher(
+            self.pool.retrieve_batch if self.pool is not None else self._retrieve_batch,
+            self.pool or self._executor,
+            max_batch=max_batch_size,
+            max_wait=batch_window
+        ) if batch_window > 0 or self.pool is not None else None
+        if self.batcher is not None:
+            self.metrics.register_collector("retrieval_batch", self.batcher.metrics)
+        self._ready = False
+        self._ready_lock = threading.Lock()
+        if not lazy:
+            self._ensure_ready()
+
+    def _ensure_ready(self):
+        """Однократная загрузка индекса и цепочки (потокобезопасно)"""
+        if self._ready:
+            return
+        with self._ready_lock:
+            if not self._ready:
+                self._initialize_system()
+                self._ready = True
+
+    def warmup(self, question: str = "Как справиться с тревогой?") -> dict:
+        """
+        Загружает индекс и энкодер и прогоняет пробный эмбеддинг и поиск, чтобы первый
+        пользователь не ждал загрузки. LLM не вызывается. Возвращает длительности этапов в секундах.
+        """
+        timings = {}
+        started = time.perf_counter()
+        self._ensure_ready()
+        timings["index_load"] = time.perf_counter() - started
+
+        if self.pool is not None:
+            # Энкодер загружается в процессах пула, в процессе бота он не нужен
+            started = time.perf_counter()
+            self.pool.warmup()
+            timings["workers_start"] = time.perf_counter() - started
+            if self.db is not None and self.db.index.ntotal:
+                started = time.perf_counter()
+                self.pool.submit(self.pool.retrieve_batch, [(question, 3)]).result()
+                timings["first_retrieve"] = time.perf_counter() - started
+            return {name: round(value, 4) for name, value in timings.items()}
+
+        if isinstance(self.encoder, LazyEmbeddings):
+            started = time.perf_counter()
+            self.encoder.load()
+            timings["encoder_load"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        vector = self._embed(question)
+        timings["first_embed"] = time.perf_counter() - started
+
+        if self.db is not None and self.db.index.ntotal:
+            started = time.perf_counter()
+            self._retrieve(vector, 3)
+            timings["first_retrieve"] = time.perf_counter() - started
+
+        return {name: round(value, 4) for name, value in timings.items()}
 
     def _initialize_system(self):
         """Инициализация FAISS и цепочки"""
-        if os.path.exists(self.faiss_path):
-            try:
-                self.db = FAISS.load_local(
-                    self.faiss_path,
-                    embeddings,
-                    allow_dangerous_deserialization=True
-                )
-            except Exception as e:
-                print("Ошибка загрузки индекса:", e)
-                self.db = None
-        else:
+        if not os.path.exists(self.faiss_path):
             print("FAISS индекс не найден, требуется векторизация.")
             self.vectorize_dataset()
             print("FAISS векторизован")
-            self.db = FAISS.load_local(
-                self.faiss_path,
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
+
+        try:
+            self.manifest = IndexManifest.load(self.faiss_path)
+            if self.manifest is not None:
+                self.index_spec = self.manifest.index_spec
+            self.embeddings.normalize = self.index_spec.normalize
+            if has_chunks(self.faiss_path):
+                self.db = load_store(self.faiss_path, self.embeddings, self.index_spec)
+            else:
+                self._load_legacy()
+            self.index_spec.configure(self.db.index)
+        except Exception as e:
+            print("Ошибка загрузки индекса:", e)
+            self.db = None
+
+        self._build_shards()
 
         self._initialize_chain()
 
+    def _load_legacy(self):
+        """Индекс старого формата (index.pkl): загружается через pickle и один раз пересохраняется без него"""
+        self.db = FAISS.load_local(
+            self.faiss_path,
+            self.embeddings,
+            allow_dangerous_deserialization=True,
+            distance_strategy=self.index_spec.distance_strategy
+        )
+        try:
+            atomic_save(self.db, self._get_manifest(), self.faiss_path)
+            print("Индекс пересохранён в формате без pickle.")
+        except OSError as e:
+            print("Не удалось пересохранить индекс:", e)
+
     def _initialize_chain(self):
         """Создаёт цепочку RAG → LLM → JSON"""
 
@@ -106,100 +330,620 @@ class PsychologistRAG:
             }
         )
 
-        llm = ChatMistralAI(
+        # Повторы и таймауты берёт на себя ResilientChatModel, клиент не должен ждать дольше дедлайна
+        client_kwargs = {"max_retries": 0, "timeout": max(1, int(self.llm_deadline))} if self.llm_deadline else {}
+        llm = self.llm or ChatMistralAI(
             model="mistral-large-latest",
             api_key=MISTRAL_API_KEY,
-            temperature=0.3
+            temperature=0.3,
+            **client_kwargs
         )
+        if self.llm_deadline and not isinstance(llm, ResilientChatModel):
+            fallback = self.fallback_llm
+            if fallback is None and self.llm is None:
+                fallback = ChatMistralAI(
+                    model=FALLBACK_MODEL,
+                    api_key=MISTRAL_API_KEY,
+                    temperature=0.3,
+                    **client_kwargs
+                )
+            llm = ResilientChatModel(
+                primary=llm,
+                fallback=fallback,
+                deadline=self.llm_deadline,
+                fallback_reserve=self.llm_deadline / 4,
+                hedge_percentile=self.hedge_percentile
+            )
+        if isinstance(llm, ResilientChatModel):
+            self.metrics.register_collector("llm", llm.metrics)
 
-        # Финальная цепочка (RunnableMap -> Prompt + Memory -> LLM -> JSON)
-        self.chain = (
+        self._prompt_chain = (
                 RunnableMap({
                     "context": lambda x: x["context"],
                     "metadata": lambda x: x["metadata"],
                     "question": lambda x: x["question"],
-                    "chat_history": lambda _: self.memory.load_memory_variables({}).get("chat_history", "")
+                    "chat_history": lambda x: x["chat_history"]
                 })
                 | prompt
-                | llm
-                | parser
         )
+        self._llm = llm
+        self._parser = parser
+
+        # Финальная цепочка (RunnableMap -> Prompt -> LLM -> JSON).
+        # ask() вызывает её звенья по отдельности, чтобы замерять этапы и считать токены
+        self.chain = self._prompt_chain | llm | parser
+
+    def vectorize_dataset(
+            self,
+            json_path: str = None,
+            chunk_size: int = CHUNK_SIZE,
+            chunk_overlap: int = CHUNK_OVERLAP,
+            batch_size: int = 64,
+            workers: int = None,
+            chunking: Chunker = None
+    ):
+        """
+        Полная сборка индекса.
 
-    def vectorize_dataset(self, json_path="data/final_dataset.json"):
-        print("Загрузка датасета...")
-
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        df = pd.DataFrame(data["rows"])
-
-        loader = DataFrameLoader(df, page_content_column="text")
-        docs = loader.load()
-
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1024,
-            chunk_overlap=128
-        )
-        chunks = splitter.split_documents(docs)
-
+        Статьи читаются потоково (json_path - директория шардированного датасета, JSONL
+        или final_dataset.json, по умолчанию data/dataset при наличии), режутся на фрагменты
+        и кодируются батчами в пуле из workers процессов (по умолчанию - по числу ядер).
+        Разбиение - chunking, по умолчанию по структуре текста (default_chunker(chunk_size, chunk_overlap)).
+        В конце печатается статистика сборки.
+        """
         print("Создание FAISS...")
-        self.db = FAISS.from_documents(chunks, embeddings)
+        self.db = None
+        chunking = chunking or default_chunker(chunk_size, chunk_overlap)
+        self.manifest = IndexManifest(
+            chunk_size,
+            chunk_overlap,
+            index=self.index_spec.to_dict(),
+            chunking=chunking.to_dict()
+        )
+        self.embeddings.normalize = self.index_spec.normalize
+        stats = self._index_articles(iter_rows(json_path or default_dataset()), batch_size=batch_size, workers=workers)
 
         print("Сохранение...")
-        self.db.save_local(self.faiss_path)
+        atomic_save(self.db, self.manifest, self.faiss_path)
+        self._index_saved(None)
 
-        print("Готово.")
+        print("Готово.", json.dumps(stats, ensure_ascii=False))
         return True
 
-    def ask(self, question: str, k: int = 3):
+    def _get_manifest(self) -> IndexManifest:
+        if self.manifest is None:
+            # Индекс собран старой версией без манифеста - восстанавливаем его по docstore
+            self.manifest = IndexManifest.from_store(self.db, CHUNK_SIZE, CHUNK_OVERLAP)
+        return self.manifest
+
+    def _index_articles(self, rows, batch_size: int = 64, workers: int = 0) -> dict:
+        """Разбивает статьи на фрагменты и добавляет их векторы в индекс"""
+        manifest = self.manifest
+        encoder_name = getattr(self.encoder, "model_name", type(self.encoder).__name__)
+        # Разбиение от энкодера не зависит и идёт в своём пуле
+        split_workers = (os.cpu_count() or 1) if workers is None else workers
+        if not isinstance(self.encoder, LazyEmbeddings):
+            # Процессы пула энкодеров умеют поднимать только стандартный энкодер
+            workers = 0
+        # Энкодер запускается только для фрагментов, которых ещё нет в кэше
+        cache = EmbeddingCache(self.embedding_cache_dir, encoder_name, manifest.chunk_size, manifest.chunk_overlap)
+        builder = IndexBuilder(
+            self.embeddings,
+            self.encoder,
+            getattr(self.encoder, "kwargs", EMBEDDINGS_KWARGS),
+            cache=cache,
+            batch_size=batch_size,
+            workers=workers,
+            spec=self.index_spec,
+            split_workers=split_workers
+        )
+        self.db = builder.build(rows, manifest, self.db)
+        return builder.stats.report()
 
+    def upsert_articles(self, rows) -> dict:
+        """
+        Добавляет новые и переиндексирует изменившиеся статьи (строки формата final_dataset.json).
+        Векторы остальных статей не затрагиваются, индекс сохраняется атомарно.
+        """
+        self._ensure_ready()
+        self._materialize()
         if self.db is None:
-            return {
-                "title": "Ошибка",
-                "solution": "Индекс не загружен. Выполните векторизацию.",
-                "link": ""
-            }
+            self.manifest = IndexManifest(
+                CHUNK_SIZE,
+                CHUNK_OVERLAP,
+                index=self.index_spec.to_dict(),
+                chunking=default_chunker(CHUNK_SIZE, CHUNK_OVERLAP).to_dict()
+            )
+            self.embeddings.normalize = self.index_spec.normalize
+        manifest = self._get_manifest()
+
+        stale_chunks = []
+        changed = []
+        stats = {"added": 0, "updated": 0, "unchanged": 0}
+        for row in rows:
+            entry = manifest.articles.get(str(row["id"]))
+            if entry is None:
+                stats["added"] += 1
+            elif entry["hash"] == article_hash(row):
+                stats["unchanged"] += 1
+                continue
+            else:
+                stats["updated"] += 1
+                stale_chunks.extend(entry["chunks"])
+            changed.append(row)
+
+        if not changed:
+            return stats
+
+        if stale_chunks:
+            remove_chunks(self.db, stale_chunks, self.index_spec)
+        self._index_articles(changed)
+
+        atomic_save(self.db, manifest, self.faiss_path)
+        self._index_saved(stale_chunks)
+        return stats
+
+    def delete_articles(self, ids) -> int:
+        """Удаляет статьи по id из индекса. Возвращает число удалённых статей"""
+        self._ensure_ready()
+        self._materialize()
+        if self.db is None:
+            return 0
+        manifest = self._get_manifest()
+
+        stale_chunks = []
+        deleted = 0
+        for article_id in ids:
+            entry = manifest.articles.pop(str(article_id), None)
+            if entry is not None:
+                stale_chunks.extend(entry["chunks"])
+                deleted += 1
+
+        if not deleted:
+            return 0
+
+        if stale_chunks:
+            remove_chunks(self.db, stale_chunks, self.index_spec)
+        atomic_save(self.db, manifest, self.faiss_path)
+        self._index_saved(stale_chunks)
+        return deleted
+
+    def _materialize(self):
+        """Загруженный через mmap индекс только для чтения - перед изменением он копируется в память"""
+        if self.db is not None:
+            materialize(self.db)
+            self.index_spec.configure(self.db.index)
+
+    def sync_dataset(self, path: str = None) -> dict:
+        """
+        Приводит индекс в соответствие с шардированным датасетом.
 
-        try:
-            docs = self.db.max_marginal_relevance_search(
-                question,
+        Хэши статей сравниваются по манифестам датасета и индекса, поэтому читаются
+        только шарды с новыми или изменившимися статьями. Статьи, которых нет в датасете, удаляются.
+        """
+        path = path or default_dataset()
+        dataset = load_dataset_manifest(path)
+        if dataset is None:
+            raise FileNotFoundError(f"{path} не является шардированным датасетом")
+
+        self._ensure_ready()
+        indexed = self._get_manifest().articles if self.db is not None else {}
+        wanted = dataset["articles"]
+        changed = {
+            article_id for article_id, entry in wanted.items()
+            if indexed.get(article_id, {}).get("hash") != entry["hash"]
+        }
+        removed = [article_id for article_id in indexed if article_id not in wanted]
+
+        deleted = self.delete_articles(removed) if removed else 0
+        shards = sorted({wanted[article_id]["shard"] for article_id in changed})
+        stats = self.upsert_articles(
+            row for row in iter_rows(path, shards) if str(row["id"]) in changed
+        )
+        stats["unchanged"] = len(wanted) - len(changed)
+        stats["deleted"] = deleted
+        return stats
+
+    def _index_saved(self, stale_chunks=None):
+        """
+        После пересохранения индекса: подындексы пересобираются, процессы поиска перезапускаются,
+        из кэша удаляются ответы по удалённым и заменённым фрагментам stale_chunks
+        (None - индекс собран заново, кэш очищается целиком)
+        """
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(stale_chunks)
+        self._build_shards()
+        if self.pool is not None:
+            self.pool.restart()
+
+    @property
+    def mmr(self) -> VectorMMR:
+        """MMR по текущему индексу; с пулом процессов создаётся только при первом поиске в процессе бота"""
+        if self._mmr is None and self.db is not None:
+            self._mmr = VectorMMR(self.db)
+        return self._mmr
+
+    def _build_shards(self):
+        """Пересоздаёт MMR и подындексы категорий после загрузки или изменения индекса"""
+        # С пулом процессов поиск для aask() идёт в них, MMR процесса бота нужен только ask()
+        self._mmr = None
+        if self.pool is None and self.db is not None:
+            self._mmr = VectorMMR(self.db)
+        if self.shard_routing and self.db is not None and self.db.index.ntotal:
+            self.shards = ShardedIndex(self.db, self.index_spec, self.mmr, confidence=self.router_confidence)
+        else:
+            self.shards = None
+
+    def _embed(self, question: str):
+        """Эмбеддинг вопроса (с LRU-кэшем)"""
+        return self.embeddings.embed_query(question)
+
+    def _retrieve(self, vector, k: int):
+        """MMR-поиск по подындексам категорий, если роутер уверен, иначе по всему индексу"""
+        if self.shards is not None:
+            docs = self.shards.max_marginal_relevance_search(
+                vector,
                 k=k,
-                fetch_k=20,
-                lambda_mult=0.5
+                fetch_k=FETCH_K,
+                lambda_mult=LAMBDA_MULT,
+                max_per_article=self.max_chunks_per_article
             )
+            if docs is not None:
+                return docs
 
-            if not docs:
-                return {
-                    "title": "Нет данных",
-                    "solution": "Не удалось найти информацию. Пожалуйста, переформулируйте вопрос.",
-                    "link": ""
-                }
+        return self.mmr.search([vector], [k], FETCH_K, LAMBDA_MULT, self.max_chunks_per_article)[0]
+
+    def _retrieve_batch(self, requests):
+        """Пакет (вопрос, k) из MicroBatcher в пуле потоков, см. retrieval.retrieve_batch"""
+        if self.shards is None:
+            return retrieve_batch(
+                self.embeddings, self.mmr, requests, FETCH_K, LAMBDA_MULT, self.max_chunks_per_article
+            )
+
+        # Роутер выбирает подындексы для каждого вопроса отдельно
+        started = time.perf_counter()
+        vectors = self.embeddings.embed_queries([question for question, _ in requests])
+        embedded = time.perf_counter()
+        docs = [self._retrieve(vector, k) for vector, (_, k) in zip(vectors, requests)]
+        timings = {"embed": embedded - started, "retrieve": time.perf_counter() - embedded}
+        return [(vector, found, timings) for vector, found in zip(vectors, docs)]
 
+    def _cached_answer(self, question: str, vector, history: str, session_id):
+        """
+        Ответ из семантического кэша.
+        Используется только для диалогов без истории, чтобы не переиспользовать ответы, зависящие от контекста.
+        """
+        if self.answer_cache is None or history:
+            return None
+
+        result = self.answer_cache.lookup(vector)
+        if result is not None:
+            self.sessions.save(session_id, question, json.dumps(result, ensure_ascii=False))
+        return result
+
+    def _build_inputs(self, question: str, docs, history: str, trace) -> dict:
+        """Собирает вход цепочки из найденных фрагментов (со сжатием контекста, если задан бюджет)"""
+        if self.budgeter is not None:
+            with trace.stage("context"):
+                built = self.budgeter.build(question, docs, history)
+            context, metadata, history = built["context"], built["metadata"], built["chat_history"]
+            trace.set(**built["stats"])
+        else:
             context = "\n\n".join(d.page_content for d in docs)
             metadata = "\n".join(
                 f"{d.metadata.get('name', 'Источник')}: {d.metadata.get('link', '')}"
                 for d in docs
             )
+            trace.set(context_tokens=estimate_tokens(context), history_tokens=estimate_tokens(history))
+
+        trace.set(retrieved_chunks=len(docs), context_chars=len(context))
+        return {
+            "context": context,
+            "metadata": metadata,
+            "question": question,
+            "chat_history": history
+        }
+
+    def _generate(self, inputs: dict, trace) -> dict:
+        """Промпт -> LLM -> JSON с замером каждого звена"""
+        with trace.stage("prompt"):
+            prompt_value = self._prompt_chain.invoke(inputs)
+        with trace.stage("llm"):
+            message = self._llm.invoke(prompt_value)
+        trace.usage(message)
+        with trace.stage("parse"):
+            return self._parser.invoke(message)
+
+    async def _agenerate(self, inputs: dict, trace) -> dict:
+        with trace.stage("prompt"):
+            prompt_value = await self._prompt_chain.ainvoke(inputs)
+        with trace.stage("llm"):
+            message = await self._llm.ainvoke(prompt_value)
+        trace.usage(message)
+        with trace.stage("parse"):
+            return self._parser.invoke(message)
+
+    async def _astream_generate(self, inputs: dict, trace):
+        """
+        Промпт -> поток токенов LLM -> частичный JSON.
+        Каждый yield - (False, словарь с уже полученными полями), последний - (True, разбор полного ответа).
+        Частичный словарь отдаётся с отставанием на одно изменение: последний из них совпадает
+        с полным разбором и заменяется им, чтобы итоговый ответ не приходил дважды.
+        """
+        with trace.stage("prompt"):
+            prompt_value = await self._prompt_chain.ainvoke(inputs)
+
+        started = time.perf_counter()
+        message = None
+        last = None
+        pending = None
+        async for chunk in self._llm.astream(prompt_value):
+            if message is None:
+                trace.record("first_token", time.perf_counter() - started)
+                message = chunk
+            else:
+                message = message + chunk
+            partial = self._parser.parse_result([Generation(text=message.text)], partial=True)
+            if isinstance(partial, dict) and partial and partial != last:
+                if pending is not None:
+                    yield False, pending
+                last = partial
+                pending = dict(partial)
+        trace.record("llm", time.perf_counter() - started)
+        trace.usage(message)
+
+        with trace.stage("parse"):
+            yield True, self._parser.invoke(message)
+
+    def _extract(self, question: str, vector, docs, session_id, trace, outcome: str) -> dict:
+        """Ответ из найденных фрагментов без LLM. Сохраняется в истории диалога, но не в кэше ответов"""
+        with trace.stage("extract"):
+            if self.pool is not None:
+                # Предложения кодируются энкодером процессов пула, в процессе бота его нет
+                result = self.pool.submit(self.pool.extractive_answer, vector, docs).result()
+            else:
+                result = self.extractive.answer(vector, docs)
+        self.sessions.save(session_id, question, json.dumps(result, ensure_ascii=False))
+        trace.finish(outcome)
+        return result
+
+    async def _aextract(self, question: str, context, session_id, trace, outcome: str) -> dict:
+        vector, _, docs = context
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._extract, question, vector, docs, session_id, trace, outcome
+        )
+
+    def _overloaded(self) -> bool:
+        return bool(self.extractive_overload) and self._queued >= self.extractive_overload
+
+    async def _acquire(self, extractive: bool, trace) -> bool:
+        """
+        Место в очереди к LLM. Возвращает False без ожидания, если ответ будет из фрагментов:
+        по запросу или потому что очередь уже длиннее extractive_overload.
+        """
+        if extractive or self._overloaded():
+            return False
+        self._queued += 1
+        try:
+            with trace.stage("queue_wait"):
+                await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+        return True
+
+    def _finalize(self, question: str, result: dict, docs, session_id, vector, history: str, latency: float) -> dict:
+        """Сохраняет ход диалога, дополняет ответ ссылкой и кладёт его в кэш ответов"""
+        self.sessions.save(
+            session_id,
+            question,
+            json.dumps(result, ensure_ascii=False)
+        )
+
+        if not result.get("link") and docs:
+            result["link"] = docs[0].metadata.get("link", "")
+
+        if self.answer_cache is not None and not history:
+            self.answer_cache.store(vector, [d.id for d in docs], result, latency)
+
+        return result
+
+    def ask(self, question: str, k: int = 3, session_id="default", extractive: bool = False):
+        """Ответ на вопрос; extractive=True - из найденных фрагментов без LLM"""
+
+        trace = self.metrics.trace(session=session_id, question_chars=len(question))
+
+        self._ensure_ready()
+        if self.db is None:
+            trace.finish("no_index")
+            return _response("Ошибка", "Индекс не загружен. Выполните векторизацию.")
+
+        docs = None
+        try:
+            with trace.stage("embed"):
+                vector = self._embed(question)
+            history = self.sessions.history(session_id)
+
+            with trace.stage("answer_cache"):
+                cached = self._cached_answer(question, vector, history, session_id)
+            if cached is not None:
+                trace.finish("cached")
+                return cached
+
+            with trace.stage("retrieve"):
+                docs = self._retrieve(vector, k)
+
+            if not docs:
+                trace.finish("no_docs")
+                return _response(
+                    "Нет данных",
+                    "Не удалось найти информацию. Пожалуйста, переформулируйте вопрос."
+                )
+            if extractive:
+                return self._extract(question, vector, docs, session_id, trace, "extractive")
 
-            result = self.chain.invoke({
-                "context": context,
-                "metadata": metadata,
-                "question": question
-            })
+            started = time.perf_counter()
+            result = self._generate(self._build_inputs(question, docs, history, trace), trace)
 
-            self.memory.save_context(
-                {"input": question},
-                {"output": json.dumps(result, ensure_ascii=False)}
+            result = self._finalize(
+                question, result, docs, session_id, vector, history, time.perf_counter() - started
             )
+            trace.finish("ok")
+            return result
+
+        except LLMUnavailable:
+            if self.extractive_fallback and docs:
+                return self._extract(question, vector, docs, session_id, trace, "extractive_fallback")
+            trace.finish("llm_unavailable")
+            return _unavailable_response()
+        except Exception as e:
+            trace.finish("error")
+            return _response("Ошибка", f"Не удалось обработать запрос: {e}")
+
+    async def _aprepare(self, question: str, k: int, session_id, trace):
+        """
+        Эмбеддинг, кэш ответов и поиск для aask() и astream().
+        Возвращает (готовый ответ, None), если LLM не нужна, иначе (None, (vector, history, docs)).
+        С пакетной обработкой поиск выполняется вместе с эмбеддингом, до проверки кэша ответов.
+        """
+        loop = asyncio.get_running_loop()
+        docs = None
+        if self.batcher is not None:
+            started = time.perf_counter()
+            vector, docs, timings = await self.batcher.submit((question, k))
+            trace.record("batch_wait", max(0.0, time.perf_counter() - started - sum(timings.values())))
+            for name, seconds in timings.items():
+                trace.record(name, seconds)
+            trace.set(batched=True)
+        else:
+            with trace.stage("embed"):
+                vector = await loop.run_in_executor(self._executor, self._embed, question)
+        history = self.sessions.history(session_id)
+
+        with trace.stage("answer_cache"):
+            cached = self._cached_answer(question, vector, history, session_id)
+        if cached is not None:
+            trace.finish("cached")
+            return cached, None
+
+        if docs is None:
+            with trace.stage("retrieve"):
+                docs = await loop.run_in_executor(self._executor, self._retrieve, vector, k)
+
+        if not docs:
+            trace.finish("no_docs")
+            return _response(
+                "Нет данных",
+                "Не удалось найти информацию. Пожалуйста, переформулируйте вопрос."
+            ), None
+
+        return None, (vector, history, docs)
+
+    async def aask(self, question: str, k: int = 3, session_id="default", extractive: bool = False):
+        """
+        Асинхронная версия ask(), не блокирующая event loop.
+
+        Поиск выполняется в пуле потоков, запрос к LLM - через нативный ainvoke модели.
+        Число одновременно обрабатываемых запросов ограничено max_concurrency. Ответ собирается
+        из фрагментов без LLM при extractive=True, при очереди длиннее extractive_overload
+        и при недоступности LLM (extractive_fallback).
+        """
 
-            if not result.get("link") and docs:
-                result["link"] = docs[0].metadata.get("link", "")
+        trace = self.metrics.trace(session=session_id, question_chars=len(question))
 
+        if not self._ready:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._ensure_ready)
+        if self.db is None:
+            trace.finish("no_index")
+            return _response("Ошибка", "Индекс не загружен. Выполните векторизацию.")
+
+        acquired = await self._acquire(extractive, trace)
+        context = None
+        try:
+            response, context = await self._aprepare(question, k, session_id, trace)
+            if response is not None:
+                return response
+            if not acquired:
+                outcome = "extractive" if extractive else "extractive_overload"
+                return await self._aextract(question, context, session_id, trace, outcome)
+            vector, history, docs = context
+
+            started = time.perf_counter()
+            result = await self._agenerate(self._build_inputs(question, docs, history, trace), trace)
+
+            result = self._finalize(
+                question, result, docs, session_id, vector, history, time.perf_counter() - started
+            )
+            trace.finish("ok")
             return result
 
+        except LLMUnavailable:
+            if self.extractive_fallback:
+                return await self._aextract(question, context, session_id, trace, "extractive_fallback")
+            trace.finish("llm_unavailable")
+            return _unavailable_response()
         except Exception as e:
-            return {
-                "title": "Ошибка",
-                "solution": f"Не удалось обработать запрос: {e}",
-                "link": ""
-            }
+            trace.finish("error")
+            return _response("Ошибка", f"Не удалось обработать запрос: {e}")
+        finally:
+            if acquired:
+                self._semaphore.release()
+
+    async def astream(self, question: str, k: int = 3, session_id="default", extractive: bool = False):
+        """
+        Потоковая версия aask(): асинхронный генератор частичных ответов.
+
+        JSON ответа LLM разбирается по мере поступления токенов, каждый yield - словарь с уже
+        полученными полями title/solution/link. Последний yield - итоговый ответ, как у aask().
+        Ответы из кэша, ответы из фрагментов без LLM и сообщения об ошибках приходят одним yield.
+        """
+
+        trace = self.metrics.trace(session=session_id, question_chars=len(question), stream=True)
+
+        if not self._ready:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._ensure_ready)
+        if self.db is None:
+            trace.finish("no_index")
+            yield _response("Ошибка", "Индекс не загружен. Выполните векторизацию.")
+            return
+
+        acquired = await self._acquire(extractive, trace)
+        context = None
+        try:
+            response, context = await self._aprepare(question, k, session_id, trace)
+            if response is not None:
+                yield response
+                return
+            if not acquired:
+                outcome = "extractive" if extractive else "extractive_overload"
+                yield await self._aextract(question, context, session_id, trace, outcome)
+                return
+            vector, history, docs = context
+
+            started = time.perf_counter()
+            result = None
+            inputs = self._build_inputs(question, docs, history, trace)
+            async for done, parsed in self._astream_generate(inputs, trace):
+                if done:
+                    # Полный разбор отдаётся один раз - уже после _finalize
+                    result = parsed
+                else:
+                    yield parsed
+
+            result = self._finalize(
+                question, result, docs, session_id, vector, history, time.perf_counter() - started
+            )
+            trace.finish("ok")
+            yield result
+
+        except LLMUnavailable:
+            if self.extractive_fallback:
+                yield await self._aextract(question, context, session_id, trace, "extractive_fallback")
+                return
+            trace.finish("llm_unavailable")
+            yield _unavailable_response()
+        except Exception as e:
+            trace.finish("error")
+            yield _response("Ошибка", f"Не удалось обработать запрос: {e}")
+        finally:
+            if acquired:
+                self._semaphore.release()
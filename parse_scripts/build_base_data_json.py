@@ -1,5 +1,13 @@
 import json
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from dataset import iter_rows, write_shards
 
 
 def build_complete_dataset(base_json_path, articles_dir, output_path):
@@ -51,6 +59,65 @@ def build_complete_dataset(base_json_path, articles_dir, output_path):
     print(f"   Полный датасет сохранен: {output_path}")
 
 
+def read_article(item, articles_dir):
+    """Строка датасета с текстом статьи или None, если файла нет"""
+    article_path = os.path.join(articles_dir, f"{item['category']}_{item['id']}.txt")
+    if not os.path.exists(article_path):
+        return None
+    with open(article_path, 'r', encoding='utf-8') as f:
+        return {**item, 'text': f.read().strip()}
+
+
+def iter_articles(base_json_path, articles_dir, workers=8, batch_size=256, missing=None):
+    """
+    Строки базового датасета с текстами статей в исходном порядке.
+    Файлы читаются параллельно батчами по batch_size, поэтому в памяти не больше одного батча.
+    id статей без файла добавляются в missing.
+    """
+    def read_batch(pool, batch):
+        for item, row in zip(batch, pool.map(lambda x: read_article(x, articles_dir), batch)):
+            if row is None:
+                if missing is not None:
+                    missing.append(item['id'])
+                continue
+            yield row
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for item in iter_rows(base_json_path):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield from read_batch(pool, batch)
+                batch = []
+        yield from read_batch(pool, batch)
+
+
+def build_sharded_dataset(base_json_path, articles_dir, output_dir, shard_size=1000, workers=8):
+    """
+    Собирает датасет в виде JSONL-шардов с манифестом (id, категория, хэш и шард каждой статьи)
+
+    Args:
+        base_json_path (str): Путь к базовому JSON с метаданными
+        articles_dir (str): Директория с текстовыми файлами статей
+        output_dir (str): Директория шардированного датасета
+        shard_size (int): Число статей в одном шарде
+        workers (int): Число потоков чтения файлов статей
+    """
+    missing = []
+    manifest = write_shards(
+        iter_articles(base_json_path, articles_dir, workers=workers, missing=missing),
+        output_dir,
+        shard_size=shard_size
+    )
+
+    print(f"\nСБОРКА ЗАВЕРШЕНА:")
+    print(f"   Найдено статей: {len(manifest['articles'])}")
+    print(f"   Отсутствует статей: {len(missing)} {missing if missing else ''}")
+    print(f"   Шардов: {len(manifest['shards'])}")
+    print(f"   Датасет сохранен: {output_dir}")
+    return manifest
+
+
 def check_articles_coverage(base_json_path, articles_dir):
     """
     Проверяет, для каких статей есть текстовые файлы
@@ -61,7 +128,7 @@ def check_articles_coverage(base_json_path, articles_dir):
     print("ПРОВЕРКА ПОКРЫТИЯ СТАТЕЙ:")
 
     for item in dataset['rows']:
-        article_id = item['id                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                  ']
+        article_id = item['id']
         category = item['category']
         article_filename = f"{category}_{article_id}.txt"
         article_path = os.path.join(articles_dir, article_filename)
@@ -73,11 +140,11 @@ def check_articles_coverage(base_json_path, articles_dir):
 if __name__ == "__main__":
     BASE_JSON_PATH = "./data/base_data.json"
     ARTICLES_DIR = "./data/articles"
-    OUTPUT_PATH = "./data/final_dataset.json"
+    OUTPUT_DIR = "./data/dataset"
 
     # Проверяем покрытие статей
     print("ПРОВЕРКА СТАТЕЙ")
     check_articles_coverage(BASE_JSON_PATH, ARTICLES_DIR)
 
     print("\nСБОРКА ДАТАСЕТА")
-    build_complete_dataset(BASE_JSON_PATH, ARTICLES_DIR, OUTPUT_PATH)
\ No newline at end of file
+    build_sharded_dataset(BASE_JSON_PATH, ARTICLES_DIR, OUTPUT_DIR)
\ No newline at end of file
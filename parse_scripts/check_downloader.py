@@ -0,0 +1,235 @@
+"""
+Проверка ArticleDownloader на локальном HTTP-сервере вместо сайтов со статьями.
+
+Сервер (http.server в отдельном потоке) отдаёт сгенерированные статьи с ETag и Last-Modified,
+отвечает 304 на условные запросы, обрабатывает каждый запрос не быстрее latency секунд и по сценарию
+отвечает 503 с Retry-After, 429 и 500. Проверяется:
+    - параллельность: сервер обрабатывает несколько запросов одновременно, загрузка быстрее последовательной;
+    - повторы: после 503 и 429 статья загружается, паузы между попытками растут экспоненциально,
+      при постоянной 500 делается max_retries + 1 попыток и статья не сохраняется;
+    - продолжение: повторный запуск без refresh запрашивает только статьи, которых нет на диске;
+    - обновление: с refresh неизменные статьи получают 304, статья с другой разметкой вокруг того же
+      текста не считается изменённой, изменённая статья попадает в reindex.json;
+    - ограничение частоты: запросы к одному хосту не чаще host_interval.
+
+Запуск из parse_scripts:
+    python check_downloader.py
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from download_articles import ArticleDownloader, content_hash
+
+ARTICLES = 12
+LATENCY = 0.1
+BACKOFF = 0.05
+MAX_RETRIES = 3
+
+PARAGRAPH = (
+    'Тревога - естественная реакция на неопределённость. Когда она усиливается и мешает жить, '
+    'помогают дыхательные упражнения, режим сна и разговор с близкими или специалистом. '
+)
+
+
+def article_html(article_id, revision=1, banner=''):
+    """Страница статьи: текст зависит от article_id и revision, banner - разметка вне статьи"""
+    return (
+        f'<html><head><title>Статья {article_id}</title></head><body>'
+        f'<nav>Главная | Статьи</nav><aside>{banner}</aside>'
+        f'<article><h1>Статья {article_id}, редакция {revision}</h1><p>{PARAGRAPH * 3}</p></article>'
+        f'<footer>2024</footer></body></html>'
+    )
+
+
+class StandInState:
+    """Статьи сервера, сценарий сбоев и журнал запросов"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.articles = {}
+        # Путь -> статусы, которыми сервер отвечает на ближайшие запросы
+        self.failures = defaultdict(list)
+        self.requests = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def attempts(self, path):
+        return [at for at, requested, _ in self.requests if requested == path]
+
+    def reset_log(self):
+        with self.lock:
+            self.requests = []
+            self.peak_in_flight = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        state = self.server.state
+        with state.lock:
+            state.in_flight += 1
+            state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+            failures = state.failures.get(self.path)
+            status = failures.pop(0) if failures else None
+        try:
+            time.sleep(state.latency)
+            if status is None and self.path not in state.articles:
+                status = 404
+            if status is not None:
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self._send_article(state.articles[self.path])
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+                state.requests.append((time.monotonic(), self.path, status or 200))
+
+    def _send_article(self, html):
+        body = html.encode('utf-8')
+        etag = f'"{content_hash(html)[:16]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def __call__(self, name, ok, details=''):
+        print(f"{'OK  ' if ok else 'FAIL'} {name}" + (f": {details}" if details else ''))
+        self.failed += not ok
+
+
+def main():
+    # Ошибки загрузки, которые вызывает сценарий, ожидаемы - в выводе только итоги проверок
+    logging.getLogger('download_articles').setLevel(logging.CRITICAL)
+
+    state = StandInState(LATENCY)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    check = Checks()
+    paths = [f'/articles/{i}' for i in range(ARTICLES)]
+    state.articles = {path: article_html(i) for i, path in enumerate(paths)}
+
+    with tempfile.TemporaryDirectory(prefix='psychrag_download_') as work_dir:
+        base_json_path = os.path.join(work_dir, 'base_dataset.json')
+        articles_dir = os.path.join(work_dir, 'articles')
+        rows = [{'id': i, 'category': 'anxiety', 'link': base_url + path} for i, path in enumerate(paths)]
+        with open(base_json_path, 'w', encoding='utf-8') as f:
+            json.dump({'rows': rows}, f)
+
+        downloader = ArticleDownloader(
+            base_json_path,
+            articles_dir,
+            workers=8,
+            host_interval=0,
+            max_retries=MAX_RETRIES,
+            backoff=BACKOFF,
+            timeout=5
+        )
+
+        def saved(article_id):
+            return os.path.exists(os.path.join(articles_dir, f'anxiety_{article_id}.txt'))
+
+        # Первый запуск: сбои по сценарию
+        state.failures.update({paths[1]: [503], paths[2]: [429, 429], paths[3]: [500] * (MAX_RETRIES + 1)})
+        started = time.perf_counter()
+        result = downloader.download_all_articles()
+        elapsed = time.perf_counter() - started
+        sequential = (ARTICLES + 1 + 2 + MAX_RETRIES) * LATENCY
+        check(
+            'параллельная загрузка',
+            state.peak_in_flight > 1 and elapsed < sequential,
+            f'до {state.peak_in_flight} запросов одновременно, {elapsed:.2f} с (последовательно {sequential:.2f} с)'
+        )
+        check('повтор после 503 с Retry-After', saved(1) and len(state.attempts(paths[1])) == 2)
+        attempts = state.attempts(paths[2])
+        gaps = [b - a - LATENCY for a, b in zip(attempts, attempts[1:])]
+        check(
+            'повторы после 429 с растущей паузой',
+            saved(2) and len(attempts) == 3
+            and all(gap >= BACKOFF * 2 ** i * 0.5 - 0.01 for i, gap in enumerate(gaps)),
+            'паузы ' + ', '.join(f'{gap:.3f}' for gap in gaps) + ' с'
+        )
+        check(
+            'постоянная 500',
+            not saved(3) and len(state.attempts(paths[3])) == MAX_RETRIES + 1
+            and result['counts'].get('failed') == 1,
+            f"попыток: {len(state.attempts(paths[3]))}"
+        )
+
+        # Второй запуск без refresh: продолжение с того, что уже скачано
+        state.reset_log()
+        result = downloader.download_all_articles()
+        requested = sorted({path for _, path, _ in state.requests})
+        check(
+            'продолжение прерванной загрузки',
+            requested == [paths[3]] and result['counts'] == {'skipped': ARTICLES - 1, 'new': 1}
+            and result['reindex'] == [3],
+            f'запрошены {requested}, {result["counts"]}'
+        )
+
+        # Третий запуск с refresh: условные запросы и хэши текста
+        state.articles[paths[4]] = article_html(4, revision=2)
+        state.articles[paths[5]] = article_html(5, banner='Подпишитесь на рассылку')
+        state.reset_log()
+        result = downloader.download_all_articles(refresh=True)
+        with open(os.path.join(downloader.state_dir, 'reindex.json'), 'r', encoding='utf-8') as f:
+            reindex = json.load(f)['ids']
+        check(
+            'обновление по условным запросам',
+            result['counts'] == {'not_modified': ARTICLES - 2, 'changed': 1, 'unchanged': 1} and reindex == [4],
+            f'{result["counts"]}, reindex {reindex}'
+        )
+
+        # Ограничение частоты запросов к хосту
+        interval = 0.15
+        state.reset_log()
+        downloader.download_all_articles(delay=interval, refresh=True)
+        arrivals = sorted(at - LATENCY for at, _, _ in state.requests)
+        min_gap = min(b - a for a, b in zip(arrivals, arrivals[1:]))
+        check(
+            'ограничение частоты к хосту',
+            min_gap >= interval - 0.02,
+            f'минимальный интервал {min_gap:.3f} с при host_interval {interval} с'
+        )
+
+    server.shutdown()
+    server.server_close()
+    if check.failed:
+        print(f'\nНе прошло проверок: {check.failed}')
+        sys.exit(1)
+    print('\nВсе проверки прошли')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
+import hashlib
 import json
 import logging
 import os
+import random
 import re
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 
 import html2text
 import requests
@@ -13,23 +20,162 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """Не чаще одного запроса в min_interval секунд к одному хосту; разные хосты не ждут друг друга"""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class DownloadCache:
+    """
+    Кэш загрузок: для каждого URL - ETag, Last-Modified и хэш очищенного текста.
+    Позволяет делать условные запросы и отличать изменившиеся статьи от неизменных.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return self.entries.get(url)
+
+    def put(self, url, **entry):
+        with self._lock:
+            self.entries[url] = entry
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _retry_after(response):
+    """Значение заголовка Retry-After в секундах (число или HTTP-дата)"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
 class ArticleDownloader:
-    def __init__(self, base_json_path, articles_dir):
+    def __init__(
+            self,
+            base_json_path,
+            articles_dir,
+            workers=8,
+            host_interval=1.0,
+            max_retries=3,
+            backoff=1.0,
+            timeout=10,
+            cache_path=None,
+            state_dir=None
+    ):
+        """
+        Args:
+            workers: Число одновременных загрузок
+            host_interval: Минимальный интервал между запросами к одному хосту, сек
+            max_retries: Повторы при сетевых ошибках и ответах 429/5xx
+            backoff: Базовая задержка экспоненциального повтора, сек
+            cache_path: Файл кэша загрузок (по умолчанию download_cache.json в state_dir)
+            state_dir: Директория для кэша загрузок и reindex.json (по умолчанию .cache рядом
+                с articles_dir, в git не попадает), чтобы рядом со статьями были только их тексты
+        """
         self.base_json_path = base_json_path
         self.articles_dir = articles_dir
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
-
-        # Инициализация html2text для чистого текста
-        self.html_converter = html2text.HTML2Text()
-        self.html_converter.ignore_links = False
-        self.html_converter.ignore_images = True
-        self.html_converter.body_width = 0
-
-        # Создаем директорию для статей, если её нет
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limiter = HostRateLimiter(host_interval)
+        # requests.Session и HTML2Text хранят состояние между вызовами - у каждого потока свои
+        self._local = threading.local()
+
+        self.state_dir = state_dir or os.path.join(os.path.dirname(os.path.abspath(articles_dir)), '.cache')
+
+        # Создаем директории для статей и состояния загрузки, если их нет
         os.makedirs(self.articles_dir, exist_ok=True)
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.cache = DownloadCache(cache_path or os.path.join(self.state_dir, 'download_cache.json'))
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update({'User-Agent': USER_AGENT})
+        return session
+
+    @property
+    def html_converter(self):
+        converter = getattr(self._local, 'html_converter', None)
+        if converter is None:
+            # Инициализация html2text для чистого текста
+            converter = self._local.html_converter = html2text.HTML2Text()
+            converter.ignore_links = False
+            converter.ignore_images = True
+            converter.body_width = 0
+        return converter
+
+    def fetch(self, url, headers=None):
+        """
+        GET с ограничением частоты по хосту и повторами с экспоненциальной задержкой и случайным разбросом.
+        Для 429/503 учитывается Retry-After. Возвращает ответ (в том числе 304) или бросает исключение.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(url)
+            response = None
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            delay = _retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.info(f"Повтор {attempt + 1}/{self.max_retries} для {url} через {delay:.1f} с: {error}")
+            time.sleep(delay)
 
     def clean_text(self, text):
         """Очистка текста от лишних пробелов и символов"""
@@ -82,35 +228,34 @@ class ArticleDownloader:
         """Скачивает и очищает статью по URL"""
         try:
             logger.info(f"Скачиваем статью {article_id} из {url}")
+            return self.parse_article(self.fetch(url), article_id)
+        except Exception as e:
+            logger.error(f"Ошибка при скачивании статьи {article_id}: {e}")
+            return None
 
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Извлекаем основной контент
-            main_content = self.extract_main_content(soup, url)
-
-            if not main_content:
-                logger.warning(f"Не удалось извлечь контент для статьи {article_id}")
-                return None
+    def parse_article(self, response, article_id):
+        """Очищенный текст статьи из ответа сервера или None"""
+        soup = BeautifulSoup(response.content, 'html.parser')
 
-            # Конвертируем в чистый текст
-            html_content = str(main_content)
-            text_content = self.html_converter.handle(html_content)
-            clean_content = self.clean_text(text_content)
+        # Извлекаем основной контент
+        main_content = self.extract_main_content(soup, response.url)
 
-            # Проверяем, что контент достаточно большой
-            if len(clean_content) < 100:
-                logger.warning(f"Слишком короткий контент для статьи {article_id}")
-                return None
+        if not main_content:
+            logger.warning(f"Не удалось извлечь контент для статьи {article_id}")
+            return None
 
-            return clean_content
+        # Конвертируем в чистый текст
+        html_content = str(main_content)
+        text_content = self.html_converter.handle(html_content)
+        clean_content = self.clean_text(text_content)
 
-        except Exception as e:
-            logger.error(f"Ошибка при скачивании статьи {article_id}: {e}")
+        # Проверяем, что контент достаточно большой
+        if len(clean_content) < 100:
+            logger.warning(f"Слишком короткий контент для статьи {article_id}")
             return None
 
+        return clean_content
+
     def save_article(self, content, article_id, category):
         """Сохраняет статью в файл"""
         filename = f"{category}_{article_id}.txt"
@@ -125,50 +270,99 @@ class ArticleDownloader:
             logger.error(f"Ошибка при сохранении статьи {filename}: {e}")
             return False
 
-    def download_all_articles(self, delay=2):
-        """Скачивает все статьи из base_dataset.json"""
+    def sync_article(self, item, refresh=False):
+        """
+        Загружает одну статью с учётом кэша и возвращает статус:
+        new, changed, unchanged (текст тот же), not_modified (304), skipped (уже есть, refresh=False), failed
+        """
+        article_id = item['id']
+        category = item['category']
+        url = item['link']
+        filepath = os.path.join(self.articles_dir, f"{category}_{article_id}.txt")
+
+        exists = os.path.exists(filepath)
+        if exists and not refresh:
+            return 'skipped'
+
+        entry = self.cache.get(url) if exists else None
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            logger.info(f"Скачиваем статью {article_id} из {url}")
+            response = self.fetch(url, headers=headers)
+            if response.status_code == 304:
+                return 'not_modified'
+            content = self.parse_article(response, article_id)
+        except Exception as e:
+            logger.error(f"Ошибка при скачивании статьи {article_id}: {e}")
+            return 'failed'
+
+        if not content:
+            return 'failed'
+
+        digest = content_hash(content)
+        old_hash = entry.get('hash') if entry else None
+        if exists and old_hash is None:
+            # Статья скачана до появления кэша - сравниваем с сохранённым файлом
+            with open(filepath, 'r', encoding='utf-8') as f:
+                old_hash = content_hash(f.read())
+
+        self.cache.put(
+            url,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            hash=digest,
+            fetched_at=time.time()
+        )
+        if digest == old_hash:
+            return 'unchanged'
+        if not self.save_article(content, article_id, category):
+            return 'failed'
+        return 'changed' if exists else 'new'
+
+    def download_all_articles(self, delay=None, refresh=False):
+        """
+        Скачивает статьи из base_dataset.json в workers потоков.
+
+        Без refresh загружаются только отсутствующие статьи, с refresh уже скачанные проверяются
+        условным запросом. id новых и изменившихся статей записываются в reindex.json в state_dir
+        для переиндексации.
+
+        Args:
+            delay: Минимальный интервал между запросами к одному хосту (по умолчанию host_interval)
+            refresh: Проверить обновления уже скачанных статей
+        """
         # Загружаем базовый датасет
         with open(self.base_json_path, 'r', encoding='utf-8') as f:
             dataset = json.load(f)
+        rows = dataset['rows']
 
-        success_count = 0
-        fail_count = 0
-        skipped_count = 0
-
-        for item in dataset['rows']:
-            article_id = item['id']
-            category = item['category']
-            url = item['link']
-
-            # Проверяем, не скачана ли уже статья
-            filename = f"{category}_{article_id}.txt"
-            filepath = os.path.join(self.articles_dir, filename)
+        if delay is not None:
+            self.rate_limiter.min_interval = delay
 
-            if os.path.exists(filepath):
-                logger.info(f"Статья уже существует, пропускаем: {filename}")
-                skipped_count += 1
-                continue
-
-            # Скачиваем статью
-            content = self.download_article(url, article_id, category)
-
-            if content:
-                # Сохраняем статью
-                if self.save_article(content, article_id, category):
-                    success_count += 1
-                else:
-                    fail_count += 1
-            else:
-                fail_count += 1
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download') as pool:
+                statuses = list(pool.map(lambda item: self.sync_article(item, refresh), rows))
+        finally:
+            self.cache.save()
 
-            # Задержка между запросами
-            time.sleep(delay)
+        counts = Counter(statuses)
+        reindex = [item['id'] for item, status in zip(rows, statuses) if status in ('new', 'changed')]
+        with open(os.path.join(self.state_dir, 'reindex.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': reindex}, f)
 
         logger.info(f"\nИТОГИ СКАЧИВАНИЯ:")
-        logger.info(f"   Успешно: {success_count}")
-        logger.info(f"   Пропущено: {skipped_count}")
-        logger.info(f"   Ошибки: {fail_count}")
-        logger.info(f"   Всего: {len(dataset['rows'])}")
+        logger.info(f"   Новые: {counts['new']}")
+        logger.info(f"   Изменились: {counts['changed']}")
+        logger.info(f"   Не изменились: {counts['unchanged'] + counts['not_modified']}")
+        logger.info(f"   Пропущено: {counts['skipped']}")
+        logger.info(f"   Ошибки: {counts['failed']}")
+        logger.info(f"   Всего: {len(rows)}")
+        return {'counts': dict(counts), 'reindex': reindex}
 
     def check_download_status(self):
         """Проверяет статус скачивания статей"""
@@ -212,8 +406,9 @@ def main():
     # Спрашиваем пользователя
     choice = input("\nХотите скачать отсутствующие статьи? (y/n): ")
     if choice.lower() == 'y':
-        # Скачиваем все статьи
-        downloader.download_all_articles(delay=1)  # Задержка 1 секунда между запросами
+        refresh = input("Проверить обновления уже скачанных статей? (y/n): ").lower() == 'y'
+        # Не чаще одного запроса в секунду к каждому сайту
+        downloader.download_all_articles(delay=1, refresh=refresh)
 
         # Снова проверяем статус
         downloader.check_download_status()
@@ -0,0 +1,338 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, List, Optional
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class LLMUnavailable(Exception):
+    """Ни основная, ни резервная модель не ответили в срок (или обе отключены автоматом)"""
+
+
+class CircuitBreaker:
+    """
+    Автомат для отказывающего эндпоинта.
+
+    После failure_threshold ошибок подряд запросы не отправляются reset_timeout секунд,
+    затем пропускается один пробный запрос: успех закрывает автомат, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probe:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self._probe = False
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Обёртка над чат-моделью: дедлайн на запрос, повторы, хеджирование и резервная модель.
+
+    На весь ответ даётся deadline секунд. Основная модель получает их за вычетом fallback_reserve,
+    ошибки повторяются до retries раз с экспоненциальной задержкой и jitter. Если основная модель
+    не успевает (или отключена автоматом после серии ошибок), запрос уходит в резервную модель
+    с оставшимся временем. С hedge_percentile, если ответ основной модели не пришёл за этот
+    перцентиль недавних задержек, параллельно отправляется второй такой же запрос и берётся
+    первый ответ. В потоке дедлайн относится к первому токену, хеджирование не используется;
+    синхронный вызов не хеджируется.
+
+    Какая модель ответила, записывается в response_metadata["served_by"].
+    """
+
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+    deadline: float = 20.0
+    fallback_reserve: float = 5.0
+    retries: int = 2
+    backoff: float = 0.5
+    hedge_percentile: Optional[float] = None
+    hedge_min_samples: int = 20
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+    _breakers: Any = PrivateAttr(default=None)
+    _latencies: Any = PrivateAttr(default=None)
+    _stats: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default=None)
+    _executor: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        self._breakers = {
+            "primary": CircuitBreaker(self.failure_threshold, self.reset_timeout),
+            "fallback": CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        }
+        self._latencies = deque(maxlen=200)
+        self._stats = dict.fromkeys(("calls", "retries", "hedges", "hedge_wins", "fallbacks", "deadline", "failed"), 0)
+        self._lock = threading.Lock()
+        # Синхронные вызовы выполняются в потоках, чтобы не ждать модель дольше дедлайна
+        self._executor = ThreadPoolExecutor(thread_name_prefix="llm-call")
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat"
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["primary_circuit_trips"] = self._breakers["primary"].trips
+        stats["primary_circuit_open"] = int(self._breakers["primary"].state == "open")
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            stats["hedge_delay_seconds"] = round(hedge_delay, 3)
+        return stats
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            return float(np.percentile(self._latencies, self.hedge_percentile))
+
+    def _backoff_delay(self, attempt: int, remaining: float) -> float:
+        return max(0.0, min(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5), remaining))
+
+    def _primary_budget(self, end: float) -> float:
+        reserve = self.fallback_reserve if self.fallback is not None else 0.0
+        return end - time.monotonic() - reserve
+
+    def _succeeded(self, name: str, message, attempt: int, started: Optional[float] = None):
+        self._breakers[name].record_success()
+        if started is not None:
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+        if name == "fallback":
+            self._count("fallbacks")
+        message.response_metadata["served_by"] = name
+        message.response_metadata["attempts"] = attempt + 1
+        return message
+
+    def _failed(self, name: str, error: Exception):
+        self._breakers[name].record_failure()
+        if isinstance(error, (TimeoutError, FutureTimeoutError)):
+            self._count("deadline")
+
+    def _unavailable(self, error: Optional[Exception]) -> LLMUnavailable:
+        self._count("failed")
+        reason = f"{type(error).__name__}: {error}" if error is not None else "модель отключена после серии ошибок"
+        return LLMUnavailable(reason)
+
+    async def _ahedged(self, messages: List[BaseMessage], budget: float):
+        """Вызов основной модели; если ответ задерживается дольше перцентиля - второй параллельный запрос"""
+        first = asyncio.ensure_future(self.primary.ainvoke(messages))
+        pending = {first}
+        try:
+            delay = self._hedge_delay()
+            if delay is not None and delay < budget:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    pending.add(asyncio.ensure_future(self.primary.ainvoke(messages)))
+                    self._count("hedges")
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _arun(self, messages: List[BaseMessage]):
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        error = None
+        for attempt in range(self.retries + 1):
+            budget = self._primary_budget(end)
+            if budget <= 0 or not self._breakers["primary"].allow():
+                break
+            if attempt:
+                self._count("retries")
+            started = time.monotonic()
+            try:
+                message = await asyncio.wait_for(self._ahedged(messages, budget), budget)
+            except TimeoutError as e:
+                # Дедлайн под угрозой - сразу в резервную модель
+                self._failed("primary", e)
+                error = e
+                break
+            except Exception as e:
+                self._failed("primary", e)
+                error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(self._backoff_delay(attempt, self._primary_budget(end)))
+                continue
+            return self._succeeded("primary", message, attempt, started)
+
+        if self.fallback is not None and self._breakers["fallback"].allow():
+            try:
+                message = await asyncio.wait_for(self.fallback.ainvoke(messages), max(end - time.monotonic(), 0.0))
+                return self._succeeded("fallback", message, 0)
+            except Exception as e:
+                self._failed("fallback", e)
+                error = e
+        raise self._unavailable(error)
+
+    def _run(self, messages: List[BaseMessage]):
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        error = None
+        for attempt in range(self.retries + 1):
+            budget = self._primary_budget(end)
+            if budget <= 0 or not self._breakers["primary"].allow():
+                break
+            if attempt:
+                self._count("retries")
+            started = time.monotonic()
+            try:
+                message = self._executor.submit(self.primary.invoke, messages).result(timeout=budget)
+            except FutureTimeoutError as e:
+                self._failed("primary", e)
+                error = e
+                break
+            except Exception as e:
+                self._failed("primary", e)
+                error = e
+                if attempt < self.retries:
+                    time.sleep(self._backoff_delay(attempt, self._primary_budget(end)))
+                continue
+            return self._succeeded("primary", message, attempt, started)
+
+        if self.fallback is not None and self._breakers["fallback"].allow():
+            try:
+                message = self._executor.submit(self.fallback.invoke, messages).result(
+                    timeout=max(end - time.monotonic(), 0.0)
+                )
+                return self._succeeded("fallback", message, 0)
+            except Exception as e:
+                self._failed("fallback", e)
+                error = e
+        raise self._unavailable(error)
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._run(messages))])
+
+    async def _agenerate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=await self._arun(messages))])
+
+    async def _afirst_chunk(self, llm: BaseChatModel, messages: List[BaseMessage], budget: float):
+        stream = llm.astream(messages)
+        try:
+            return stream, await asyncio.wait_for(stream.__anext__(), budget)
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    async def _astream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager=None,
+            **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        error = None
+        stream = None
+        for attempt in range(self.retries + 1):
+            budget = self._primary_budget(end)
+            if budget <= 0 or not self._breakers["primary"].allow():
+                break
+            if attempt:
+                self._count("retries")
+            try:
+                stream, chunk = await self._afirst_chunk(self.primary, messages, budget)
+            except TimeoutError as e:
+                self._failed("primary", e)
+                error = e
+                break
+            except Exception as e:
+                self._failed("primary", e)
+                error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(self._backoff_delay(attempt, self._primary_budget(end)))
+                continue
+            chunk = self._succeeded("primary", chunk, attempt)
+            break
+
+        if stream is None and self.fallback is not None and self._breakers["fallback"].allow():
+            try:
+                stream, chunk = await self._afirst_chunk(self.fallback, messages, max(end - time.monotonic(), 0.0))
+                chunk = self._succeeded("fallback", chunk, 0)
+            except Exception as e:
+                self._failed("fallback", e)
+                error = e
+                stream = None
+
+        if stream is None:
+            raise self._unavailable(error)
+
+        # После первого токена поток дочитывается без ограничений
+        yield ChatGenerationChunk(message=chunk)
+        async for chunk in stream:
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,147 @@
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+import numpy as np
+
+from index_factory import IndexSpec
+from mmr import VectorMMR, normalize_rows
+
+
+class CategoryRouter:
+    """
+    Выбор категорий для запроса по ближайшим центроидам.
+
+    Близости запроса к центроидам переводятся в распределение (softmax с температурой),
+    категории берутся по убыванию вероятности, пока суммарная вероятность не достигнет confidence
+    или не наберётся max_shards. Если этого не хватило - запрос идёт в общий индекс.
+    """
+
+    def __init__(
+            self,
+            categories: List[str],
+            centroids: np.ndarray,
+            max_shards: int = 2,
+            confidence: float = 0.8,
+            temperature: float = 0.05
+    ):
+        self.categories = categories
+        self.centroids = normalize_rows(np.asarray(centroids, dtype=np.float32))
+        self.max_shards = max_shards
+        self.confidence = confidence
+        self.temperature = temperature
+
+    def probabilities(self, vector) -> np.ndarray:
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        logits = self.centroids @ query / self.temperature
+        logits -= logits.max()
+        probs = np.exp(logits)
+        return probs / probs.sum()
+
+    def route(self, vector) -> Optional[List[str]]:
+        """Категории для поиска или None, если уверенности недостаточно"""
+        probs = self.probabilities(vector)
+        chosen = []
+        mass = 0.0
+        for i in np.argsort(-probs)[:self.max_shards]:
+            chosen.append(self.categories[i])
+            mass += probs[i]
+            if mass >= self.confidence:
+                return chosen
+        return None
+
+
+class ShardedIndex:
+    """
+    Подындексы FAISS по категориям статей поверх общего store.
+
+    Векторы восстанавливаются из общего индекса, номера строк подындекса
+    отображаются обратно в номера общего индекса, документы берутся из общего docstore.
+    Категории, которым не хватает векторов для обучения IVF/PQ, получают точный flat-подындекс.
+    """
+
+    def __init__(self, db, spec: IndexSpec, mmr: Optional[VectorMMR] = None, **router_kwargs):
+        self.db = db
+        self.spec = spec
+        self.mmr = mmr or VectorMMR(db)
+
+        rows_by_category = defaultdict(list)
+        for row, doc_id in db.index_to_docstore_id.items():
+            category = db.docstore.search(doc_id).metadata.get("category")
+            rows_by_category[category].append(row)
+
+        self.shards = {}
+        categories, centroids = [], []
+        for category, rows in rows_by_category.items():
+            rows = np.array(sorted(rows), dtype=np.int64)
+            vectors = np.stack([db.index.reconstruct(int(r)) for r in rows])
+            shard_spec = spec if spec.can_train(len(rows)) else IndexSpec(metric=spec.metric)
+            index = shard_spec.create(vectors.shape[1], vectors)
+            index.add(vectors)
+            self.shards[category] = (index, rows)
+            categories.append(category)
+            centroids.append(normalize_rows(vectors).mean(axis=0))
+
+        self.router = CategoryRouter(categories, np.stack(centroids), **router_kwargs)
+        self.routed = 0
+        self.fallback = 0
+
+    def candidates(self, vector, categories: List[str], fetch_k: int):
+        """Лучшие fetch_k строк общего индекса из выбранных подындексов: (оценка, строка)"""
+        query = np.asarray([vector], dtype=np.float32)
+        found = []
+        for category in categories:
+            index, rows = self.shards[category]
+            scores, ids = index.search(query, min(fetch_k, len(rows)))
+            found.extend((score, rows[i]) for score, i in zip(scores[0], ids[0]) if i != -1)
+
+        # L2 - меньше лучше, скалярное произведение - больше лучше
+        found.sort(key=lambda item: -item[0] if self.spec.normalize else item[0])
+        return found[:fetch_k]
+
+    def max_marginal_relevance_search(
+            self,
+            vector,
+            k: int = 4,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5,
+            max_per_article: Optional[int] = None
+    ):
+        """
+        MMR-поиск в подындексах категорий, выбранных роутером.
+        Возвращает None, если роутер не уверен и нужен поиск по общему индексу.
+        """
+        categories = self.router.route(vector)
+        if categories is None:
+            self.fallback += 1
+            return None
+        self.routed += 1
+
+        found = self.candidates(vector, categories, fetch_k)
+        if not found:
+            return []
+
+        selected = self.mmr.select([vector], [[row for _, row in found]], [k], lambda_mult, max_per_article)[0]
+        return [self.db.docstore.search(self.db.index_to_docstore_id[row]) for row in selected]
+
+
+
+def retrieve_batch(
+        embeddings,
+        mmr: VectorMMR,
+        requests,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        max_per_article: Optional[int] = None
+) -> list:
+    """
+    Эмбеддинг и поиск для пакета (вопрос, k): вопросы кодируются одним проходом энкодера,
+    поиск по индексу и MMR - одним пакетом. Возвращает (vector, docs, timings) на каждый вопрос
+    """
+    started = time.perf_counter()
+    vectors = embeddings.embed_queries([question for question, _ in requests])
+    embedded = time.perf_counter()
+    docs = mmr.search(vectors, [k for _, k in requests], fetch_k, lambda_mult, max_per_article)
+    timings = {"embed": embedded - started, "retrieve": time.perf_counter() - embedded}
+    return [(vector, found, timings) for vector, found in zip(vectors, docs)]
@@ -0,0 +1,104 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Hashable, Optional
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Приблизительная оценка числа токенов: слова и знаки препинания.
+    Точный токенизатор Mistral не нужен - оценка используется только для бюджета истории.
+    """
+    return len(_TOKEN_RE.findall(text))
+
+
+class ChatSession:
+    """История одного диалога, ограниченная бюджетом токенов"""
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.turns = deque()
+        self.tokens = 0
+        self.last_access = time.monotonic()
+
+    def add_turn(self, question: str, answer: str):
+        """Добавляет реплику и удаляет самые старые, пока история не уложится в бюджет"""
+        turn = f"Human: {question}\nAI: {answer}"
+        size = estimate_tokens(turn)
+        self.turns.append((turn, size))
+        self.tokens += size
+
+        while self.tokens > self.max_tokens and self.turns:
+            _, dropped = self.turns.popleft()
+            self.tokens -= dropped
+
+    def history(self) -> str:
+        """История в формате ConversationBufferMemory"""
+        return "\n".join(turn for turn, _ in self.turns)
+
+
+class SessionStore:
+    """
+    Хранилище диалогов по id чата.
+
+    Число живых сессий ограничено max_sessions (вытесняется давно неактивная, LRU),
+    сессии без активности дольше ttl секунд удаляются.
+    """
+
+    def __init__(
+            self,
+            max_sessions: int = 1000,
+            ttl: Optional[float] = 3600,
+            max_history_tokens: int = 1024
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history_tokens = max_history_tokens
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            # Сессии упорядочены по времени последнего обращения
+            while self._sessions:
+                session = next(iter(self._sessions.values()))
+                if now - session.last_access <= self.ttl:
+                    break
+                self._sessions.popitem(last=False)
+
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _get(self, session_id: Hashable, create: bool = True) -> Optional[ChatSession]:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = ChatSession(self.max_history_tokens)
+            self._sessions[session_id] = session
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_access = now
+        self._evict(now)
+        return session
+
+    def history(self, session_id: Hashable) -> str:
+        """История диалога; для неизвестного id - пустая, без создания сессии (иначе она вытесняла бы живые)"""
+        with self._lock:
+            session = self._get(session_id, create=False)
+            return session.history() if session is not None else ""
+
+    def save(self, session_id: Hashable, question: str, answer: str):
+        with self._lock:
+            self._get(session_id).add_turn(question, answer)
+
+    def clear(self, session_id: Hashable):
+        with self._lock:
+            self._sessions.pop(session_id, None)
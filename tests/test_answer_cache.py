@@ -0,0 +1,79 @@
+"""
+Сброс семантического кэша ответов после изменения индекса.
+
+Запуск из корня проекта:
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from answer_cache import SemanticAnswerCache
+
+QUESTION = "Как справиться с тревогой?"
+
+
+def _article(article_id: int, category: str, text: str) -> dict:
+    return {
+        "id": article_id,
+        "name": f"Статья {article_id}",
+        "link": f"https://example.org/{article_id}",
+        "date": "01-01-2025",
+        "category": category,
+        "text": text
+    }
+
+
+def test_invalidate_drops_entries_citing_stale_chunks():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=None)
+    cache.store(np.array([1.0, 0.0]), ["1:0", "2:0"], {"title": "a"}, latency=1.0)
+    cache.store(np.array([0.0, 1.0]), ["3:0"], {"title": "b"}, latency=1.0)
+
+    assert cache.invalidate(["2:0"]) == 1
+    assert cache.lookup(np.array([1.0, 0.0])) is None
+    assert cache.lookup(np.array([0.0, 1.0])) == {"title": "b"}
+
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_upsert_invalidates_cached_answer(tmp_path):
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from eval.fake_llm import FakeChatModel
+    from model import PsychologistRAG
+
+    rows = [
+        _article(1, "anxiety", "Тревога - естественная реакция на неопределённость. Помогает дыхание."),
+        _article(2, "stress", "Стресс снижают сон, прогулки и разговор с близкими людьми.")
+    ]
+    dataset_path = tmp_path / "dataset.jsonl"
+    dataset_path.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in rows), encoding="utf-8")
+
+    bot = PsychologistRAG(
+        faiss_path=str(tmp_path / "faiss_index"),
+        embedding_cache_dir=str(tmp_path / "embedding_cache"),
+        encoder=DeterministicFakeEmbedding(size=32),
+        llm=FakeChatModel(latency=0),
+        llm_deadline=0,
+        lazy=True
+    )
+    bot.vectorize_dataset(str(dataset_path), workers=0)
+    # Кэш используется только без истории диалога - у каждого вопроса своя сессия
+    bot.ask(QUESTION, session_id="first")
+    bot.ask(QUESTION, session_id="second")
+    assert bot.answer_cache.metrics()["hits"] == 1
+
+    rows[0]["text"] = "Тревогу уменьшают регулярные физические упражнения и режим дня."
+    assert bot.upsert_articles(rows)["updated"] == 1
+    assert len(bot.answer_cache) == 0
+
+    misses = bot.answer_cache.metrics()["misses"]
+    bot.ask(QUESTION, session_id="third")
+    assert bot.answer_cache.metrics()["misses"] == misses + 1
@@ -0,0 +1,45 @@
+"""
+Дисковый кэш эмбеддингов после прерванной записи.
+
+Запуск из корня проекта:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from embedding_cache import EmbeddingCache
+
+DIM = 4
+
+
+def _cache(cache_dir) -> EmbeddingCache:
+    return EmbeddingCache(str(cache_dir), "fake", chunk_size=500, chunk_overlap=50)
+
+
+def test_partial_tail_does_not_shift_new_rows(tmp_path):
+    first = np.arange(2 * DIM, dtype=np.float32).reshape(2, DIM)
+    cache = _cache(tmp_path)
+    cache.put_many(["a", "b"], first)
+    cache.flush()
+
+    # Прерванный запуск: целая строка без записи в индекс и недописанная строка
+    with open(cache._vectors_path, "ab") as f:
+        f.write(np.ones(DIM, dtype=np.float32).tobytes())
+        f.write(b"\x00" * 6)
+
+    second = np.full((1, DIM), 7.0, dtype=np.float32)
+    cache = _cache(tmp_path)
+    cache.put_many(["c"], second)
+    cache.flush()
+
+    cache = _cache(tmp_path)
+    a, b, c = cache.get_many(["a", "b", "c"])
+    assert np.array_equal(a, first[0]) and np.array_equal(b, first[1])
+    assert np.array_equal(c, second[0])
+    assert os.path.getsize(cache._vectors_path) == 3 * DIM * 4
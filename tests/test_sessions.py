@@ -0,0 +1,27 @@
+"""
+Хранилище диалогов: чтение истории неизвестного чата не вытесняет живые сессии.
+
+Запуск из корня проекта:
+    python -m pytest tests
+"""
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sessions import SessionStore
+
+
+def test_history_of_unknown_session_does_not_evict():
+    store = SessionStore(max_sessions=2, ttl=None)
+    store.save("a", "Вопрос", "Ответ")
+    store.save("b", "Вопрос", "Ответ")
+
+    for session_id in range(10):
+        assert store.history(session_id) == ""
+
+    assert len(store) == 2
+    assert "Human: Вопрос" in store.history("a")
+    assert "Human: Вопрос" in store.history("b")
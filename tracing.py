@@ -0,0 +1,216 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger("psychrag")
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: Optional[dict] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Счётчики и гистограммы в памяти процесса с выгрузкой в текстовом формате Prometheus.
+
+    При enabled=False trace() возвращает пустую трассировку, и запросы не платят за замеры.
+    """
+
+    def __init__(self, enabled: bool = True, prefix: str = "psychrag"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=TIME_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, float]]):
+        """Источник значений, которые считываются в момент выгрузки (например, метрики кэша)"""
+        self._collectors[name] = collector
+
+    def trace(self, **attrs) -> "Trace":
+        return Trace(self, attrs) if self.enabled else NULL_TRACE
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {
+                name + _format_labels(labels): value
+                for (name, labels), value in self._counters.items()
+            }
+            histograms = {
+                name + _format_labels(labels): {"count": h.count, "sum": round(h.sum, 6)}
+                for (name, labels), h in self._histograms.items()
+            }
+        gauges = {
+            f"{name}_{key}": value
+            for name, collector in self._collectors.items()
+            for key, value in collector().items()
+        }
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def render(self) -> str:
+        """Текст для /metrics в формате Prometheus"""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{self.prefix}_{name}{_format_labels(labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                full_name = f"{self.prefix}_{name}"
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels, {'le': '+Inf'})} {h.count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {h.sum}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {h.count}")
+        for name, collector in sorted(self._collectors.items()):
+            for key, value in sorted(collector().items()):
+                lines.append(f"{self.prefix}_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Замеры одного запроса: длительности этапов и атрибуты, в конце - одна строка структурированного лога"""
+
+    def __init__(self, metrics: Metrics, attrs: dict):
+        self.metrics = metrics
+        self.attrs = dict(attrs)
+        self.stages = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.metrics.observe("stage_seconds", seconds, stage=name)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def usage(self, message):
+        """Токены промпта и ответа из usage_metadata ответа LLM и модель, которая ответила"""
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage:
+            self.set(prompt_tokens=usage.get("input_tokens", 0), completion_tokens=usage.get("output_tokens", 0))
+            self.metrics.inc("prompt_tokens_total", usage.get("input_tokens", 0))
+            self.metrics.inc("completion_tokens_total", usage.get("output_tokens", 0))
+        served_by = (getattr(message, "response_metadata", None) or {}).get("served_by")
+        if served_by:
+            self.set(llm_served_by=served_by)
+            self.metrics.inc("llm_responses_total", served_by=served_by)
+
+    def finish(self, outcome: str):
+        total = time.perf_counter() - self._started
+        self.metrics.inc("requests_total", outcome=outcome)
+        self.metrics.observe("request_seconds", total)
+        for key in ("context_tokens", "context_tokens_before", "retrieved_chunks"):
+            if key in self.attrs:
+                self.metrics.observe(key, self.attrs[key], buckets=SIZE_BUCKETS)
+
+        logger.info(json.dumps(
+            {
+                "event": "rag_request",
+                "outcome": outcome,
+                "total_ms": round(total * 1000, 2),
+                "stages_ms": {name: round(value * 1000, 2) for name, value in self.stages.items()},
+                **self.attrs
+            },
+            ensure_ascii=False,
+            default=str
+        ))
+
+
+class _NullTrace:
+    """Трассировка-заглушка для выключенных метрик"""
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def record(self, name: str, seconds: float):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def usage(self, message):
+        pass
+
+    def finish(self, outcome: str):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def start_metrics_server(metrics: Metrics, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Поднимает /metrics в фоновом потоке"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional
+
+from retrieval import retrieve_batch
+
+_worker = None
+
+
+def _init_worker(
+        faiss_path: str,
+        encoder,
+        threads: int,
+        fetch_k: int,
+        lambda_mult: float,
+        query_cache_size: int,
+        max_per_article: Optional[int]
+):
+    """
+    Каждый процесс загружает свою копию энкодера, а индекс и фрагменты отображает в память:
+    страницы файлов общие для всех процессов, корпус не копируется.
+    """
+    global _worker
+    # До загрузки энкодера, чтобы процессы не делили ядра между собой
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import faiss
+
+    from chunk_store import load_store
+    from embedding_cache import CachedEmbeddings
+    from encoders import LazyEmbeddings, get_encoder
+    from extractive import ExtractiveAnswerer
+    from index_factory import IndexSpec
+    from indexing import IndexManifest
+    from mmr import VectorMMR
+
+    faiss.omp_set_num_threads(threads)
+    if encoder is None or isinstance(encoder, str):
+        encoder = get_encoder(encoder)
+    if isinstance(encoder, LazyEmbeddings):
+        encoder.load()
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+    manifest = IndexManifest.load(faiss_path)
+    spec = manifest.index_spec if manifest is not None else IndexSpec()
+    embeddings = CachedEmbeddings(encoder, query_cache_size=query_cache_size, normalize=spec.normalize)
+    db = load_store(faiss_path, embeddings, spec)
+    spec.configure(db.index)
+    _worker = (embeddings, VectorMMR(db), fetch_k, lambda_mult, max_per_article, ExtractiveAnswerer(encoder))
+
+
+def _retrieve_batch(requests):
+    embeddings, mmr, fetch_k, lambda_mult, max_per_article, _ = _worker
+    return retrieve_batch(embeddings, mmr, requests, fetch_k, lambda_mult, max_per_article)
+
+
+def _extractive_answer(vector, docs) -> dict:
+    return _worker[-1].answer(vector, docs)
+
+
+def _ping(delay: float) -> int:
+    time.sleep(delay)
+    return os.getpid()
+
+
+class RetrievalPool(Executor):
+    """
+    Пул процессов для эмбеддинга вопросов и поиска по индексу.
+
+    Из-за GIL процесс бота использует для энкодера и MMR примерно одно ядро; пул разносит эту
+    работу по processes процессам, а в процессе бота остаются LLM и Telegram. Ответы из фрагментов
+    без LLM (extractive_answer) тоже собираются в пуле: энкодер в процессе бота не загружается. Индекс должен быть
+    сохранён в формате chunk_store (загрузка через mmap). После пересохранения индекса пул
+    перезапускается через restart(), чтобы процессы отобразили новые файлы.
+    Процессы запускаются через spawn и заново импортируют модуль точки входа, поэтому тот
+    не должен запускать работу при импорте (в bot.py опрос Telegram стартует только под __main__).
+
+    Args:
+        faiss_path: Путь к индексу
+        processes: Число процессов
+        encoder: Бэкенд энкодера (None - как в EMBEDDINGS_BACKEND) или сериализуемый объект Embeddings
+        threads: Потоков энкодера и FAISS в каждом процессе
+        fetch_k, lambda_mult: Параметры MMR
+        query_cache_size: Размер LRU-кэша эмбеддингов вопросов в каждом процессе
+        max_chunks_per_article: Не больше стольких фрагментов одной статьи в выдаче
+    """
+
+    # Функция для MicroBatcher: выполняется в процессе пула
+    retrieve_batch = staticmethod(_retrieve_batch)
+    # extractive.ExtractiveAnswerer.answer(vector, docs) в процессе пула
+    extractive_answer = staticmethod(_extractive_answer)
+
+    def __init__(
+            self,
+            faiss_path: str,
+            processes: int = 2,
+            encoder=None,
+            threads: int = 1,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5,
+            query_cache_size: int = 256,
+            max_chunks_per_article: Optional[int] = None
+    ):
+        self.processes = processes
+        self._initargs = (
+            os.path.abspath(faiss_path),
+            encoder,
+            threads,
+            fetch_k,
+            lambda_mult,
+            query_cache_size,
+            max_chunks_per_article
+        )
+        self._executor = self._create()
+
+    def _create(self) -> ProcessPoolExecutor:
+        # spawn вместо fork: потоки OpenMP и энкодера родителя не переживают fork
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=self._initargs
+        )
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def warmup(self) -> List[int]:
+        """Запускает все процессы (каждый загружает энкодер и индекс). Возвращает их pid"""
+        futures = [self._executor.submit(_ping, 0.2) for _ in range(self.processes)]
+        return sorted({f.result() for f in futures})
+
+    def restart(self):
+        """Новые процессы для нового индекса; задачи, уже отправленные в старые, завершаются"""
+        old, self._executor = self._executor, self._create()
+        old.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)